@@ -0,0 +1,208 @@
+"""
+Join several headers into one toast input, and split toast's Nim output back
+into one piece per header.
+
+Toast groups its output into sections (`const`, `type`, ...) and top-level
+statements such as procs, so a single positional marker cannot separate the
+files. Instead every boundary gets a marker in each of the shapes toast emits:
+a `#define` (const section), a `typedef` (type section) and a prototype (proc).
+Within each kind of output, declarations keep their source order, so the
+markers of a kind partition that kind's entries between the files.
+
+Files in a directory may include each other, and each file's macros would
+otherwise stay defined for the files after it. At every boundary, the macros
+that the files so far define, include guards among them, are undefined, so
+each file is read as if alone. A file whose guard cannot be undefined, as
+with `#pragma once`, comes out empty when a file before it includes it.
+
+A split is rejected with `SplitError` whenever the markers of an output kind
+are missing or out of order, or a file that declares something comes out
+empty, and callers fall back to running files one by one.
+"""
+
+import secrets
+
+import regex as re
+
+
+_section_regex = re.compile(r'(const|type|var|let)\s*(\#.*)?')
+
+_define_regex = re.compile(r'^[ \t]*\#[ \t]*define[ \t]+(\w+)', re.MULTILINE)
+
+# A line of code, or a macro definition, which toast emits as a constant.
+# Lines starting a comment, or continuing one with `*`, are not code; these
+# are matched line by line, as lexing whole headers would cost more than
+# the batching saves.
+_declaration_regex = re.compile(r'^[ \t]*(?:\#[ \t]*define\b|[^\#\s/*])', re.MULTILINE)
+
+
+class SplitError(Exception):
+    pass
+
+
+def new_token():
+    return secrets.token_hex(4)
+
+
+def marker_name(token, index):
+    return f'DeprocessorMarker{token}x{index}'
+
+
+def declares(data):
+    """
+    Whether toast is expected to emit anything for header contents `data`:
+    whether it has a line of code or a `#define`.
+    """
+    return _declaration_regex.search(data) is not None
+
+
+def join_headers(token, datas):
+    """
+    Concatenate header contents, with boundary markers in front of every file
+    but the first, and the macros defined by the files up to each boundary
+    undefined there.
+    """
+    parts = []
+    defined = {}
+    for index, data in enumerate(datas):
+        defined.update(dict.fromkeys(_define_regex.findall(data)))
+        if index:
+            name = marker_name(token, index)
+            parts.append('\n')
+            parts.extend(f'#undef {macro}\n' for macro in defined)
+            parts.append(
+                f'#define {name} {index}\n'
+                f'typedef int {name}Type;\n'
+                f'void {name}Proc(void);\n'
+            )
+
+        parts.append(data)
+        if not data.endswith('\n'):
+            parts.append('\n')
+
+    return ''.join(parts)
+
+
+def _items(lines):
+    """
+    Break Nim output into items: `[kind, section_id, header, lines]`, where
+    `kind` is a section name for section entries and 'top' for everything at
+    the top level.
+    """
+    items = []
+    section = None
+    section_id = 0
+    header = None
+    entry_indent = None
+
+    for line in lines:
+        stripped = line.strip()
+        indent = len(line) - len(line.lstrip())
+
+        if not stripped:
+            if items:
+                items[-1][3].append(line)
+            continue
+
+        if indent == 0:
+            match = _section_regex.fullmatch(stripped)
+            if match:
+                section = match[1]
+                section_id += 1
+                header = line
+                entry_indent = None
+            else:
+                section = None
+                items.append(['top', 0, None, [line]])
+            continue
+
+        if section is not None:
+            if entry_indent is None:
+                entry_indent = indent
+            if indent <= entry_indent:
+                items.append([section, section_id, header, [line]])
+                continue
+
+        if items:
+            items[-1][3].append(line)
+        else:
+            items.append(['top', 0, None, [line]])
+
+    return items
+
+
+def _common_affixes(lines, empty_lines):
+    """
+    Find the prologue and epilogue toast emits even for an empty input, as
+    the longest split of `empty_lines` that frames `lines`.
+    """
+    for split in range(len(empty_lines), -1, -1):
+        prologue = empty_lines[:split]
+        epilogue = empty_lines[split:]
+        if (lines[:len(prologue)] == prologue
+                and (not epilogue or lines[-len(epilogue):] == epilogue)
+                and len(prologue) + len(epilogue) <= len(lines)):
+            return prologue, epilogue
+
+    return [], []
+
+
+def split_output(token, count, output, empty_output='', declared=None):
+    """
+    Split the Nim `output` of an amalgamated header built by `join_headers`
+    into `count` pieces. `empty_output` is toast's output for an empty header;
+    it is stripped from the joined output and repeated in every piece.
+    `declared`, if given, says which files must not come out empty, as
+    `declares` would.
+    """
+    lines = output.splitlines(keepends=True)
+    prologue, epilogue = _common_affixes(lines, empty_output.splitlines(keepends=True))
+    body = lines[len(prologue):len(lines) - len(epilogue)]
+
+    marker_regex = re.compile(rf'\b{marker_name(token, "")}(\d+)')
+
+    # Assign each item to a file by the markers seen so far for its kind
+    current = {}
+    has_content = set()
+    assigned = []
+    for item in _items(body):
+        kind = item[0]
+        match = marker_regex.search(''.join(item[3]))
+        if match:
+            index = int(match[1])
+            if index != current.get(kind, 0) + 1:
+                raise SplitError(f"Marker {index} out of order in {kind} output")
+            current[kind] = index
+            continue
+
+        has_content.add(kind)
+        assigned.append((current.get(kind, 0), item))
+
+    for kind in has_content:
+        if current.get(kind, 0) != count - 1:
+            raise SplitError(f"Missing markers in {kind} output")
+
+    # A file that declares something but got nothing was most likely hidden by
+    # a file before it, which included it
+    filled = {file_index for file_index, _ in assigned}
+    for index, expected in enumerate(declared or ()):
+        if expected and index not in filled:
+            raise SplitError(f"File {index} of {count} came out empty")
+
+    # Rebuild each file's output, re-opening sections as needed
+    pieces = []
+    for index in range(count):
+        piece = list(prologue)
+        open_section = None
+        for file_index, (kind, section_id, header, item_lines) in assigned:
+            if file_index != index:
+                continue
+            if header is not None and section_id != open_section:
+                piece.append(header)
+            open_section = section_id if header is not None else None
+            piece.extend(item_lines)
+
+        piece.extend(epilogue)
+        pieces.append(''.join(piece))
+
+    return pieces
@@ -0,0 +1,184 @@
+"""
+Benchmarks comparing ways of running the pipeline over the same corpus.
+
+Memory is measured as the peak resident set size of this process plus all of
+its live `multiprocessing` children, sampled from `/proc` while the benchmark
+runs. Where the kernel provides it, the proportional set size is used instead,
+so pages forked workers share with their parent are only counted once. Where
+`/proc` is not available, RSS is reported as unknown.
+"""
+
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+from functools import partial
+
+from .executors import EXECUTORS, make_pool, can_fork, call_preloaded, call_star
+from .memory import read_rss
+
+
+class RSSSampler():
+    """
+    Track the peak combined RSS of this process and its children, from a
+    background thread, for the duration of a `with` block.
+    """
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        pids = ['self'] + [child.pid for child in multiprocessing.active_children()]
+        sizes = [read_rss(pid) for pid in pids]
+        if sizes[0] is None:
+            return
+
+        total = sum(size for size in sizes if size is not None)
+        if self.peak is None or total > self.peak:
+            self.peak = total
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.sample()
+        self._stop.set()
+        self._thread.join()
+
+
+def corpus_size(paths):
+    total = 0
+    for path in paths:
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            pass
+    return total
+
+
+def compare_executors(task_worker, tasks, processes, file_count, byte_count, dsl, executors=EXECUTORS):
+    """
+    Run `task_worker(*task)` for each of `tasks` once under each executor,
+    and return one result dict per executor. Every task starts with `dsl`.
+    `tasks` must be a list, since it is reused for every run.
+    """
+    results = []
+    for executor in executors:
+        if executor == 'fork' and not can_fork():
+            continue
+
+        if executor == 'fork':
+            run_task = partial(call_preloaded, task_worker)
+            run_tasks = [task[1:] for task in tasks]
+        else:
+            run_task = partial(call_star, task_worker)
+            run_tasks = tasks
+
+        with RSSSampler() as sampler:
+            start = time.perf_counter()
+            pool = make_pool(executor, processes, dsl)
+            try:
+                pool.map(run_task, run_tasks)
+                pool.close()
+            except BaseException:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+            seconds = time.perf_counter() - start
+
+        results.append({
+            'executor'        : executor,
+            'processes'       : processes,
+            'seconds'         : seconds,
+            'files_per_second': file_count / seconds if seconds else 0.0,
+            'mb_per_second'   : byte_count / seconds / 1e6 if seconds else 0.0,
+            'peak_rss'        : sampler.peak,
+        })
+
+    return results
+
+
+def format_results(results):
+    lines = [f'{"executor":<10} {"seconds":>9} {"files/s":>10} {"MB/s":>8} {"peak RSS":>10}']
+    for result in results:
+        rss = result['peak_rss']
+        rss_text = 'unknown' if rss is None else f'{rss / 1e6:.1f} MB'
+        lines.append(
+            f'{result["executor"]:<10} '
+            f'{result["seconds"]:>9.2f} '
+            f'{result["files_per_second"]:>10.1f} '
+            f'{result["mb_per_second"]:>8.2f} '
+            f'{rss_text:>10}'
+        )
+
+    return '\n'.join(lines)
+
+
+def startup_time(repeat=5):
+    """
+    Return the best wall time, over `repeat` runs, of importing the CLI and
+    printing its help in a fresh interpreter.
+    """
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, '-m', 'deprocessor', '--help'],
+            cwd    = package_parent,
+            stdout = subprocess.DEVNULL,
+            check  = True,
+        )
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best:
+            best = seconds
+
+    return best
+
+
+def template_overhead(matches=200000, repeat=3):
+    """
+    Time a match-heavy substitution with the WITH clause applied in
+    different ways, and return `(label, nanoseconds per match)` rows.
+    """
+    import regex as re
+    from .templates import compile_template
+
+    text = 'FooIsNimProc bar\n' * matches
+    regex = re.compile(r'IsNimProc (\b)', re.MULTILINE | re.VERBOSE)
+
+    template = compile_template('$1')
+    cases = [
+        ('$1, expanded per match',         lambda m: m.expand(r'\1')),
+        ('$1, template called per match',  template),
+        ('$1, template expanded natively', template.native),
+        ('literal, expanded per match',    lambda m: m.expand('Proc')),
+        ('literal, compiled to a string',  compile_template('Proc')),
+    ]
+
+    rows = []
+    for label, repl in cases:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            _, count = regex.subn(repl, text, concurrent=True)
+            seconds = time.perf_counter() - start
+            if best is None or seconds < best:
+                best = seconds
+
+        rows.append((label, best / count * 1e9))
+
+    return rows
@@ -0,0 +1,181 @@
+"""
+A content-addressed cache for external tool invocations.
+
+Entries are keyed on the identity of the tool binary, the tool's arguments
+(excluding output paths) and the bytes fed to it, so near-duplicate headers
+that end up byte-identical after the pre-replacement stage only pay for one
+tool run. The bytes fed to it include the headers a header includes from
+beside it (see `steps.read_includes`), but not system headers or headers
+found on the include path, which are assumed not to change between runs.
+
+Entries are single files written atomically, which makes the cache safe to
+share between pool workers.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+
+
+class ToolCache():
+    # How many stores a process makes before re-measuring the cache size
+    rescan_interval = 64
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self._identities = {}
+        self._estimated_size = None
+        self._stores = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self):
+        # Identities and size estimates are per-process
+        return dict(directory=self.directory, max_bytes=self.max_bytes)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    # ## Keys ## #
+    def tool_identity(self, tool):
+        identity = self._identities.get(tool)
+        if identity is None:
+            resolved = shutil.which(tool) or tool
+            try:
+                info = os.stat(resolved)
+                identity = f'{os.path.abspath(resolved)}:{info.st_size}:{info.st_mtime_ns}'
+            except OSError:
+                identity = resolved
+
+            self._identities[tool] = identity
+
+        return identity
+
+    def key(self, tool, args, inputs):
+        """
+        Hash a tool invocation. `args` should not contain output paths, and
+        `inputs` is an iterable of the str/bytes data the tool reads.
+        """
+        digest = hashlib.sha256()
+
+        def feed(data):
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            digest.update(len(data).to_bytes(8, 'little'))
+            digest.update(data)
+
+        feed(self.tool_identity(tool))
+        feed(json.dumps(list(args)))
+        for data in inputs:
+            feed(data)
+
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    # ## Access ## #
+    def get(self, key):
+        """
+        Return `(CompletedProcess, output)` for a cached invocation, or None.
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'r') as fh:
+                entry = json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+        # Refresh the entry's age for eviction purposes
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+        result = subprocess.CompletedProcess(
+            args       = entry['args'],
+            returncode = entry['returncode'],
+            stdout     = entry['stdout'],
+            stderr     = entry['stderr'],
+        )
+        return result, entry['output']
+
+    def put(self, key, result, output=None):
+        entry = dict(
+            args       = list(result.args),
+            returncode = result.returncode,
+            stdout     = result.stdout,
+            stderr     = result.stderr,
+            output     = output,
+        )
+
+        entry_path = self._entry_path(key)
+        entry_dir = os.path.dirname(entry_path)
+        os.makedirs(entry_dir, exist_ok=True)
+
+        # Write to a temporary file first, so that concurrent readers never
+        # see a partial entry.
+        fd, temp_path = tempfile.mkstemp(dir=entry_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(entry, fh)
+            size = os.path.getsize(temp_path)
+            os.replace(temp_path, entry_path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+        self._account(size)
+
+    # ## Eviction ## #
+    def _entries(self):
+        for dir_entry in os.scandir(self.directory):
+            if not dir_entry.is_dir():
+                continue
+            for entry in os.scandir(dir_entry.path):
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    info = entry.stat()
+                except OSError:
+                    continue
+                yield entry.path, info.st_size, info.st_mtime
+
+    def _account(self, size):
+        self._stores += 1
+        if self._estimated_size is None or self._stores % self.rescan_interval == 0:
+            self._estimated_size = sum(size for _, size, _ in self._entries())
+        else:
+            self._estimated_size += size
+
+        if self._estimated_size > self.max_bytes:
+            self.evict()
+
+    def evict(self, target_fraction=0.9):
+        """
+        Remove the least recently used entries until the cache is below
+        `target_fraction` of its maximum size.
+        """
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * target_fraction
+
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Another worker got there first
+                pass
+            total -= size
+
+        self._estimated_size = total
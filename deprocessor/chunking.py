@@ -0,0 +1,97 @@
+"""
+Parallel substitution over pieces of a single large file.
+
+Line-local rules (see `regexes.is_line_local`) give the same result over a
+file split at line ends as over the whole file, so a large file can be cut
+into chunks that threads rewrite at the same time. Matching runs with
+`concurrent=True`, which lets the `regex` module release the GIL.
+"""
+
+
+def _inside_comment(data, position):
+    return data.rfind('/*', 0, position) > data.rfind('*/', 0, position)
+
+
+def find_boundary(data, position, window):
+    """
+    Find a chunk boundary at or after `position`. Prefer the start of a blank
+    line outside comments and macro continuations; fall back to the next line
+    start. Returns None if the rest of the file is a single line.
+    """
+    limit = min(len(data), position + window)
+    candidate = data.find('\n\n', position, limit)
+    while candidate >= 0:
+        if data[candidate - 1:candidate] != '\\' and not _inside_comment(data, candidate):
+            return candidate + 1
+        candidate = data.find('\n\n', candidate + 1, limit)
+
+    candidate = data.find('\n', position)
+    if candidate < 0 or candidate + 1 >= len(data):
+        return None
+    return candidate + 1
+
+
+def split_chunks(data, chunk_size):
+    """
+    Split `data` into pieces of roughly `chunk_size` characters, each ending
+    at a line end.
+    """
+    chunks = []
+    start = 0
+    while len(data) - start > chunk_size:
+        boundary = find_boundary(data, start + chunk_size, chunk_size // 2)
+        if boundary is None:
+            break
+        chunks.append(data[start:boundary])
+        start = boundary
+
+    chunks.append(data[start:])
+    return chunks
+
+
+def sub_chunk(regex, repl, chunk, final, context=''):
+    """
+    `regex.subn(repl, chunk)`, except that an empty match at the very end of
+    a non-final chunk is left for the start of the next chunk, which is the
+    same position in the file. `context` is the text before the chunk, which
+    lookbehinds may see but matches never include.
+    """
+    text = context + chunk if context else chunk
+    offset = len(context)
+
+    pieces = []
+    last = offset
+    count = 0
+    for match in regex.finditer(text, pos=offset, concurrent=True):
+        start, end = match.span()
+        if start == end == len(text) and not final:
+            break
+        pieces.append(text[last:start])
+        pieces.append(repl(match))
+        last = end
+        count += 1
+
+    if not count:
+        return chunk, 0
+
+    pieces.append(text[last:])
+    return ''.join(pieces), count
+
+
+def sub_chunks(executor, rules, chunks):
+    """
+    Apply `(regex, repl)` rules in order to every chunk, one thread per chunk.
+    Returns the rewritten chunks and the match count of each rule.
+    """
+    def run(index):
+        chunk = chunks[index]
+        final = index == len(chunks) - 1
+        counts = []
+        for regex, repl in rules:
+            chunk, count = sub_chunk(regex, repl, chunk, final)
+            counts.append(count)
+        return chunk, counts
+
+    results = list(executor.map(run, range(len(chunks))))
+    counts = [sum(c) for c in zip(*(counts for _, counts in results))]
+    return [chunk for chunk, _ in results], counts
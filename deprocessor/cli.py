@@ -0,0 +1,1167 @@
+"""
+Command line interface, run as `python -m deprocessor <command>`.
+
+Only the standard library is imported up front. Each command imports the
+pipeline modules it needs, and the DSL grammar and rules are compiled on first
+use, so `--help` and other short invocations start quickly.
+"""
+
+import argparse
+import os
+
+
+DEFAULT_DSL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'default.dsl')
+
+# Mirrors executors.EXECUTORS, which would pull in multiprocessing
+EXECUTORS = ('process', 'thread', 'fork')
+
+
+# ## Shared helpers ## #
+def load_dsl(args, compile=True, fold=True):
+    from .dsl import DSL
+    from .telemetry import log
+
+    with open(args.dsl, 'r') as fh:
+        text = fh.read()
+
+    # Folded rules share one match count, so reports that count matches per
+    # rule turn folding off
+    dsl = DSL(text, optimize=not args.no_optimize, fold=fold)
+    for optimization in dsl.optimizations:
+        log.info("%s", optimization)
+
+    if compile:
+        dsl.compile()
+    return dsl
+
+
+def chunk_paths(path_list, chunk_size):
+    return [
+        path_list[i:i + chunk_size]
+        for i in range(0, len(path_list), chunk_size)
+    ]
+
+
+def run_pool(args, dsl, path_chunks, tasks, task_worker, total, final_stage, log_handler, store=None):
+    """
+    Run `task_worker(*task)` over `tasks` in a pool of the kind chosen by
+    `--executor`, with live progress. Every task starts with the DSL and
+    the chunk of paths it covers. With a `sinks.PackedStore`, workers send
+    their output to a writer process for it. Returns the workers' results, or
+    None when the run was interrupted.
+    """
+    import multiprocessing
+    from functools import partial
+
+    from . import memory, profiling, telemetry
+    from .executors import IPCMeter, make_pool, make_event_queue, can_fork, call_preloaded, call_star
+    from .sinks import StoreWriter
+
+    log = telemetry.log
+
+    executor = args.executor
+    if executor == 'fork' and not can_fork():
+        log.warning("Forking is not supported on this platform, using the process executor")
+        executor = 'process'
+
+    ipc = IPCMeter()
+
+    # Admit chunks by their estimated memory, and recycle workers
+    admission = memory.Admission(
+        processes = args.processes,
+        budget    = args.worker_memory and args.worker_memory * memory.MB * args.processes,
+        min_free  = args.min_free_memory * memory.MB,
+    )
+    # Threads share one process, so there is no memory of their own to
+    # measure, and no worker to recycle
+    own_memory = executor != 'thread'
+    max_rss = args.max_worker_rss * memory.MB if args.max_worker_rss and own_memory else None
+    max_tasks = args.max_tasks_per_worker if own_memory else None
+
+    tasks = admission.admit(
+        tasks,
+        weigh = lambda task: memory.chunk_weight(task[1], args.stream_threshold)
+    )
+
+    # Workers read their own files, in parallel; the parent only holds paths
+    if executor == 'fork':
+        # Workers already hold the DSL
+        tasks = ((ticket, task[1:]) for ticket, task in tasks)
+        task_worker = partial(call_preloaded, task_worker)
+    else:
+        task_worker = partial(call_star, task_worker)
+
+    # Profile inside the workers, where the work is
+    if args.profile:
+        profiling.prepare(args.profile)
+        task_worker = partial(
+            profiling.call_profiled, task_worker,
+            directory    = os.path.abspath(args.profile),
+            trace_frames = args.profile_frames if args.profile_memory else 0,
+            trace_every  = max(args.profile_memory_every, 1),
+        )
+
+    task_worker = partial(
+        memory.call_measured, task_worker,
+        measure   = own_memory,
+        max_tasks = max_tasks,
+        max_rss   = max_rss,
+    )
+    if args.trace:
+        task_worker = partial(telemetry.call_spanned, task_worker)
+
+    events = make_event_queue(executor)
+    trace = telemetry.TraceRecorder(args.trace) if args.trace else None
+    progress = telemetry.Progress(
+        events           = events,
+        total            = total,
+        final_stage      = final_stage,
+        live             = args.progress,
+        metrics_path     = args.metrics_file,
+        metrics_interval = args.metrics_interval,
+        trace            = trace,
+    )
+    log_handler.progress = progress
+
+    writer = None
+    if store is not None:
+        context = multiprocessing.get_context('fork' if executor == 'fork' else None)
+        writer = StoreWriter(store, context).start()
+
+    # A pool is fed until a worker passes --max-worker-rss, then drained and
+    # replaced by a fresh one, which takes the rest of the tasks
+    tasks = iter(ipc.measure_tasks(tasks))
+    exhausted = False
+
+    def generation():
+        nonlocal exhausted
+        while not admission.recycle.is_set():
+            task = next(tasks, None)
+            if task is None:
+                exhausted = True
+                return
+            yield task
+
+    pool = None
+    progress.start()
+
+    try:
+        log.info("Running workers")
+        results = []
+        while not exhausted:
+            if pool is not None:
+                log.info("Memory: a worker passed the RSS limit, replacing the pool")
+                admission.recycle.clear()
+            pool = make_pool(
+                executor, args.processes, dsl, events, writer and writer.queue, max_tasks,
+                detail = trace is not None,
+            )
+            for ticket, usage, result in pool.imap_unordered(task_worker, generation()):
+                results.append(ipc.measure_result(result))
+                admission.release(ticket, usage)
+            pool.close()
+            pool.join()
+    except KeyboardInterrupt:
+        log.warning("Caught KeyboardInterrupt, terminating workers")
+        # Unblock the pool's task feeder, so it can be shut down
+        admission.cancel()
+        if pool is not None:
+            pool.terminate()
+        if writer is not None:
+            writer.close()
+        progress.stop()
+        if trace is not None:
+            log.info("Trace: %d spans written to %s", trace.write(), args.trace)
+        return None
+
+    if writer is not None:
+        writer.close()
+    progress.stop()
+
+    if executor != 'thread':
+        log.info("%s", ipc.report(executor, dsl))
+    log.info("%s", admission.report())
+    if args.profile:
+        log.info("%s", profiling.merge(args.profile))
+    if trace is not None:
+        log.info("Trace: %d spans written to %s", trace.write(), args.trace)
+
+    return results
+
+
+def merge_stats(dsl, results):
+    from .steps import SubStats
+
+    pre_stats  = SubStats(len(dsl.pre_replacements))
+    post_stats = SubStats(len(dsl.post_replacements))
+    for chunk_pre_stats, chunk_post_stats, *_ in results:
+        pre_stats.merge(chunk_pre_stats)
+        post_stats.merge(chunk_post_stats)
+
+    return pre_stats, post_stats
+
+
+def log_unifdef_report(log, records, top=10):
+    if not records:
+        return
+
+    size_in = sum(r['size_in'] for r in records)
+    size_out = sum(r['size_out'] for r in records)
+    saved = sum(r['saved_seconds'] or 0 for r in records)
+    log.info(
+        "Unifdef resolved %d conditions in %d headers, %s to %s bytes (-%.1f%%), "
+        "saving an estimated %.1fs of toast time",
+        sum(r['resolved'] for r in records), len(records), f'{size_in:,}', f'{size_out:,}',
+        100 * (size_in - size_out) / size_in if size_in else 0, saved
+    )
+
+    records = sorted(
+        records,
+        key = lambda r: (r['saved_seconds'] or 0, r['size_in'] - r['size_out']),
+        reverse = True
+    )
+    for r in records[:top]:
+        saved = '?' if r['saved_seconds'] is None else f"{r['saved_seconds']:.2f}s"
+        log.info(
+            "  %s: %s to %s bytes (-%.1f%%), toast %s saved",
+            r['path'], f"{r['size_in']:,}", f"{r['size_out']:,}",
+            100 * (r['size_in'] - r['size_out']) / r['size_in'], saved
+        )
+
+
+# ## Commands ## #
+def cmd_run(args):
+    from functools import partial
+
+    from . import distributed, telemetry
+    from .cache import ToolCache
+    from .failures import FailureSink
+    from .journal import Journal
+    from .quarantine import Quarantine
+    from .unifdef import Report as UnifdefReport
+    from .sinks import PackedStore
+    from .steps import nim_path_for
+    from .workers import (
+        worker, packed_worker, dry_run_worker, write_remote_result, write_remote_failure,
+        run_remote_workers,
+        get_paths, stats_report, write_stats
+    )
+
+    log_handler = telemetry.configure(args.log_level)
+    log = telemetry.log
+    authkey = os.environ.get('DEPROCESS_AUTHKEY', '').encode()
+    if args.authkey_file:
+        with open(args.authkey_file, 'rb') as fh:
+            authkey = fh.read().strip()
+
+    # Check the key before any worker starts, rather than in each of them
+    address = args.connect or args.coordinator
+    if address:
+        address = distributed.parse_address(address)
+        try:
+            authkey = distributed.check_authkey(address, authkey)
+        except ValueError as e:
+            log.error("%s", e)
+            return 1
+
+    cache = None
+    if args.tool_cache:
+        cache = ToolCache(args.tool_cache, args.tool_cache_size * 1024 * 1024)
+
+    # Remote workers get their directives from the coordinator
+    if args.connect:
+        run_remote_workers(address, args.processes, authkey, cache)
+        return 0
+
+    # Parse the directives
+    dsl = load_dsl(args, fold=not args.dry_run and args.stats is None)
+
+    if args.list_paths:
+        for path in get_paths(dsl, args.input):
+            print(path)
+        return 0
+
+    # Get the paths
+    failures = FailureSink(args.failures)
+    if args.retry_failed:
+        retry_paths = set(failures.failed_paths())
+        path_list = [p for p in get_paths(dsl, args.input) if p in retry_paths]
+        log.info("Retrying %d previously failed files", len(path_list))
+    else:
+        path_list = list(get_paths(dsl, args.input))
+
+    if not args.dry_run:
+        failures.reset()
+
+    if args.coordinator:
+        coordinator = distributed.Coordinator(
+            paths          = path_list,
+            dsl            = dsl,
+            handle_result  = partial(write_remote_result, failures),
+            handle_failure = partial(write_remote_failure, failures),
+            batch_size     = args.batch_size,
+            authkey        = authkey,
+        )
+        try:
+            coordinator.serve(address)
+        except KeyboardInterrupt:
+            log.warning("Caught KeyboardInterrupt, stopping coordinator")
+        return 0
+
+    # A packed store stands in for the journal: what is in it is done
+    store = None
+    if args.output_store and not args.dry_run:
+        store = PackedStore(args.output_store)
+        if args.resume:
+            stored = store.paths()
+            remaining = [p for p in path_list if nim_path_for(p) not in stored]
+            log.info(
+                "Resuming, %d of %d files already in %s",
+                len(path_list) - len(remaining), len(path_list), args.output_store
+            )
+            path_list = remaining
+        elif not args.retry_failed:
+            store.reset()
+
+    # Split the paths into chunks
+    path_chunks = chunk_paths(path_list, args.chunk_size)
+
+    split_options = dict(
+        split_threshold  = args.split_threshold,
+        split_threads    = args.split_threads,
+        stream_threshold = args.stream_threshold,
+    )
+
+    done_count = 0
+    # Files being retried are given another chance
+    quarantine = None
+    if args.screen:
+        quarantine = Quarantine(args.quarantine, args.sniff_bytes, known=not args.retry_failed)
+
+    unifdef_report = None
+    if args.unifdef and not args.dry_run:
+        unifdef_report = UnifdefReport(args.unifdef_report)
+        unifdef_report.reset()
+
+    if args.dry_run:
+        tasks = ((dsl, chunk) for chunk in path_chunks)
+        task_worker = partial(dry_run_worker, **split_options)
+    elif store is not None:
+        tasks = ((dsl, chunk, {}) for chunk in path_chunks)
+        task_worker = partial(
+            packed_worker,
+            stats          = args.stats is not None,
+            cache          = cache,
+            failures       = failures,
+            amalgamate     = args.amalgamate,
+            quarantine     = quarantine,
+            unifdef_report = unifdef_report,
+            **split_options
+        )
+    else:
+        journal = Journal(args.journal)
+        completed = {}
+        if args.resume or args.retry_failed:
+            completed = journal.load()
+        else:
+            journal.reset()
+
+        if args.resume:
+            done_count = sum(
+                'post' in completed.get(nim_path_for(p), ())
+                for p in path_list
+            )
+            log.info("Resuming, %d of %d files already complete", done_count, len(path_list))
+
+        # Only ship each chunk its own part of the journal
+        chunk_completed = lambda chunk: {
+            path: completed[path]
+            for p in chunk
+            for path in (p, nim_path_for(p))
+            if path in completed
+        }
+
+        tasks = (
+            (dsl, chunk, chunk_completed(chunk))
+            for chunk in path_chunks
+        )
+        task_worker = partial(
+            worker,
+            stats          = args.stats is not None,
+            cache          = cache,
+            journal        = journal,
+            failures       = failures,
+            amalgamate     = args.amalgamate,
+            quarantine     = quarantine,
+            unifdef_report = unifdef_report,
+            **split_options
+        )
+
+    results = run_pool(
+        args, dsl, path_chunks, tasks, task_worker,
+        total       = len(path_list) - done_count,
+        final_stage = 'pre' if args.dry_run else 'post',
+        log_handler = log_handler,
+        store       = store,
+    )
+    if results is None:
+        return 130
+
+    failure_count = len(failures.load()) if not args.dry_run else 0
+    if failure_count:
+        log.warning("%d failures recorded in %s", failure_count, args.failures)
+
+    skipped = [] if args.dry_run else sorted(
+        entry for result in results for entry in result[2]
+    )
+    if skipped:
+        log.warning("%d files skipped without running any tools:", len(skipped))
+        for path, reason in skipped:
+            log.warning("  %s: %s", path, reason)
+
+    if unifdef_report is not None:
+        log_unifdef_report(log, unifdef_report.load())
+
+    if args.stats is not None:
+        pre_stats, post_stats = merge_stats(dsl, results)
+        report = stats_report(dsl, len(path_list), pre_stats, post_stats)
+        write_stats(args.stats, report)
+
+    return 0
+
+
+def cmd_watch(args):
+    from . import telemetry
+    from .cache import ToolCache
+    from .executors import can_fork
+    from .unifdef import Report as UnifdefReport
+    from .watch import Watch
+
+    telemetry.configure(args.log_level)
+    log = telemetry.log
+
+    executor = args.executor
+    if executor == 'fork' and not can_fork():
+        log.warning("Forking is not supported on this platform, using the process executor")
+        executor = 'process'
+
+    options = dict(
+        amalgamate       = args.amalgamate,
+        split_threshold  = args.split_threshold,
+        split_threads    = args.split_threads,
+        stream_threshold = args.stream_threshold,
+    )
+    if args.unifdef:
+        options['unifdef_report'] = UnifdefReport(args.unifdef_report)
+        options['unifdef_report'].reset()
+
+    watch = Watch(
+        root          = args.input,
+        dsl_path      = args.dsl,
+        load_dsl      = lambda: load_dsl(args),
+        processes     = args.processes,
+        executor      = executor,
+        chunk_size    = args.chunk_size,
+        cache         = ToolCache(args.tool_cache, args.tool_cache_size * 1024 * 1024),
+        options       = options,
+        poll          = args.poll,
+        poll_interval = args.poll_interval,
+        debounce      = args.debounce,
+    )
+    watch.run()
+    return 0
+
+
+def cmd_daemon(args):
+    from . import telemetry
+    from .cache import ToolCache
+    from .daemon import Daemon
+
+    telemetry.configure(args.log_level)
+
+    dsl_paths = {'default': args.dsl}
+    for spec in args.load:
+        name, sep, path = spec.partition('=')
+        if not sep or not name or not path:
+            telemetry.log.error("--load expects NAME=PATH, got %r", spec)
+            return 2
+        dsl_paths[name] = path
+
+    daemon = Daemon(
+        socket_path     = args.socket,
+        dsl_paths       = dsl_paths,
+        threads         = args.threads,
+        batch_window    = args.batch_window / 1000,
+        batch_size      = args.batch_size,
+        cache           = ToolCache(args.tool_cache, args.tool_cache_size * 1024 * 1024),
+        unifdef_headers = args.unifdef,
+        optimize        = not args.no_optimize,
+    )
+    try:
+        daemon.run()
+    except FileExistsError as e:
+        telemetry.log.error("%s", e)
+        return 1
+    return 0
+
+
+def cmd_transform(args):
+    import json
+    import sys
+    from .daemon import request
+
+    if args.op == 'transform':
+        if args.file == '-':
+            text = sys.stdin.read()
+        else:
+            with open(args.file, 'r') as fh:
+                text = fh.read()
+        message = dict(op='transform', mode=args.mode, dsl=args.name, path=args.file, text=text)
+    else:
+        message = dict(op=args.op, dsl=args.name)
+
+    response = request(args.socket, message, timeout=args.timeout)
+    if 'error' in response:
+        print(f"error: {response['error']}", file=sys.stderr)
+        if response.get('stderr'):
+            print(response['stderr'], file=sys.stderr)
+        return 1
+
+    if args.op == 'transform':
+        sys.stdout.write(response['text'])
+    else:
+        print(json.dumps(response, indent=2))
+    return 0
+
+
+def cmd_stats(args):
+    from functools import partial
+
+    from . import telemetry
+    from .workers import dry_run_worker, get_paths, stats_report, write_stats
+
+    log_handler = telemetry.configure(args.log_level)
+
+    dsl = load_dsl(args, fold=False)
+    path_list = list(get_paths(dsl, args.input))
+    path_chunks = chunk_paths(path_list, args.chunk_size)
+
+    results = run_pool(
+        args, dsl, path_chunks,
+        tasks       = ((dsl, chunk) for chunk in path_chunks),
+        task_worker = partial(
+            dry_run_worker,
+            split_threshold  = args.split_threshold,
+            split_threads    = args.split_threads,
+            stream_threshold = args.stream_threshold,
+        ),
+        total       = len(path_list),
+        final_stage = 'pre',
+        log_handler = log_handler,
+    )
+    if results is None:
+        return 130
+
+    pre_stats, post_stats = merge_stats(dsl, results)
+    write_stats(args.output, stats_report(dsl, len(path_list), pre_stats, post_stats))
+    return 0
+
+
+def cmd_parse_dsl(args):
+    from . import telemetry
+
+    telemetry.configure(args.log_level)
+    dsl = load_dsl(args, compile=args.check)
+
+    print(f"Exclude paths:   {len(dsl.exclude_paths)}")
+    print(f"Exclude content: {len(dsl.exclude_contents)}")
+    print(f"Defines:         {len(dsl.defines)}")
+    print(f"Undefines:       {len(dsl.undefines)}")
+    print(f"Strip:           {len(dsl.prefixes)} prefixes, {len(dsl.suffixes)} suffixes")
+    print(f"Type map:        {len(dsl.type_map)}")
+    print(f"Token map:       {len(dsl.identifier_map)}")
+
+    for stage, replacements in (('pre', dsl.pre_replacements), ('post', dsl.post_replacements)):
+        tokens = sum(replacement.scope == 'token' for replacement in replacements)
+        print(f"{stage.capitalize()} replacements: {len(replacements)} ({tokens} token)")
+        if args.rules:
+            for index, replacement in enumerate(replacements):
+                if replacement.scope == 'token':
+                    scope = 'token'
+                else:
+                    scope = 'line' if replacement.line_local else 'file'
+                print(f"  {index:>4} [{scope}] {replacement!r}")
+
+    return 0
+
+
+def cmd_index(args):
+    import time
+
+    from . import identifiers, telemetry
+    from .executors import make_pool
+    from .workers import get_paths
+
+    telemetry.configure(args.log_level)
+    log = telemetry.log
+
+    dsl = load_dsl(args, compile=False)
+    path_list = list(get_paths(dsl, args.input))
+
+    start = time.perf_counter()
+    index = identifiers.IdentifierIndex(args.index).load()
+    pool = make_pool('process', args.processes)
+    try:
+        reindexed, removed = index.update(
+            path_list,
+            lambda function, paths: pool.imap_unordered(function, paths, chunksize=16)
+        )
+    except KeyboardInterrupt:
+        pool.terminate()
+        return 130
+    finally:
+        pool.close()
+        pool.join()
+    index.save()
+
+    table = index.table()
+    groups = identifiers.collisions(table, dsl.identifier_map, dsl.prefixes, dsl.suffixes)
+    rules = identifiers.rewrite_rules(groups, dsl.identifier_map)
+    log.info(
+        "Indexed %d headers (%d re-read, %d removed) in %.2fs: "
+        "%d names, %d colliding groups, %d new rules",
+        len(path_list), reindexed, removed, time.perf_counter() - start,
+        len(table), len(groups), len(rules)
+    )
+
+    text = identifiers.format_rules(rules)
+    if args.output == '-':
+        print(text, end='')
+    else:
+        with open(args.output, 'w') as fh:
+            fh.write(text)
+    return 0
+
+
+def cmd_extract(args):
+    import time
+
+    from . import telemetry
+    from .sinks import PackedStore
+
+    telemetry.configure(args.log_level)
+    store = PackedStore(args.store)
+
+    if args.list:
+        for path in sorted(store.paths()):
+            print(path)
+        return 0
+
+    start = time.perf_counter()
+    count, size = store.extract(args.destination, args.glob, args.threads)
+    telemetry.log.info(
+        "Extracted %d files (%.1f MB) to %s in %.2fs",
+        count, size / 1e6, args.destination, time.perf_counter() - start
+    )
+    return 0
+
+
+def cmd_bench_executors(args):
+    import pickle
+    from functools import partial
+
+    from . import bench, telemetry
+    from .workers import dry_run_worker, get_paths
+
+    telemetry.configure(args.log_level)
+
+    dsl = load_dsl(args)
+    path_list = list(get_paths(dsl, args.input))
+    path_chunks = chunk_paths(path_list, args.chunk_size)
+
+    telemetry.log.info("DSL pickles to %d bytes per process pool task", len(pickle.dumps(dsl)))
+    results = bench.compare_executors(
+        task_worker = partial(
+            dry_run_worker,
+            split_threshold  = args.split_threshold,
+            split_threads    = args.split_threads,
+            stream_threshold = args.stream_threshold,
+        ),
+        tasks       = [(dsl, chunk) for chunk in path_chunks],
+        processes   = args.processes,
+        file_count  = len(path_list),
+        byte_count  = bench.corpus_size(path_list),
+        dsl         = dsl,
+    )
+    print(bench.format_results(results))
+    return 0
+
+
+def cmd_bench_templates(args):
+    from . import bench
+
+    for label, nanoseconds in bench.template_overhead(args.matches):
+        print(f"{label:<32} {nanoseconds:8.0f} ns/match")
+    return 0
+
+
+def cmd_bench_startup(args):
+    from . import bench
+
+    seconds = bench.startup_time(args.repeat)
+    print(f"import + --help: {seconds * 1000:.0f} ms (best of {args.repeat}), budget {args.budget * 1000:.0f} ms")
+    if seconds > args.budget:
+        print("Over budget")
+        return 1
+    return 0
+
+
+# ## Arguments ## #
+def pool_parser(executor='process', chunk_size=200):
+    # A parent parser for the commands that run a pool. Commands wanting other
+    # defaults get a parser of their own, as set_defaults would change them
+    # for every command sharing it.
+    pool = argparse.ArgumentParser(add_help=False)
+    pool.add_argument(
+        'input', nargs='?', default='./output',
+        help="Directory to search for headers (default: %(default)s)"
+    )
+    pool.add_argument(
+        '--processes', type=int, default=4,
+        help="Number of worker processes (default: %(default)s)"
+    )
+    pool.add_argument(
+        '--executor', choices=EXECUTORS, default=executor,
+        help="Run workers as processes, as threads sharing one DSL, or as processes forked "
+             "with the DSL preloaded "
+             "(default: %(default)s)"
+    )
+    pool.add_argument(
+        '--chunk-size', type=int, default=chunk_size,
+        help="Number of headers handed to a worker at once (default: %(default)s)"
+    )
+    pool.add_argument(
+        '--split-threshold', type=int, default=16 * 1024 * 1024, metavar='BYTES',
+        help="Rewrite files at least this large in parallel chunks; 0 disables (default: %(default)s)"
+    )
+    pool.add_argument(
+        '--split-threads', type=int, default=None, metavar='N',
+        help="Threads used per large file (default: CPU count)"
+    )
+    pool.add_argument(
+        '--stream-threshold', type=int, default=256 * 1024 * 1024, metavar='BYTES',
+        help="Stream files at least this large through the rules in bounded memory, instead of "
+             "reading them whole; 0 disables (default: %(default)s)"
+    )
+    pool.add_argument(
+        '--worker-memory', type=int, default=None, metavar='MB',
+        help="Memory budget per worker: only admit chunks while their estimated peak memory, "
+             "learned as the run goes, fits in --processes times this much"
+    )
+    pool.add_argument(
+        '--min-free-memory', type=int, default=512, metavar='MB',
+        help="Run fewer chunks at once while the system has less free memory than this; "
+             "0 disables (default: %(default)s)"
+    )
+    pool.add_argument(
+        '--max-tasks-per-worker', type=int, default=None, metavar='N',
+        help="Replace each worker process after it has run N chunks"
+    )
+    pool.add_argument(
+        '--max-worker-rss', type=int, default=None, metavar='MB',
+        help="Replace the pool's worker processes once one's memory passes this much after a chunk"
+    )
+    pool.add_argument(
+        '--progress', action=argparse.BooleanOptionalAction, default=None,
+        help="Redraw a live progress line (default: when stderr is a terminal)"
+    )
+    pool.add_argument(
+        '--metrics-file', metavar='PATH',
+        help="Periodically write run metrics to PATH in the Prometheus text format"
+    )
+    pool.add_argument(
+        '--metrics-interval', type=float, default=15.0, metavar='SECONDS',
+        help="How often to rewrite --metrics-file (default: %(default)s)"
+    )
+    return pool
+
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        '--dsl', default=DEFAULT_DSL, metavar='FILE',
+        help="DSL file describing the run (default: the bundled default.dsl)"
+    )
+    common.add_argument(
+        '--no-optimize', action='store_true',
+        help="Compile the DSL exactly as written, skipping the optimizer"
+    )
+    common.add_argument(
+        '--log-level', default='INFO', type=str.upper,
+        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+        help="Minimum level of log messages to show (default: %(default)s)"
+    )
+
+    pool = pool_parser()
+
+    profile = argparse.ArgumentParser(add_help=False)
+    profile.add_argument(
+        '--profile', metavar='DIR',
+        help="Profile each worker with cProfile, writing per-worker stats to DIR and merging "
+             "them into DIR/merged.prof at the end"
+    )
+    profile.add_argument(
+        '--profile-memory', action='store_true',
+        help="With --profile, also trace allocations in a sample of each worker's chunks with "
+             "tracemalloc, reporting their peaks and the lines holding the most memory in "
+             "DIR/allocations.txt"
+    )
+    profile.add_argument(
+        '--profile-memory-every', type=int, default=10, metavar='N',
+        help="Trace a worker's first chunk and one in every N after it, as tracing slows "
+             "chunks several times over (default: %(default)s)"
+    )
+    profile.add_argument(
+        '--profile-frames', type=int, default=1, metavar='N',
+        help="Frames of traceback tracemalloc keeps per allocation; more cost more "
+             "(default: %(default)s)"
+    )
+    profile.add_argument(
+        '--trace', metavar='PATH',
+        help="Record a span for every file in every stage, and every task a worker runs, and "
+             "write them to PATH as Chrome trace-event JSON, for chrome://tracing or Perfetto"
+    )
+
+    parser = argparse.ArgumentParser(
+        prog='python -m deprocessor',
+        description="Run the DSL and Nimterop over a tree of headers."
+    )
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+
+    # run
+    run = commands.add_parser(
+        'run', parents=[common, pool, profile],
+        help="Run the whole pipeline over a tree of headers"
+    )
+    run.set_defaults(func=cmd_run)
+    run.add_argument(
+        '--dry-run', action='store_true',
+        help="Only run the in-process replacement stages; spawn no tools and write no files"
+    )
+    run.add_argument(
+        '--list-paths', action='store_true',
+        help="Print the headers the run would process, and exit"
+    )
+    run.add_argument(
+        '--stats', nargs='?', const='-', metavar='PATH',
+        help="Write per-rule match statistics as JSON to PATH (default: stdout)"
+    )
+    run.add_argument(
+        '--tool-cache', metavar='DIR',
+        help="Cache tool output in DIR, keyed on the tool's input"
+    )
+    run.add_argument(
+        '--tool-cache-size', type=int, default=1024, metavar='MB',
+        help="Maximum size of the tool cache before eviction (default: %(default)s)"
+    )
+    run.add_argument(
+        '--coordinator', metavar='ADDRESS',
+        help="Serve batches to remote workers on ADDRESS (host:port or socket path) instead of running a local pool"
+    )
+    run.add_argument(
+        '--connect', metavar='ADDRESS',
+        help="Run --processes workers pulling batches from the coordinator at ADDRESS"
+    )
+    run.add_argument(
+        '--authkey-file', metavar='PATH',
+        help="Read the secret key shared by the coordinator and its workers from PATH; TCP "
+             "addresses need one, from this or the DEPROCESS_AUTHKEY environment variable"
+    )
+    run.add_argument(
+        '--batch-size', type=int, default=20,
+        help="Number of headers per coordinator batch (default: %(default)s)"
+    )
+    run.add_argument(
+        '--journal', default='deprocess.journal', metavar='PATH',
+        help="Record per-file stage completion in PATH (default: %(default)s)"
+    )
+    run.add_argument(
+        '--resume', action='store_true',
+        help="Skip work recorded as complete in the journal of an interrupted run"
+    )
+    run.add_argument(
+        '--failures', default='deprocess.failures.jsonl', metavar='PATH',
+        help="Write a JSON line per failed tool invocation to PATH (default: %(default)s)"
+    )
+    run.add_argument(
+        '--retry-failed', action='store_true',
+        help="Only reprocess the files listed in the previous run's failure report"
+    )
+    run.add_argument(
+        '--screen', action=argparse.BooleanOptionalAction, default=True,
+        help="Skip headers that look like C++, match an EXCLUDE CONTENT rule, or have contents "
+             "toast failed on before (default: on)"
+    )
+    run.add_argument(
+        '--quarantine', default='deprocess.quarantine.jsonl', metavar='PATH',
+        help="Remember the contents of headers toast failed on in PATH, across runs (default: %(default)s)"
+    )
+    run.add_argument(
+        '--sniff-bytes', type=int, default=256 * 1024, metavar='BYTES',
+        help="How much of the start of each header to search for C++ (default: %(default)s)"
+    )
+    run.add_argument(
+        '--unifdef', action=argparse.BooleanOptionalAction, default=True,
+        help="Remove #if branches that the DSL's DEFINE and UNDEFINE statements rule out before "
+             "running toast (default: on)"
+    )
+    run.add_argument(
+        '--unifdef-report', default='deprocess.unifdef.jsonl', metavar='PATH',
+        help="Write a JSON line per header --unifdef changed to PATH, with its size before and "
+             "after and the toast time saved (default: %(default)s)"
+    )
+    run.add_argument(
+        '--output-store', metavar='PATH',
+        help="Run each worker in local scratch space and write rewritten headers and Nim output "
+             "into one SQLite store at PATH, through a single writer process, instead of in place"
+    )
+    run.add_argument(
+        '--amalgamate', type=int, default=0, metavar='N',
+        help="Run toast once per batch of up to N headers from the same directory"
+    )
+
+    # watch
+    watch = commands.add_parser(
+        'watch', parents=[common, pool_parser(executor='fork', chunk_size=20)],
+        help="Keep the DSL and workers loaded, and regenerate .nim files as headers or the DSL change "
+             "(workers are forked with the DSL preloaded unless --executor says otherwise)"
+    )
+    watch.set_defaults(func=cmd_watch)
+    watch.add_argument(
+        '--tool-cache', default='deprocess.cache', metavar='DIR',
+        help="Cache tool output in DIR, so headers a DSL change leaves alone do not run toast "
+             "again (default: %(default)s)"
+    )
+    watch.add_argument(
+        '--tool-cache-size', type=int, default=1024, metavar='MB',
+        help="Maximum size of the tool cache before eviction (default: %(default)s)"
+    )
+    watch.add_argument(
+        '--unifdef', action=argparse.BooleanOptionalAction, default=True,
+        help="Remove #if branches that the DSL's DEFINE and UNDEFINE statements rule out before "
+             "running toast (default: on)"
+    )
+    watch.add_argument(
+        '--unifdef-report', default='deprocess.unifdef.jsonl', metavar='PATH',
+        help="Write a JSON line per header --unifdef changed to PATH (default: %(default)s)"
+    )
+    watch.add_argument(
+        '--amalgamate', type=int, default=0, metavar='N',
+        help="Run toast once per batch of up to N headers from the same directory"
+    )
+    watch.add_argument(
+        '--poll', action='store_true',
+        help="Poll modification times instead of using inotify"
+    )
+    watch.add_argument(
+        '--poll-interval', type=float, default=1.0, metavar='SECONDS',
+        help="How often to poll (default: %(default)s)"
+    )
+    watch.add_argument(
+        '--debounce', type=float, default=0.1, metavar='SECONDS',
+        help="Wait this long after a change for the rest of a save's changes (default: %(default)s)"
+    )
+
+    # daemon
+    daemon = commands.add_parser(
+        'daemon', parents=[common],
+        help="Keep DSLs compiled and serve transforms of single headers over a Unix socket"
+    )
+    daemon.set_defaults(func=cmd_daemon)
+    daemon.add_argument(
+        '--socket', default='deprocess.sock', metavar='PATH',
+        help="Unix socket to listen on (default: %(default)s)"
+    )
+    daemon.add_argument(
+        '--load', action='append', default=[], metavar='NAME=PATH',
+        help="Also serve the DSL at PATH as NAME; --dsl is served as 'default' (repeatable)"
+    )
+    daemon.add_argument(
+        '--threads', type=int, default=4,
+        help="Number of threads running transforms (default: %(default)s)"
+    )
+    daemon.add_argument(
+        '--batch-window', type=float, default=2.0, metavar='MS',
+        help="Gather transforms arriving this close together into one batch (default: %(default)s)"
+    )
+    daemon.add_argument(
+        '--batch-size', type=int, default=32, metavar='N',
+        help="Run a batch as soon as it has N transforms (default: %(default)s)"
+    )
+    daemon.add_argument(
+        '--tool-cache', default='deprocess.cache', metavar='DIR',
+        help="Cache tool output in DIR (default: %(default)s)"
+    )
+    daemon.add_argument(
+        '--tool-cache-size', type=int, default=1024, metavar='MB',
+        help="Maximum size of the tool cache before eviction (default: %(default)s)"
+    )
+    daemon.add_argument(
+        '--unifdef', action=argparse.BooleanOptionalAction, default=True,
+        help="Remove #if branches that the DSL's DEFINE and UNDEFINE statements rule out in pre "
+             "and full transforms (default: on)"
+    )
+
+    # transform
+    transform = commands.add_parser(
+        'transform',
+        help="Send a header to a running daemon and print the result"
+    )
+    transform.set_defaults(func=cmd_transform)
+    transform.add_argument(
+        'file', nargs='?', default='-',
+        help="Header to transform, or - for stdin (default: %(default)s)"
+    )
+    transform.add_argument(
+        '--socket', default='deprocess.sock', metavar='PATH',
+        help="Daemon socket (default: %(default)s)"
+    )
+    transform.add_argument(
+        '--mode', choices=('pre', 'post', 'full'), default='full',
+        help="Run the pre replacements, the post replacements, or the whole pipeline "
+             "(default: %(default)s)"
+    )
+    transform.add_argument(
+        '--name', default='default', metavar='NAME',
+        help="DSL to use, as named by the daemon's --load (default: %(default)s)"
+    )
+    transform.add_argument(
+        '--op', choices=('transform', 'histogram', 'status', 'reload', 'ping'), default='transform',
+        help="Ask for something other than a transform: the latency histograms, the daemon's "
+             "status, a reload of the DSL from its file, or a ping"
+    )
+    transform.add_argument(
+        '--timeout', type=float, default=None, metavar='SECONDS',
+        help="Give up waiting for the daemon after this long"
+    )
+
+    # parse-dsl
+    parse_dsl = commands.add_parser(
+        'parse-dsl', parents=[common],
+        help="Parse a DSL file and summarize it"
+    )
+    parse_dsl.set_defaults(func=cmd_parse_dsl)
+    parse_dsl.add_argument(
+        '--rules', action='store_true',
+        help="List every replacement rule"
+    )
+    parse_dsl.add_argument(
+        '--check', action='store_true',
+        help="Also compile every replacement rule"
+    )
+
+    # stats
+    stats = commands.add_parser(
+        'stats', parents=[common, pool, profile],
+        help="Measure per-rule matches over a tree of headers, without running any tools"
+    )
+    stats.set_defaults(func=cmd_stats)
+    stats.add_argument(
+        '--output', default='-', metavar='PATH',
+        help="Write the JSON report to PATH (default: stdout)"
+    )
+
+    # extract
+    extract = commands.add_parser(
+        'extract', parents=[common],
+        help="Write the files in a --output-store back out"
+    )
+    extract.set_defaults(func=cmd_extract)
+    extract.add_argument('store', help="Store written by run --output-store")
+    extract.add_argument(
+        'destination', nargs='?', default='.',
+        help="Directory to write the files under (default: %(default)s)"
+    )
+    extract.add_argument(
+        '--glob', metavar='PATTERN',
+        help="Only extract paths matching PATTERN"
+    )
+    extract.add_argument(
+        '--list', action='store_true',
+        help="List the stored paths instead of extracting"
+    )
+    extract.add_argument(
+        '--threads', type=int, default=8,
+        help="Number of threads writing files (default: %(default)s)"
+    )
+
+    # index
+    index = commands.add_parser(
+        'index', parents=[common],
+        help="Find names Nim's style insensitivity would merge, and write REWRITE TOKEN rules for them"
+    )
+    index.set_defaults(func=cmd_index)
+    index.add_argument(
+        'input', nargs='?', default='./output',
+        help="Directory to search for headers (default: %(default)s)"
+    )
+    index.add_argument(
+        '--processes', type=int, default=os.cpu_count(),
+        help="Number of worker processes (default: CPU count)"
+    )
+    index.add_argument(
+        '--index', default='deprocess.identifiers.json', metavar='PATH',
+        help="Keep per-file declarations in PATH, so later runs only re-read changed headers "
+             "(default: %(default)s)"
+    )
+    index.add_argument(
+        '--output', default='-', metavar='PATH',
+        help="Write the rules to PATH (default: stdout)"
+    )
+
+    # bench
+    bench = commands.add_parser('bench', help="Run a benchmark")
+    benchmarks = bench.add_subparsers(dest='benchmark', metavar='BENCHMARK', required=True)
+
+    executors = benchmarks.add_parser(
+        'executors', parents=[common, pool],
+        help="Compare throughput and RSS of the executors over the replacement stages"
+    )
+    executors.set_defaults(func=cmd_bench_executors)
+
+    templates = benchmarks.add_parser(
+        'templates',
+        help="Measure per-match cost of applying WITH clauses"
+    )
+    templates.set_defaults(func=cmd_bench_templates)
+    templates.add_argument(
+        '--matches', type=int, default=200000,
+        help="Number of matches in the benchmark text (default: %(default)s)"
+    )
+
+    startup = benchmarks.add_parser(
+        'startup',
+        help="Time `python -m deprocessor --help`, failing when over a budget"
+    )
+    startup.set_defaults(func=cmd_bench_startup)
+    startup.add_argument(
+        '--budget', type=float, default=0.15, metavar='SECONDS',
+        help="Fail when the best time is above this (default: %(default)s)"
+    )
+    startup.add_argument(
+        '--repeat', type=int, default=5,
+        help="Number of runs to take the best of (default: %(default)s)"
+    )
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.command is None:
+        parser.print_help()
+        return 2
+
+    return args.func(args)
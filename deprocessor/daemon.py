@@ -0,0 +1,380 @@
+"""
+A daemon serving transforms of single headers over a Unix socket, for editor
+tooling that cannot wait for Python to start and the DSL to compile.
+
+The daemon holds one or more compiled DSLs by name, each with a
+`pipeline.Pipeline` per mode. Clients send one JSON object per line, or a
+JSON array of them as a batch, and get one line back per line sent:
+
+    {"id": 1, "op": "transform", "mode": "pre", "dsl": "default",
+     "path": "winbase.h2", "text": "..."}
+    {"id": 1, "text": "...", "seconds": 0.004}
+
+`mode` is `pre` (pre replacements and unifdef, what toast would be given),
+`post` (post replacements over toast output) or `full` (the whole pipeline,
+returning the `.nim` text, and the rewritten header as `header`). A failed
+request answers with `error` and the failing `stage` instead of `text`,
+adding toast's `returncode` and `stderr` when toast failed. Other ops are
+`histogram`, the latency histogram of each op and transform mode, `status`,
+`reload`, which recompiles a DSL from its file, and `ping`.
+
+Requests are handled concurrently, and lines from one connection may be
+answered out of order, so clients should send an `id`. Transforms that
+arrive within `batch_window` seconds of each other for the same DSL and
+mode are run as one batch: full transforms in a batch share one toast run
+(see `steps.nimterop_files`), and other batches are spread over the worker
+threads. Rules match with the GIL released, and toast runs as a subprocess,
+so the threads run in parallel.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+
+from .dsl import DSL
+from .pipeline import STAGES, Pipeline
+
+
+log = logging.getLogger('deprocessor')
+
+# The pipeline stages each mode runs
+MODES = {
+    'pre' : ('pre', 'unifdef'),
+    'post': ('post',),
+    'full': STAGES,
+}
+
+
+# ## Latency ## #
+class LatencyHistogram():
+    """
+    Counts of request latencies in fixed buckets, in milliseconds.
+    """
+    bounds = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, milliseconds):
+        self.counts[bisect_left(self.bounds, milliseconds)] += 1
+        self.count += 1
+        self.total += milliseconds
+
+    def quantile(self, q):
+        # The upper bound of the bucket holding the quantile
+        if not self.count:
+            return None
+        seen = 0
+        for bound, count in zip((*self.bounds, float('inf')), self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return bound
+        return float('inf')
+
+    def snapshot(self):
+        cumulative = 0
+        buckets = []
+        for bound, count in zip((*self.bounds, '+Inf'), self.counts):
+            cumulative += count
+            buckets.append([bound, cumulative])
+
+        snapshot = {'buckets': buckets, 'count': self.count, 'sum_ms': round(self.total, 3)}
+        for q in (50, 90, 99):
+            bound = self.quantile(q / 100)
+            # JSON has no infinity
+            snapshot[f'p{q}_ms'] = None if bound == float('inf') else bound
+        return snapshot
+
+
+# ## Transforms ## #
+def load(path, optimize=True):
+    with open(path, 'r') as fh:
+        return DSL(fh.read(), optimize=optimize).compile()
+
+
+def respond(result):
+    """
+    The response fields for a `pipeline.Result`.
+    """
+    if result.ok:
+        response = {'text': result.text}
+    else:
+        error = result.error
+        response = {'error': str(error), 'stage': error.stage}
+        if error.returncode is not None:
+            response.update(returncode=error.returncode, stderr=error.stderr)
+    if result.header is not None:
+        response['header'] = result.header
+    return response
+
+
+# ## Server ## #
+class Daemon():
+    """
+    Serve transforms with the DSLs in `dsl_paths`, a `{name: path}` dict,
+    on the Unix socket at `socket_path`, using `threads` worker threads.
+    """
+    # The longest request line, which holds a whole header
+    max_request = 256 * 1024 * 1024
+
+    def __init__(
+            self,
+            socket_path,
+            dsl_paths,
+            threads=4,
+            batch_window=0.002,
+            batch_size=32,
+            cache=None,
+            unifdef_headers=True,
+            optimize=True):
+        self.socket_path = socket_path
+        self.dsl_paths = dict(dsl_paths)
+        self.threads = threads
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.cache = cache
+        self.unifdef_headers = unifdef_headers
+        self.optimize = optimize
+
+        self.pipelines = {}
+        self.executor = None
+        self.pending = {}
+        self.histograms = {}
+        self.started = time.time()
+        self.batches = 0
+        self.batched_items = 0
+
+    def build(self, name):
+        """
+        Compile the DSL named `name`, returning a `Pipeline` for each mode.
+        """
+        start = time.perf_counter()
+        dsl = load(self.dsl_paths[name], self.optimize)
+        log.info("Loaded DSL %r from %s in %.2fs", name, self.dsl_paths[name], time.perf_counter() - start)
+
+        pipelines = {}
+        for mode, stages in MODES.items():
+            if not self.unifdef_headers:
+                stages = [stage for stage in stages if stage != 'unifdef']
+            pipelines[mode] = Pipeline(
+                dsl, stages,
+                batch_size = self.batch_size,
+                amalgamate = self.batch_size,
+                cache      = self.cache,
+            )
+        return pipelines
+
+    # ## Batching ## #
+    def submit(self, dsl_name, mode, item):
+        """
+        Queue an item for the next batch of its DSL and mode, and return a
+        future for its result.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = (dsl_name, mode)
+
+        batch = self.pending.setdefault(key, [])
+        batch.append((item, future))
+        if len(batch) >= self.batch_size:
+            self.flush(key)
+        elif len(batch) == 1:
+            loop.call_later(self.batch_window, self.flush, key)
+        return future
+
+    def flush(self, key):
+        batch = self.pending.pop(key, None)
+        if not batch:
+            return
+
+        dsl_name, mode = key
+        self.batches += 1
+        self.batched_items += len(batch)
+
+        # Full batches share a toast run; others are spread over the threads
+        if mode == 'full':
+            parts = [batch]
+        else:
+            step = -(-len(batch) // self.threads)
+            parts = [batch[i:i + step] for i in range(0, len(batch), step)]
+
+        for part in parts:
+            self.run_batch(dsl_name, mode, part)
+
+    def run_batch(self, dsl_name, mode, batch):
+        items = [item for item, _ in batch]
+        futures = [future for _, future in batch]
+
+        def finish(done):
+            try:
+                results = done.result()
+            except Exception as e:
+                log.exception("Batch of %d %s transforms failed", len(items), mode)
+                results = [{'error': f'{type(e).__name__}: {e}'}] * len(futures)
+            for future, result in zip(futures, results):
+                if not future.done():
+                    future.set_result(result)
+
+        pipeline = self.pipelines[dsl_name][mode]
+        work = asyncio.get_running_loop().run_in_executor(
+            self.executor, lambda: [respond(result) for result in pipeline.process_many(items)]
+        )
+        work.add_done_callback(finish)
+
+    # ## Requests ## #
+    async def handle_request(self, request):
+        start = time.perf_counter()
+        if not isinstance(request, dict):
+            return {'error': 'requests must be JSON objects'}
+
+        op = request.get('op', 'transform')
+        response = {'id': request.get('id')}
+
+        if op == 'transform':
+            mode = request.get('mode', 'pre')
+            dsl_name = request.get('dsl', 'default')
+            text = request.get('text')
+            if mode not in MODES:
+                response['error'] = f'unknown mode {mode!r}, expected one of {", ".join(MODES)}'
+            elif dsl_name not in self.pipelines:
+                response['error'] = f'unknown DSL {dsl_name!r}'
+            elif not isinstance(text, str):
+                response['error'] = 'transform needs the header as "text"'
+            else:
+                item = (request.get('path') or 'input.h2', text)
+                response.update(await self.submit(dsl_name, mode, item))
+                op = f'transform {mode}'
+        elif op == 'histogram':
+            response['histograms'] = {
+                name: histogram.snapshot()
+                for name, histogram in sorted(self.histograms.items())
+            }
+        elif op == 'status':
+            response.update(
+                dsls          = self.dsl_paths,
+                threads       = self.threads,
+                uptime        = round(time.time() - self.started, 3),
+                batches       = self.batches,
+                batched_items = self.batched_items,
+            )
+        elif op == 'reload':
+            dsl_name = request.get('dsl', 'default')
+            if dsl_name not in self.dsl_paths:
+                response['error'] = f'unknown DSL {dsl_name!r}'
+            else:
+                try:
+                    self.pipelines[dsl_name] = await asyncio.get_running_loop().run_in_executor(
+                        self.executor, self.build, dsl_name
+                    )
+                except Exception as e:
+                    response['error'] = f'{type(e).__name__}: {e}'
+        elif op == 'ping':
+            pass
+        else:
+            response['error'] = f'unknown op {op!r}'
+
+        elapsed = time.perf_counter() - start
+        response['seconds'] = round(elapsed, 6)
+        self.histograms.setdefault(op, LatencyHistogram()).record(elapsed * 1000)
+        return response
+
+    async def handle_line(self, line, writer):
+        try:
+            message = json.loads(line)
+        except ValueError as e:
+            response = {'error': f'invalid JSON: {e}'}
+        else:
+            if isinstance(message, list):
+                response = await asyncio.gather(*map(self.handle_request, message))
+            else:
+                response = await self.handle_request(message)
+
+        writer.write(json.dumps(response).encode('utf-8') + b'\n')
+        await writer.drain()
+
+    async def handle_connection(self, reader, writer):
+        tasks = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    writer.write(b'{"error": "request too long"}\n')
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = asyncio.create_task(self.handle_line(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    # ## Running ## #
+    def remove_stale_socket(self):
+        if not os.path.exists(self.socket_path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+        except OSError:
+            os.remove(self.socket_path)
+        else:
+            raise FileExistsError(f"A daemon is already serving {self.socket_path}")
+        finally:
+            probe.close()
+
+    async def serve(self):
+        for name in self.dsl_paths:
+            self.pipelines[name] = self.build(name)
+
+        self.executor = ThreadPoolExecutor(self.threads)
+        self.remove_stale_socket()
+        server = await asyncio.start_unix_server(
+            self.handle_connection, path=self.socket_path, limit=self.max_request
+        )
+        # Stop on SIGTERM as on Ctrl-C, removing the socket
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        log.info("Serving on %s with %d threads", self.socket_path, self.threads)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False)
+            try:
+                os.remove(self.socket_path)
+            except OSError:
+                pass
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            log.info("Stopping")
+
+
+# ## Client ## #
+def request(socket_path, message, timeout=None):
+    """
+    Send one request (or a list of them) to a daemon and return its
+    response.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(socket_path)
+        client.sendall(json.dumps(message).encode('utf-8') + b'\n')
+        with client.makefile('rb') as fh:
+            return json.loads(fh.readline())
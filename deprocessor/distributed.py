@@ -0,0 +1,309 @@
+"""
+Coordinator/worker execution over a socket.
+
+The coordinator owns the path list and the parsed DSL. Workers connect, receive
+the DSL once, then repeatedly pull batches of `(path, data)` pairs and send
+back one outcome per path. A batch is leased to the connection that pulled it;
+if that connection drops before returning a result, the batch goes back into
+the queue for another (or a restarted) worker, up to `max_leases` times. A
+batch that keeps losing its workers, or that a worker fails to process, has
+its paths failed instead. Each path is completed or failed exactly once:
+results for paths that are already done are ignored.
+
+Messages are pickled tuples sent over `multiprocessing.connection`, which
+handles framing and authentication. Addresses are either `host:port` for TCP
+or a filesystem path for a Unix socket. Unpickling a message can run code, so
+TCP needs a secret key shared by the coordinator and its workers; a Unix
+socket is guarded by its file's permissions, and falls back to a fixed key.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from multiprocessing.connection import Listener, Client
+
+
+log = logging.getLogger(__name__)
+
+# Only for Unix sockets
+LOCAL_AUTHKEY = b'deprocessor'
+
+
+def parse_address(text):
+    host, sep, port = text.rpartition(':')
+    if sep and port.isdigit():
+        return (host or '127.0.0.1', int(port))
+    return text
+
+
+def _address_family(address):
+    return 'AF_INET' if isinstance(address, tuple) else 'AF_UNIX'
+
+
+def check_authkey(address, authkey):
+    """
+    Return the key to use at `address`, raising ValueError when it is a TCP
+    address and `authkey` is empty.
+    """
+    if authkey:
+        return authkey
+    if isinstance(address, tuple):
+        raise ValueError(
+            f"Refusing to use TCP address {address[0]}:{address[1]} without a secret key; "
+            f"set DEPROCESS_AUTHKEY or pass --authkey-file"
+        )
+    return LOCAL_AUTHKEY
+
+
+class Coordinator():
+    """
+    Hand out batches of paths to workers and collect their results.
+    `handle_result(path, outcome)` is called exactly once per completed path,
+    and `handle_failure(path, reason)` once per failed path, from the thread
+    serving the worker concerned.
+    """
+    # How long an idle worker is told to wait while batches are still leased
+    wait_interval = 1.0
+
+    def __init__(self, paths, dsl, handle_result, handle_failure=None, batch_size=20, authkey=None, max_leases=3):
+        self.dsl = dsl
+        self.handle_result = handle_result
+        self.handle_failure = handle_failure
+        self.authkey = authkey
+        self.max_leases = max_leases
+
+        # Batches waiting for a worker, with how often each has been leased
+        self.pending = deque(
+            (list(paths[i:i + batch_size]), 0)
+            for i in range(0, len(paths), batch_size)
+        )
+        self.remaining = set(paths)
+        self.leases = {}
+        self.next_batch_id = 0
+
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        if not self.remaining:
+            self.finished.set()
+
+    # ## Batch bookkeeping ## #
+    def _lease(self, connection_id):
+        with self.lock:
+            while self.pending:
+                batch, leases = self.pending.popleft()
+                batch = [p for p in batch if p in self.remaining]
+                if not batch:
+                    continue
+
+                batch_id = self.next_batch_id
+                self.next_batch_id += 1
+                self.leases[batch_id] = (connection_id, batch, leases + 1)
+                return batch_id, batch
+
+            return None, None
+
+    def _release(self, connection_id):
+        # Put everything leased to a lost connection back in the queue, unless
+        # it has lost too many workers already
+        exhausted = []
+        with self.lock:
+            lost = [
+                batch_id
+                for batch_id, (owner, _, _) in self.leases.items()
+                if owner == connection_id
+            ]
+            for batch_id in lost:
+                _, batch, leases = self.leases.pop(batch_id)
+                if leases >= self.max_leases:
+                    exhausted.append(batch)
+                else:
+                    self.pending.appendleft((batch, leases))
+
+        for batch in exhausted:
+            self._fail(batch, f"lost {self.max_leases} workers while processing its batch")
+
+    def _fail(self, paths, reason):
+        for path in paths:
+            with self.lock:
+                if path not in self.remaining:
+                    continue
+                self.remaining.discard(path)
+
+            log.warning("Failed %s: %s", path, reason)
+            if self.handle_failure is not None:
+                self.handle_failure(path, reason)
+
+        with self.lock:
+            if not self.remaining:
+                self.finished.set()
+
+    def _complete(self, batch_id, results):
+        for path, outcome in results:
+            with self.lock:
+                if path not in self.remaining:
+                    continue
+                self.remaining.discard(path)
+
+            self.handle_result(path, outcome)
+
+        with self.lock:
+            self.leases.pop(batch_id, None)
+            if not self.remaining:
+                self.finished.set()
+
+    def _read_batch(self, batch):
+        items = []
+        for path in batch:
+            try:
+                with open(path, 'r') as fh:
+                    items.append((path, fh.read()))
+            except OSError:
+                # Nothing a worker could do about it either
+                log.warning("Could not read contents of %s", path)
+                with self.lock:
+                    self.remaining.discard(path)
+                    if not self.remaining:
+                        self.finished.set()
+
+        return items
+
+    # ## Serving ## #
+    def _serve_connection(self, connection, connection_id):
+        try:
+            connection.send(('dsl', self.dsl))
+
+            while True:
+                message = connection.recv()
+                kind = message[0]
+
+                if kind == 'result':
+                    _, batch_id, results = message
+                    self._complete(batch_id, results)
+
+                elif kind == 'failed':
+                    # The worker could not process the batch at all
+                    _, batch_id, reason = message
+                    with self.lock:
+                        _, batch, _ = self.leases.pop(batch_id, (None, (), None))
+                    self._fail(batch, reason)
+
+                elif kind == 'request':
+                    if self.finished.is_set():
+                        connection.send(('done',))
+                        break
+
+                    batch_id, batch = self._lease(connection_id)
+                    if batch is None:
+                        connection.send(('wait', self.wait_interval))
+                    else:
+                        items = self._read_batch(batch)
+                        connection.send(('batch', batch_id, items))
+
+                else:
+                    raise ValueError(f"Unknown message kind {kind!r}")
+
+        except (EOFError, OSError) as e:
+            log.warning("Lost worker %s: %r", connection_id, e)
+        finally:
+            self._release(connection_id)
+            connection.close()
+
+    def serve(self, address):
+        listener = Listener(
+            address,
+            family  = _address_family(address),
+            authkey = check_authkey(address, self.authkey)
+        )
+        log.info("Coordinator listening on %s", listener.address)
+
+        def accept_loop():
+            connection_id = 0
+            while not self.finished.is_set():
+                try:
+                    connection = listener.accept()
+                except Exception:
+                    # Closed listener, or a client failing authentication
+                    if self.finished.is_set():
+                        break
+                    continue
+
+                threading.Thread(
+                    target = self._serve_connection,
+                    args   = (connection, connection_id),
+                    daemon = True
+                ).start()
+                connection_id += 1
+
+        threading.Thread(target=accept_loop, daemon=True).start()
+
+        try:
+            while not self.finished.wait(1):
+                pass
+
+            # Give idle workers a chance to hear that everything is done
+            time.sleep(self.wait_interval * 2)
+        finally:
+            listener.close()
+
+
+def _process(process_batch, dsl, batch_id, items):
+    # The reply for a batch. A batch that cannot be processed fails, rather
+    # than dropping the connection and going to the next worker.
+    try:
+        return ('result', batch_id, list(process_batch(dsl, items)))
+    except Exception as e:
+        log.exception("Could not process batch %d", batch_id)
+        return ('failed', batch_id, f'{type(e).__name__}: {e}')
+
+
+def run_worker(address, process_batch, authkey=None, retries=10, retry_delay=1.0):
+    """
+    Pull batches from the coordinator at `address` until it reports that all
+    work is done. `process_batch(dsl, items)` receives `(path, data)` pairs and
+    returns `(path, outcome)` pairs; if it raises, the batch's paths are
+    reported as failed. Connection failures are retried, so a worker may be
+    started before its coordinator.
+    """
+    authkey = check_authkey(address, authkey)
+    attempt = 0
+    while True:
+        try:
+            connection = Client(
+                address,
+                family  = _address_family(address),
+                authkey = authkey
+            )
+        except OSError:
+            attempt += 1
+            if attempt > retries:
+                raise
+            time.sleep(retry_delay)
+            continue
+
+        attempt = 0
+        try:
+            _, dsl = connection.recv()
+            while True:
+                connection.send(('request',))
+                message = connection.recv()
+                kind = message[0]
+
+                if kind == 'done':
+                    return
+                elif kind == 'wait':
+                    time.sleep(message[1])
+                elif kind == 'batch':
+                    _, batch_id, items = message
+                    connection.send(_process(process_batch, dsl, batch_id, items))
+
+        except (EOFError, OSError) as e:
+            # The coordinator finishing closes the socket too
+            log.warning("Connection to coordinator lost (%s): %r", os.getpid(), e)
+            attempt += 1
+            if attempt > retries:
+                return
+            time.sleep(retry_delay)
+        finally:
+            connection.close()
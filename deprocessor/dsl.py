@@ -3,13 +3,22 @@ Defines a DSL that can be used to describe parameters and actions to take on
 header files.
 """
 
+import logging
+from itertools import chain
+
 import regex as re
 
+from . import lexer
 from . import regexes
+from . import optimizer
+from . import templates
+
+
+log = logging.getLogger(__name__)
 
 # Note, this heavily uses "function-call" shorthand
 # provided by regexes.to_regex
-_dsl = regexes.to_regex(r"""
+_dsl_pattern = r"""
     (?(DEFINE)
         # Divider for syntactical elements
         (?P<syntax_edge> \s+ )
@@ -52,6 +61,13 @@ _dsl = regexes.to_regex(r"""
         [[syntax-edge]]
         END
     ) |
+    (
+        (?P<kind> EXCLUDE [[join]] CONTENT )
+        [[syntax-edge]]
+        (?P<value> [[ng_all]] )
+        [[syntax-edge]]
+        END
+    ) |
     (
         (?P<kind> DEFINE )
         [[syntax-edge]]
@@ -104,6 +120,17 @@ _dsl = regexes.to_regex(r"""
         [[syntax-edge]]
         END
     ) |
+    (
+        (?P<kind> ( ( PRE | POST ) [[join]] )? REPLACE [[join]] TOKEN )
+        [[syntax-edge]]
+        (?P<pattern> [[ng_all]] )
+        [[syntax-edge]]
+        WITH
+        [[syntax-edge]]
+        (?P<replacement> [[ng_all]] )
+        [[syntax-edge]]
+        END
+    ) |
     (
         (?P<kind> ( ( PRE | POST ) [[join]] )? REPLACE )
         [[syntax-edge]]
@@ -121,12 +148,89 @@ _dsl = regexes.to_regex(r"""
     )
 
     [[statement_edge]]?
-""")
+"""
+
+# The grammar takes a while to compile, so it is only compiled once something
+# is parsed
+_dsl = None
+
+
+def _grammar():
+    global _dsl
+    if _dsl is None:
+        _dsl = regexes.to_regex(_dsl_pattern)
+    return _dsl
+
+
+class Statement():
+    """
+    A single parsed DSL statement.
+    """
+    __slots__ = ('kind', 'key', 'value', 'pattern', 'replacement', 'text')
+
+    def __init__(self, kind, key=None, value=None, pattern=None, replacement=None, text=None):
+        self.kind = kind
+        self.key = key
+        self.value = value
+        self.pattern = pattern
+        self.replacement = replacement
+        self.text = text
+
+    def __repr__(self):
+        return f'Statement({self.text!r})'
+
+
+class Replacement():
+    """
+    A replacement rule. Unpacks as `(regex, replacement)`. The pattern is
+    compiled on first use of `regex`; a WITH clause is compiled up front into
+    a plain string or a `templates.Template`. `statements` holds the
+    statements the rule was built from, and `line_local` tells whether the
+    rule can be run over a file split at line ends. `reach` is how much text
+    before such a piece the rule needs to see, or None if it needs the whole
+    file (see `regexes.lookbehind_reach`). `scope` is 'token' for a REPLACE
+    TOKEN rule, whose pattern only ever matches whole identifiers (see
+    `lexer.TokenRegex`), and 'text' otherwise.
+    """
+    __slots__ = ('pattern', '_regex', 'replacement', 'statements', 'line_local', 'reach', 'scope')
+
+    def __init__(self, pattern, replacement, statements, scope='text'):
+        self.pattern = pattern
+        self._regex = None
+        if not callable(replacement):
+            replacement = templates.compile_template(replacement)
+        self.replacement = replacement
+        self.statements = statements
+        self.scope = scope
+        if scope == 'token':
+            # Identifiers are found by lexing the whole file
+            self.line_local = False
+            self.reach = None
+        else:
+            self.line_local = regexes.is_line_local(pattern)
+            self.reach = regexes.lookbehind_reach(pattern)
+
+    @property
+    def regex(self):
+        if self._regex is None:
+            regex = regexes.to_regex(self.pattern)
+            templates.check(self.replacement, regex)
+            if self.scope == 'token':
+                regex = lexer.TokenRegex(regex)
+            self._regex = regex
+        return self._regex
+
+    def __iter__(self):
+        return iter((self.regex, self.replacement))
+
+    def __repr__(self):
+        return f'Replacement({self.pattern!r}, {self.replacement!r})'
 
 
 class DSL():
     statement_kinds = [
         'EXCLUDE_PATH',
+        'EXCLUDE_CONTENT',
         'DEFINE',
         'UNDEFINE',
         'STRIP',
@@ -138,14 +242,24 @@ class DSL():
         'REPLACE',
         'PRE_REPLACE',
         'POST_REPLACE',
+        'REPLACE_TOKEN',
+        'PRE_REPLACE_TOKEN',
+        'POST_REPLACE_TOKEN',
     ]
 
-    def __init__(self, text):
+    def __init__(self, text, optimize=True, fold=True):
         statements = {k: [] for k in self.statement_kinds}
 
         for statement in self.gather_statements(text):
-            kind = re.sub('[-_ ]', '_', statement['kind'])
-            statements[kind].append(statement)
+            statements[statement.kind].append(statement)
+
+        # List of optimizer.Optimization records describing what the
+        # optimizer removed or folded.
+        self.optimize = optimize
+        self.fold = fold
+        self.optimizations = []
+        if optimize:
+            optimizer.optimize_statements(statements, self.optimizations)
 
         self.process_statements(statements)
 
@@ -160,7 +274,7 @@ class DSL():
         position = 0
         while position < len(text):
             # Get the next statement match
-            match = _dsl.match(text, pos=position)
+            match = _grammar().match(text, pos=position)
 
             if match is None:
                 end_position = min(
@@ -172,7 +286,25 @@ class DSL():
                 raise ValueError(msg)
 
             position = match.end()
-            yield match.groupdict() 
+
+            # The statement's own text, without surrounding comments
+            end = max(
+                match.end(group)
+                for group in ('kind', 'key', 'value', 'pattern', 'replacement')
+                if match[group] is not None
+            )
+            if text[end:match.end()].lstrip().startswith('END'):
+                end = text.index('END', end) + len('END')
+            source = text[match.start('kind'):end]
+
+            yield Statement(
+                kind        = re.sub('[-_ ]', '_', match['kind']),
+                key         = match['key'],
+                value       = match['value'],
+                pattern     = match['pattern'],
+                replacement = match['replacement'],
+                text        = ' '.join(source.split()),
+            )
 
 
     def process_statements(self, raw_statements):
@@ -182,30 +314,36 @@ class DSL():
 
         ## EXCLUDE PATH
         self.exclude_paths = [
-            regexes.to_regex(r['value'])
+            regexes.to_regex(r.value)
             for r in raw_statements['EXCLUDE_PATH']
         ]
 
+        ## EXCLUDE CONTENT
+        self.exclude_contents = [
+            regexes.to_regex(r.value)
+            for r in raw_statements['EXCLUDE_CONTENT']
+        ]
+
         ## DEFINE
         self.defines = [
-            rs['value']
+            rs.value
             for rs in raw_statements['DEFINE']
         ]
-        print("Defines", self.defines)
+        log.debug("Defines %s", self.defines)
 
         ## UNDEFINE
         self.undefines = [
-            rs['value']
+            rs.value
             for rs in raw_statements['UNDEFINE']
         ]
-        print("Undefines", self.undefines)
+        log.debug("Undefines %s", self.undefines)
 
         ## STRIP
         raw_statements['STRIP_SUFFIX'] += raw_statements['STRIP']
         raw_statements['STRIP_PREFIX'] += raw_statements['STRIP']
 
         r = lambda rs: rinsort([
-            rs['value']
+            rs.value
             for rs in raw_statements[rs]
         ])
 
@@ -214,13 +352,13 @@ class DSL():
 
         ## MAP TYPE
         self.type_map = dict(rinsort([
-            (rs['key'], rs['value'])
+            (rs.key, rs.value)
             for rs in raw_statements['MAP_TYPE']
         ]))
 
         ## MAP IDENTIFIER
         self.identifier_map = dict(rinsort([
-            (rs['key'], rs['value'])
+            (rs.key, rs.value)
             for rs in raw_statements['REWRITE_TOKEN']
         ]))
 
@@ -228,7 +366,7 @@ class DSL():
         # Regexes must be processed before replacements, since replacements
         # use them.
         self.regexes = {
-            r['key']: r['value']
+            r.key: r.value
             for r in raw_statements['REGEX']
         }
 
@@ -236,16 +374,56 @@ class DSL():
         raw_statements['PRE_REPLACE']  += raw_statements['REPLACE']
         raw_statements['POST_REPLACE'] += raw_statements['REPLACE']
 
-        r = lambda rs: [
-            (
-                regexes.to_regex(r['pattern'].format(**self.regexes)),
-                regexes.strip_lines(r['replacement'])
-            )
-            for r in raw_statements[rs]
-        ]
+        ## REPLACE TOKEN
+        raw_statements['PRE_REPLACE_TOKEN']  += raw_statements['REPLACE_TOKEN']
+        raw_statements['POST_REPLACE_TOKEN'] += raw_statements['REPLACE_TOKEN']
+
+        def r(rs):
+            rules = [
+                (
+                    r.pattern.format(**self.regexes),
+                    regexes.strip_lines(r.replacement),
+                    r
+                )
+                for r in raw_statements[rs]
+            ]
+            if self.optimize:
+                rules = optimizer.optimize_replacements(
+                    rules, rs, self.optimizations, fold=self.fold
+                )
+
+            # Token rules run after the stage's text rules, as they are given
+            token_rules = [
+                Replacement(
+                    r.pattern.format(**self.regexes),
+                    regexes.strip_lines(r.replacement),
+                    [r],
+                    scope = 'token',
+                )
+                for r in raw_statements[rs + '_TOKEN']
+            ]
+
+            return [
+                Replacement(
+                    pattern,
+                    replacement,
+                    source if isinstance(source, list) else [source]
+                )
+                for pattern, replacement, source in rules
+            ] + token_rules
 
         self.pre_replacements = r('PRE_REPLACE')
-        print(f'self.pre_replacements = {self.pre_replacements}')
+        log.debug("Pre replacements %s", self.pre_replacements)
         self.post_replacements = r('POST_REPLACE')
-        print(f'self.post_replacements = {self.post_replacements}')
+        log.debug("Post replacements %s", self.post_replacements)
+
 
+    def compile(self):
+        """
+        Compile every replacement rule now, rather than on first use, so that
+        bad patterns are reported up front and forked workers share the
+        compiled rules.
+        """
+        for replacement in chain(self.pre_replacements, self.post_replacements):
+            replacement.regex
+        return self
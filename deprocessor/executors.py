@@ -0,0 +1,152 @@
+"""
+Worker pools for the local pipeline.
+
+`process` is a `multiprocessing.Pool`: every task pickles its arguments,
+including the whole `DSL`, and every worker compiles and keeps its own copy of
+the rules. `thread` runs the same workers on threads of one process, sharing a
+single `DSL`; the replacement stages match with `concurrent=True`, which
+releases the GIL, and the tool stages spend their time waiting on
+subprocesses, so threads still run in parallel. `fork` forks its workers from
+a parent that already holds the compiled `DSL`, so the rules are shared
+copy-on-write and tasks carry no `DSL` at all.
+"""
+
+import gc
+import multiprocessing
+import pickle
+import queue
+import signal
+from multiprocessing import Pool, resource_tracker
+from multiprocessing.pool import ThreadPool
+
+from . import sinks, telemetry
+
+
+EXECUTORS = ('process', 'thread', 'fork')
+
+
+def can_fork():
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+# ## Preloaded DSL ## #
+_preloaded_dsl = None
+
+
+def _init_worker(dsl, events, sink, detail=False):
+    global _preloaded_dsl
+    _preloaded_dsl = dsl
+    if events is not None:
+        telemetry.attach_worker(events, detail)
+    if sink is not None:
+        sinks.attach(sink)
+
+
+def call_preloaded(task_worker, args):
+    """
+    Run `task_worker(dsl, *args)` with the DSL the worker was forked with.
+    """
+    return task_worker(_preloaded_dsl, *args)
+
+
+def call_star(task_worker, args):
+    return task_worker(*args)
+
+
+# ## Pools ## #
+def make_event_queue(executor):
+    """
+    Return a queue that workers of the given kind can send telemetry to.
+    """
+    if executor == 'thread':
+        return queue.Queue()
+    if executor == 'fork':
+        return multiprocessing.get_context('fork').Queue()
+    return multiprocessing.Queue()
+
+
+def make_pool(executor, processes, dsl=None, events=None, sink=None, max_tasks=None, detail=False):
+    """
+    Start a pool of `processes` workers of the given kind. All kinds share
+    the `multiprocessing.Pool` interface. `fork` pools need the `dsl` to
+    preload, and tasks for them are run through `call_preloaded`. Workers
+    send telemetry to `events`, from `make_event_queue`, with detail spans
+    when `detail` is on, and finished files to the `sink` queue of a
+    `sinks.StoreWriter`, if given. Process workers are replaced after
+    `max_tasks` tasks.
+    """
+    if executor == 'thread':
+        if events is not None:
+            telemetry.attach(events, detail)
+        if sink is not None:
+            sinks.attach(sink)
+        return ThreadPool(processes)
+
+    if executor == 'process':
+        context = None
+        initargs = (None, events, sink, detail)
+    elif executor == 'fork':
+        context = multiprocessing.get_context('fork')
+        initargs = (dsl, events, sink, detail)
+
+        # Move everything allocated so far, the compiled rules included, out
+        # of the collector's reach, so collections in the workers do not
+        # write to (and so copy) the pages they share with the parent.
+        gc.freeze()
+
+        # Workers must share the parent's resource tracker, which would
+        # otherwise report the shared memory blocks they unlink as leaked.
+        resource_tracker.ensure_running()
+    else:
+        raise ValueError(f"Unknown executor {executor!r}")
+
+    # Start the pool, using masks to correctly handle ctrl+c
+    original_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        if context is None:
+            return Pool(processes, _init_worker, initargs, max_tasks)
+        return context.Pool(processes, _init_worker, initargs, max_tasks)
+    finally:
+        signal.signal(signal.SIGINT, original_handler)
+
+
+# ## IPC accounting ## #
+class IPCMeter():
+    """
+    Count the bytes pickled into pool tasks and results.
+    """
+    def __init__(self):
+        self.tasks = 0
+        self.task_bytes = 0
+        self.result_bytes = 0
+
+    def measure_tasks(self, tasks):
+        for task in tasks:
+            self.tasks += 1
+            self.task_bytes += len(pickle.dumps(task))
+            yield task
+
+    def measure_result(self, result):
+        self.result_bytes += len(pickle.dumps(result))
+        return result
+
+    def report(self, executor, dsl):
+        """
+        Describe the traffic, next to what a `process` pool would have
+        pickled for the same tasks.
+        """
+        if not self.tasks:
+            return "IPC: no tasks"
+
+        per_task = self.task_bytes / self.tasks
+        lines = [
+            f"IPC ({executor}): {self.tasks} tasks, "
+            f"{per_task:,.0f} bytes per task, "
+            f"{self.result_bytes / self.tasks:,.0f} bytes per result"
+        ]
+        if executor == 'fork':
+            dsl_bytes = len(pickle.dumps(dsl))
+            lines.append(
+                f"  without the preloaded DSL: {per_task + dsl_bytes:,.0f} bytes per task"
+            )
+        return '\n'.join(lines)
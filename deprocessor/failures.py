@@ -0,0 +1,60 @@
+"""
+A per-run report of files that failed a pipeline stage.
+
+Each failure is appended as one JSON line holding the path, the stage, the
+tool's arguments, its exit code, its stderr and how long it ran, so the input
+files stay untouched and a later run can retry just the failures.
+"""
+
+import json
+import time
+
+from . import telemetry
+from .steps import append_json_line
+
+
+class FailureSink():
+    def __init__(self, path):
+        self.path = path
+
+    def reset(self):
+        with open(self.path, 'w'):
+            pass
+
+    def record(self, path, stage, args=None, returncode=None, stderr='', duration=0.0, report=True):
+        """
+        Append a failure. With `report` off, no telemetry event is sent, for
+        failures forwarded from a worker that already reported them.
+        """
+        entry = dict(
+            path       = path,
+            stage      = stage,
+            args       = list(args) if args is not None else None,
+            returncode = returncode,
+            stderr     = stderr,
+            duration   = round(duration, 6),
+            time       = time.time(),
+        )
+        append_json_line(self.path, entry)
+        if report:
+            telemetry.failure(stage, path)
+        return entry
+
+    def load(self):
+        try:
+            fh = open(self.path, 'r')
+        except FileNotFoundError:
+            return []
+
+        records = []
+        with fh:
+            for line in fh:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+
+        return records
+
+    def failed_paths(self):
+        return list(dict.fromkeys(r['path'] for r in self.load()))
@@ -0,0 +1,376 @@
+"""
+Find C identifiers that Nim's style-insensitive identifier rules would merge,
+and generate the REWRITE TOKEN rules that keep them apart.
+
+Nim compares identifiers by their first character, then the rest of the name
+with case and underscores ignored, so `HDITEM` and `HD_ITEM`, or
+`WriteCacheType` and `WRITE_CACHE_TYPE`, are the same name. Indexing is a
+map-reduce: every header is lexed on its own into the names it declares,
+with what kind of thing each one is, and the per-file results are merged
+into one table keyed on the Nim form of each name.
+
+The per-file results are kept in an index file along with each file's size
+and modification time, so later runs only re-read headers that changed.
+
+Declarations are found with a lightweight lexer and a few heuristics rather
+than a C parser: `#define`s, enumerators, typedef names, struct, union and
+enum tags, function prototypes and top-level variables.
+"""
+
+import json
+import os
+
+import regex as re
+
+
+# Tokens are told apart by their first character. There are no groups, so
+# `findall` returns plain strings, which is much faster than building a
+# Match per token.
+_token_regex = re.compile(r'''
+    //[^\n]* | /\*.*?\*/
+  | ^[ \t]* \# (?: [^\n\\] | \\. )*
+  | " (?: [^"\\\n] | \\. )* " | ' (?: [^'\\\n] | \\. )* '
+  | [A-Za-z_]\w*
+  | [{}()\[\];,=*]
+''', re.VERBOSE | re.MULTILINE | re.DOTALL)
+
+_define_regex = re.compile(r'[ \t]*\#[ \t]*define[ \t]+([A-Za-z_]\w*)')
+
+_ident_start = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_')
+
+_tag_keywords = {'struct', 'union', 'enum'}
+
+# Identifiers that look like function names, but are attributes
+_attributes = {'__attribute__', '__declspec', '__pragma', '_Pragma', 'alignas', '_Alignas'}
+
+# Kinds that get a descriptive suffix, which later REPLACE rules strip again
+SUFFIX_KINDS = ('Proc', 'Const', 'Type', 'Enum')
+
+
+# ## Names ## #
+def nim_normalize(name):
+    return name[:1] + name[1:].replace('_', '').lower()
+
+
+def strip_affixes(name, prefixes=(), suffixes=()):
+    """
+    Strip the first matching prefix and suffix, as toast's --prefix and
+    --suffix options do.
+    """
+    for prefix in prefixes:
+        if name.startswith(prefix) and len(name) > len(prefix):
+            name = name[len(prefix):]
+            break
+    for suffix in suffixes:
+        if name.endswith(suffix) and len(name) > len(suffix):
+            name = name[:-len(suffix)]
+            break
+    return name
+
+
+def suffixed(name, label):
+    """
+    Add a collision suffix in the style of `name`: `_IS_NIM_TYPE` for
+    upper-case names, `IsNimType` otherwise.
+    """
+    if name.upper() == name:
+        return f'{name}_IS_NIM_{label.upper()}'
+    return f'{name}IsNim{label}'
+
+
+# ## Map ## #
+def declarations(data):
+    """
+    Return a dict mapping each name declared in C source `data` to the set
+    of kinds it is declared as.
+    """
+    found = {}
+    add = lambda name, kind: found.setdefault(name, set()).add(kind)
+    is_ident = lambda token: token[0] in _ident_start
+
+    # Top-level tokens of the current statement, with their paren depth
+    statement = []
+    braces = []
+    parens = 0
+    expect_enumerator = False
+
+    def close_statement():
+        tokens = statement[:]
+        statement.clear()
+
+        idents = [text for text, _ in tokens if is_ident(text)]
+        if not idents:
+            return
+
+        if idents[0] == 'typedef':
+            for index, (text, depth) in enumerate(tokens[:-1]):
+                if not is_ident(text):
+                    continue
+                following = tokens[index + 1][0]
+                # `* NAME )` names a function pointer type
+                if index and tokens[index - 1][0] == '*' and following == ')':
+                    add(text, 'Type')
+                # Otherwise the name ends a declarator
+                elif depth == 0 and following in (',', ';', '['):
+                    add(text, 'Type')
+            return
+
+        if tokens[-1][0] in (';', '{') and len(tokens) > 1 and tokens[-2][0] == ')':
+            # A prototype or definition: the name before the last top-level
+            # parameter list, after at least a return type
+            for index in range(len(tokens) - 2, 0, -1):
+                text, depth = tokens[index]
+                if text == '(' and depth == 0:
+                    name = tokens[index - 1][0]
+                    if name in _attributes:
+                        continue
+                    if is_ident(name) and index > 1:
+                        add(name, 'Proc')
+                    break
+            return
+
+        if tokens[-1][0] == ';' and len(idents) > 1 and all(text != '(' for text, _ in tokens):
+            # A variable: the name before the initializer or the end
+            for index, (text, _) in enumerate(tokens[:-1]):
+                following = tokens[index + 1][0]
+                if is_ident(text) and following in (',', ';', '=', '['):
+                    if text not in _tag_keywords:
+                        add(text, 'Var')
+                    if following == '=':
+                        break
+
+    for token in _token_regex.findall(data):
+        first = token[0]
+        if first in ' \t#':
+            define = _define_regex.match(token)
+            if define:
+                add(define[1], 'Const')
+            continue
+        if first == '/':
+            continue
+        if first in '"\'':
+            if statement and statement[-1][0] == 'extern':
+                statement.append((token, parens))
+            continue
+
+        if braces and braces[-1][0] == 'enum':
+            if expect_enumerator and first in _ident_start and parens == braces[-1][1]:
+                add(token, 'Enum')
+                expect_enumerator = False
+            elif token == ',' and parens == braces[-1][1]:
+                expect_enumerator = True
+            elif token == '(':
+                parens += 1
+            elif token == ')':
+                parens -= 1
+            elif token == '}':
+                braces.pop()
+                if not braces:
+                    statement.append(('}', parens))
+            continue
+
+        if token == '{':
+            if braces:
+                braces.append(('block', parens))
+            elif len(statement) >= 2 and statement[-2][0] == 'extern' and statement[-1][0][0] == '"':
+                # extern "C" blocks are transparent
+                statement.clear()
+            elif 'enum' in (text for text, _ in statement[-2:]):
+                # `enum {` or `enum TAG {`
+                braces.append(('enum', parens))
+                expect_enumerator = True
+            elif statement and statement[-1][0] == ')':
+                # A function definition: record it, and skip the body
+                statement.append(('{', parens))
+                close_statement()
+                braces.append(('body', parens))
+            else:
+                braces.append(('block', parens))
+            continue
+
+        if token == '}':
+            if braces:
+                block_kind, _ = braces.pop()
+                if not braces and block_kind != 'body':
+                    statement.append(('}', parens))
+            continue
+
+        if braces:
+            # Members of structs and unions, and function bodies
+            continue
+
+        if token == '(':
+            statement.append(('(', parens))
+            parens += 1
+        elif token == ')':
+            parens = max(parens - 1, 0)
+            statement.append((')', parens))
+        else:
+            if first in _ident_start and statement and statement[-1][0] in _tag_keywords:
+                add(token, 'Type')
+            statement.append((token, parens))
+            if token == ';' and parens == 0:
+                close_statement()
+
+    return found
+
+
+def index_file(path):
+    """
+    Map step: return `(path, entry)`, where the entry records the file's
+    size, modification time and declarations, or `(path, None)` if the file
+    could not be read.
+    """
+    try:
+        info = os.stat(path)
+        with open(path, 'r', errors='replace') as fh:
+            data = fh.read()
+    except OSError:
+        return path, None
+
+    names = declarations(data)
+    return path, {
+        'size'    : info.st_size,
+        'mtime_ns': info.st_mtime_ns,
+        'names'   : {name: sorted(kinds) for name, kinds in names.items()},
+    }
+
+
+# ## Reduce ## #
+class IdentifierIndex():
+    """
+    Per-file declarations, stored in a JSON file at `path` and refreshed
+    incrementally with `update`.
+    """
+    version = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as fh:
+                state = json.load(fh)
+        except (OSError, ValueError):
+            return self
+
+        if state.get('version') == self.version:
+            self.files = state['files']
+        return self
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as fh:
+            json.dump({'version': self.version, 'files': self.files}, fh)
+        os.replace(temp_path, self.path)
+
+    def stale(self, paths):
+        """
+        Return the paths whose entries are missing or out of date.
+        """
+        stale = []
+        for path in paths:
+            entry = self.files.get(path)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            if (entry is None
+                    or entry['size'] != info.st_size
+                    or entry['mtime_ns'] != info.st_mtime_ns):
+                stale.append(path)
+        return stale
+
+    def update(self, paths, map_function=map):
+        """
+        Re-index the stale files among `paths` through `map_function` (for
+        instance a pool's `imap_unordered`), and forget files not in `paths`.
+        Returns `(reindexed, removed)` counts.
+        """
+        paths = list(paths)
+        wanted = set(paths)
+        removed = [path for path in self.files if path not in wanted]
+        for path in removed:
+            del self.files[path]
+
+        stale = self.stale(paths)
+        for path, entry in map_function(index_file, stale):
+            if entry is None:
+                self.files.pop(path, None)
+            else:
+                self.files[path] = entry
+
+        return len(stale), len(removed)
+
+    def table(self):
+        """
+        Merge the per-file results into one dict of name to kinds.
+        """
+        table = {}
+        for entry in self.files.values():
+            for name, kinds in entry['names'].items():
+                table.setdefault(name, set()).update(kinds)
+        return table
+
+
+def collisions(table, identifier_map=None, prefixes=(), suffixes=()):
+    """
+    Group the names in `table` that Nim would consider the same, after
+    `identifier_map` rewrites and affix stripping. Returns a list of dicts
+    mapping each C name in a group to its kinds.
+    """
+    identifier_map = identifier_map or {}
+    groups = {}
+    for name, kinds in table.items():
+        nim_name = strip_affixes(identifier_map.get(name, name), prefixes, suffixes)
+        groups.setdefault(nim_normalize(nim_name), {})[name] = kinds
+
+    result = []
+    for members in groups.values():
+        spellings = {
+            strip_affixes(identifier_map.get(name, name), prefixes, suffixes)
+            for name in members
+        }
+        if len(spellings) > 1:
+            result.append(members)
+
+    return result
+
+
+def kind_of(kinds):
+    for kind in SUFFIX_KINDS:
+        if kind in kinds:
+            return kind
+    return None
+
+
+def rewrite_rules(groups, identifier_map=None):
+    """
+    Return `(name, new_name)` rewrites separating every colliding group.
+    Members of a group are suffixed with their kind when every member's kind
+    is distinct, and numbered otherwise. Names the DSL already rewrites are
+    left alone.
+    """
+    identifier_map = identifier_map or {}
+    rules = []
+    for members in groups:
+        names = sorted(members)
+        kinds = [kind_of(members[name]) for name in names]
+        distinct = None not in kinds and len(set(kinds)) == len(kinds)
+
+        for number, (name, kind) in enumerate(zip(names, kinds), 1):
+            if name in identifier_map:
+                continue
+            label = kind if distinct else str(number)
+            rules.append((name, suffixed(name, label)))
+
+    rules.sort(key=lambda rule: (nim_normalize(rule[0]), rule[0]), reverse=True)
+    return rules
+
+
+def format_rules(rules):
+    return ''.join(
+        f'REWRITE TOKEN {name:<40} TO {new_name:<55} END\n'
+        for name, new_name in rules
+    )
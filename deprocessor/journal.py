@@ -0,0 +1,91 @@
+"""
+A durable, append-only record of per-file stage completion, used to resume
+interrupted runs.
+
+Every stage that rewrites a file records a `begin` entry holding a digest of
+the data about to be written, then a `done` entry once the write has landed.
+Each entry is fsync'd before the pipeline moves on. When a run is resumed, a
+`begin` without a matching `done` is settled by comparing the file on disk to
+the recorded digest, so a crash between the write and its `done` entry never
+causes a replacement stage to be applied twice.
+"""
+
+import hashlib
+import json
+
+from .steps import append_json_line
+
+
+def _digest(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+class Journal():
+    def __init__(self, path):
+        self.path = path
+
+    def reset(self):
+        with open(self.path, 'w'):
+            pass
+
+    def begin(self, path, stage, data=None, digest=None):
+        """
+        Record that `data` is about to be written to `path`. Writers that
+        never hold all of the data pass its SHA-256 `digest` instead.
+        """
+        if digest is None:
+            digest = _digest(data)
+        append_json_line(
+            self.path,
+            dict(path=path, stage=stage, state='begin', digest=digest),
+            sync=True
+        )
+
+    def done(self, path, stage):
+        append_json_line(
+            self.path,
+            dict(path=path, stage=stage, state='done'),
+            sync=True
+        )
+
+    def load(self):
+        """
+        Return a dict mapping each path to the set of stages completed for it.
+        """
+        completed = {}
+        in_flight = {}
+
+        try:
+            fh = open(self.path, 'r')
+        except FileNotFoundError:
+            return completed
+
+        with fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash
+                    continue
+
+                key = (entry['path'], entry['stage'])
+                if entry['state'] == 'begin':
+                    in_flight[key] = entry['digest']
+                else:
+                    in_flight.pop(key, None)
+                    completed.setdefault(entry['path'], set()).add(entry['stage'])
+
+        # Settle writes that may have landed without being recorded
+        for (path, stage), digest in in_flight.items():
+            try:
+                with open(path, 'rb') as fh:
+                    landed = _digest(fh.read()) == digest
+            except OSError:
+                landed = False
+
+            if landed:
+                completed.setdefault(path, set()).add(stage)
+
+        return completed
@@ -0,0 +1,340 @@
+"""
+A fast C lexer shared by the text stages.
+
+`tokenize` splits a file into compact arrays of token spans in one scan, and
+keeps them for the last few texts it saw, so the stages that look at the same
+text one after another (identifier rules, include discovery, comment
+stripping, marker removal, conditional evaluation) share a single lexing
+pass, and none of them misfires inside a comment or a string literal.
+
+Whitespace is not kept. A directive is lexed as its `#` and name, followed by
+the tokens of the rest of its line, except for `#include`, which is one
+token holding the header name too.
+"""
+
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import accumulate, chain, compress, repeat
+from operator import add, itemgetter, methodcaller
+
+
+# ## Tokens ## #
+IDENTIFIER, NUMBER, STRING, CHARACTER, COMMENT, DIRECTIVE, INCLUDE, PUNCTUATION = range(8)
+
+KIND_NAMES = (
+    'identifier', 'number', 'string', 'character',
+    'comment', 'directive', 'include', 'punctuation',
+)
+
+_SPACE = 255
+
+# Tokens cover the text without gaps, so `findall` can return plain strings,
+# which is much faster than building a Match per token, and each span's
+# start is the sum of the lengths before it. Kinds are told apart by the
+# first character. The pattern needs nothing from the `regex` module, and
+# the standard library's engine runs it twice as fast.
+_token_regex = re.compile(r'''
+    \s+ | \\\r?\n
+  | //(?:[^\n\\]|\\.)* | /\*.*?(?:\*/|\Z)
+  | \#[ \t]* include(?:_next)? [ \t]* (?: <[^>\n]*> | "[^"\n]*" )
+  | \#[ \t]* \w*
+  | (?:u8|[LuU])? " (?: [^"\\\n] | \\. )* "?
+  | (?:u8|[LuU])? ' (?: [^'\\\n] | \\. )* '?
+  | [A-Za-z_]\w*
+  | \.?[0-9](?:[eEpP][-+]|[\w.])*
+  | .
+''', re.VERBOSE | re.DOTALL)
+
+# A name that lexes as an identifier wherever it is put
+_identifier_regex = re.compile(r'(?!(?:u8|[LuU])\Z)[A-Za-z_]\w*')
+
+_first_kinds = dict.fromkeys(map(chr, range(128)), PUNCTUATION)
+_first_kinds.update(dict.fromkeys(' \t\r\n\f\v', _SPACE))
+_first_kinds.update(dict.fromkeys('ABCDEFGHIJKMNOPQRSTVWXYZabcdefghijklmnopqrstvwxyz_', IDENTIFIER))
+_first_kinds.update(dict.fromkeys('0123456789', NUMBER))
+_first_kinds.update({'"': STRING, "'": CHARACTER})
+# Decided by `_kind_of`
+for _first in 'LuU/#.\\':
+    del _first_kinds[_first]
+
+
+def _kind_of(data, text, start):
+    # The kinds that need more than the first character. None marks a `#`
+    # inside a line, which is only punctuation, and whatever follows it is
+    # lexed again.
+    first = text[0]
+    if first in 'LuU':
+        if '"' in text[:3]:
+            return STRING
+        if "'" in text[:3]:
+            return CHARACTER
+        return IDENTIFIER
+    if first == '/':
+        return COMMENT if text[1:2] in ('/', '*') else PUNCTUATION
+    if first == '#':
+        if len(text) == 1:
+            return PUNCTUATION
+        line_start = data.rfind('\n', 0, start) + 1
+        if data[line_start:start].strip(' \t'):
+            return None
+        return INCLUDE if text[-1] in '>"' else DIRECTIVE
+    if first == '.':
+        return NUMBER if len(text) > 1 else PUNCTUATION
+    if first == '\\':
+        return _SPACE if len(text) > 1 else PUNCTUATION
+    if first.isspace():
+        return _SPACE
+    if first.isalpha():
+        return IDENTIFIER
+    return PUNCTUATION
+
+
+class Tokens():
+    """
+    The token spans of `data`, as parallel arrays of kinds, start and end
+    offsets.
+    """
+    __slots__ = ('data', 'kinds', 'starts', 'ends')
+
+    def __init__(self, data, kinds, starts, ends):
+        self.data = data
+        self.kinds = kinds
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def spans(self, *kinds):
+        """
+        Yield `(kind, start, end)` for every token, or those of `kinds`.
+        """
+        if not kinds:
+            return zip(self.kinds, self.starts, self.ends)
+
+        # Searching the kinds as bytes finds the tokens without a Python
+        # loop over all of them
+        kinds_regex = re.compile(b'[' + re.escape(bytes(kinds)) + b']')
+        return (
+            (self.kinds[index], self.starts[index], self.ends[index])
+            for index in map(methodcaller('start'), kinds_regex.finditer(self.kinds.tobytes()))
+        )
+
+
+def _lex(data):
+    texts = _token_regex.findall(data)
+
+    while True:
+        ends = list(accumulate(map(len, texts)))
+        kinds = list(map(_first_kinds.get, map(itemgetter(0), texts)))
+
+        # Fill in the kinds the first character leaves open
+        split = False
+        for index, kind in enumerate(kinds):
+            if kind is None:
+                text = texts[index]
+                kind = kinds[index] = _kind_of(data, text, ends[index] - len(text))
+                split = split or kind is None
+        if not split:
+            break
+
+        texts = list(chain.from_iterable(
+            ['#', *_token_regex.findall(text[1:])] if kind is None else [text]
+            for text, kind in zip(texts, kinds)
+        ))
+
+    keep = [kind != _SPACE for kind in kinds]
+    texts = compress(texts, keep)
+    ends = list(compress(ends, keep))
+    starts = map(int.__sub__, ends, map(len, texts))
+    return Tokens(data, array('B', compress(kinds, keep)), array('L', starts), array('L', ends))
+
+
+# ## Cache ## #
+# Keyed on the text itself: a str caches its hash, and comparing a text with
+# itself is an identity check, so looking up the text a stage was handed
+# costs nothing once it has been hashed.
+CACHE_SIZE = 4
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _remember(tokens):
+    with _cache_lock:
+        _cache[tokens.data] = tokens
+        while len(_cache) > CACHE_SIZE:
+            del _cache[next(iter(_cache))]
+
+
+def tokenize(data):
+    """
+    Return the `Tokens` of `data`, lexing it only if it is not one of the
+    last `CACHE_SIZE` texts seen.
+    """
+    with _cache_lock:
+        tokens = _cache.get(data)
+    if tokens is not None:
+        return tokens
+
+    tokens = _lex(data)
+    _remember(tokens)
+    return tokens
+
+
+# ## Stages ## #
+def strip_comments(data, replacement=' '):
+    """
+    Replace every comment in `data` with `replacement`.
+    """
+    pieces = []
+    position = 0
+    for _, start, end in tokenize(data).spans(COMMENT):
+        pieces.append(data[position:start])
+        pieces.append(replacement)
+        position = end
+    if not pieces:
+        return data
+    pieces.append(data[position:])
+    return ''.join(pieces)
+
+
+def find_comments(data, text):
+    """
+    Return the `(start, end)` spans of the comments in `data` that start
+    with `text`, such as `//MARKER`.
+    """
+    return [
+        (start, end)
+        for _, start, end in tokenize(data).spans(COMMENT)
+        if data.startswith(text, start)
+    ]
+
+
+def includes(data):
+    """
+    Return the `(start, end)` spans of the `#include` directives in `data`.
+    """
+    return [(start, end) for _, start, end in tokenize(data).spans(INCLUDE)]
+
+
+def _shifted(tokens, data, edits):
+    # The tokens of `data`, which is `tokens.data` with some identifiers
+    # replaced by others, given `(start, end, delta)` edits in order
+    starts = array('L')
+    ends = array('L')
+    shift = 0
+    index = 0
+    for start, end, delta in edits:
+        position = bisect_left(tokens.starts, start, index)
+        starts.extend(map(add, tokens.starts[index:position + 1], repeat(shift)))
+        ends.extend(map(add, tokens.ends[index:position], repeat(shift)))
+        ends.append(end + shift + delta)
+        shift += delta
+        index = position + 1
+    starts.extend(map(add, tokens.starts[index:], repeat(shift)))
+    ends.extend(map(add, tokens.ends[index:], repeat(shift)))
+    return Tokens(data, tokens.kinds, starts, ends)
+
+
+def sub_identifiers(rules, data):
+    """
+    Apply `(regex, repl)` rules in order to the identifiers of `data`, each
+    rule replacing the identifiers it matches in full, as `regex.subn` would.
+    Returns the new text and each rule's number of replacements. The text is
+    lexed once for all the rules, and each distinct name is matched once.
+    When every replacement is an identifier, the new text's tokens are
+    derived from the old ones and cached, rather than lexed again.
+    """
+    counts = []
+    tokens = spans = original = occurrences = None
+
+    for regex, repl in rules:
+        if tokens is None:
+            tokens = tokenize(data)
+            spans = [(start, end) for _, start, end in tokens.spans(IDENTIFIER)]
+            original = [data[start:end] for start, end in spans]
+            # How often each current name occurs, and the original names
+            # that have become it
+            occurrences = Counter(original)
+            owners = {name: [name] for name in occurrences}
+
+        mapping = {}
+        count = 0
+        for name, occurrence_count in occurrences.items():
+            match = regex.fullmatch(name)
+            if match is None:
+                continue
+            mapping[name] = repl(match) if callable(repl) else match.expand(repl)
+            count += occurrence_count
+        counts.append(count)
+
+        # Rename from the names as they were before the rule, all at once, so
+        # no name is renamed twice by one rule, nor merged away in a swap
+        if any(new != name for name, new in mapping.items()):
+            renamed_occurrences = Counter()
+            renamed_owners = {}
+            for name, occurrence_count in occurrences.items():
+                new = mapping.get(name, name)
+                renamed_occurrences[new] += occurrence_count
+                renamed_owners.setdefault(new, []).extend(owners[name])
+            occurrences, owners = renamed_occurrences, renamed_owners
+
+    renamed = {
+        old: name
+        for name, olds in (owners.items() if tokens is not None else ())
+        for old in olds
+        if old != name
+    }
+    if not renamed:
+        return data, counts
+
+    # Rebuild the text from the pieces between identifiers
+    pieces = []
+    edits = []
+    position = 0
+    for start, end in spans:
+        new = renamed.get(data[start:end])
+        if new is not None:
+            pieces.append(data[position:start])
+            pieces.append(new)
+            edits.append((start, end, len(new) - (end - start)))
+            position = end
+    pieces.append(data[position:])
+    new_data = ''.join(pieces)
+
+    if all(map(_identifier_regex.fullmatch, renamed.values())):
+        _remember(_shifted(tokens, new_data, edits))
+    return new_data, counts
+
+
+class TokenRegex():
+    """
+    A compiled pattern scoped to identifier tokens: `subn` only replaces
+    identifiers the pattern matches in full, never text inside comments or
+    string literals, nor part of a longer name.
+    """
+    __slots__ = ('regex',)
+
+    def __init__(self, regex):
+        self.regex = regex
+
+    @property
+    def pattern(self):
+        return self.regex.pattern
+
+    def fullmatch(self, string):
+        return self.regex.fullmatch(string)
+
+    def subn(self, repl, data, concurrent=None):
+        data, (count,) = sub_identifiers([(self, repl)], data)
+        return data, count
+
+    def sub(self, repl, data, concurrent=None):
+        return self.subn(repl, data)[0]
+
+    def __repr__(self):
+        return f'TokenRegex({self.regex.pattern!r})'
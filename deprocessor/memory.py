@@ -0,0 +1,343 @@
+"""
+Memory-aware scheduling for the local pool.
+
+Without limits, a pool hands out chunks as fast as workers take them, so a
+few giant headers landing on different workers at once can push the machine
+into swap, and long-lived workers keep whatever memory they once needed.
+
+`Admission` sits between the task generator and the pool. Each chunk is
+weighed by its largest file, since the stages pass files through one at a
+time, and admitted only while the estimated memory of the chunks in flight
+(weight times an expansion factor, learned from the peak memory workers
+report after each chunk) fits the budget. It also lowers the number of
+chunks in flight while the system runs low on free memory, and raises it
+again once memory is back.
+
+Workers run their tasks through `call_measured`, which reports the memory a
+chunk took, and whether the worker has passed its RSS threshold. The pool
+replaces each worker after a number of tasks itself (`maxtasksperchild`);
+for RSS, `Admission` sets `recycle`, and the caller stops feeding the pool,
+lets it drain, and starts a fresh one. Memory is read from `/proc`; where it
+is not available, nothing is learned or recycled for RSS.
+"""
+
+import logging
+import os
+import threading
+import time
+
+
+log = logging.getLogger('deprocessor')
+
+# Peak memory of a chunk over its largest file, before any is measured
+DEFAULT_EXPANSION = 8.0
+
+# Below this, a worker's fixed costs (compiling rules on first use, starting
+# tools) swamp what a file adds, so smaller chunks teach nothing
+LEARN_MIN_WEIGHT = 1024 * 1024
+
+MB = 1024 * 1024
+
+
+# ## Measuring ## #
+def read_rss(pid='self'):
+    """
+    Return the proportional (or failing that, resident) set size of `pid` in
+    bytes, or None.
+    """
+    sources = (
+        (f'/proc/{pid}/smaps_rollup', 'Pss:'),
+        (f'/proc/{pid}/status', 'VmRSS:'),
+    )
+    for path, field in sources:
+        try:
+            with open(path, 'r') as fh:
+                for line in fh:
+                    if line.startswith(field):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError):
+            pass
+
+    return None
+
+
+def available_memory():
+    """
+    Return the memory the system can give out without swapping, in bytes, or
+    None.
+    """
+    try:
+        with open('/proc/meminfo', 'r') as fh:
+            for line in fh:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _reset_peak():
+    # Reset the kernel's peak RSS (VmHWM) of this process, so the peak read
+    # after a task is that task's own
+    try:
+        with open('/proc/self/clear_refs', 'w') as fh:
+            fh.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _read_status(field):
+    # A size from /proc/self/status, such as VmRSS or VmHWM, in bytes
+    try:
+        with open('/proc/self/status', 'r') as fh:
+            for line in fh:
+                if line.startswith(field):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+# ## Worker side ## #
+_tasks_done = 0
+
+
+def call_measured(call, task, measure=True, max_tasks=None, max_rss=None):
+    """
+    Run `call(args)` for a `(ticket, args)` task from `Admission.admit`,
+    returning `(ticket, usage, result)`. `usage` holds the worker's pid, its
+    RSS before and after, the peak growth during the task when `measure` is
+    on, and why the worker is due to retire, if it is: 'rss' past `max_rss`,
+    or 'tasks' on its last task of `max_tasks`.
+    """
+    global _tasks_done
+
+    ticket, args = task
+    usage = {'pid': os.getpid(), 'before': None, 'after': None, 'growth': None, 'retire': None}
+    if measure:
+        usage['before'] = read_rss()
+        # Growth is measured in RSS, as the kernel only tracks its peak
+        rss_before = _read_status('VmRSS:') if _reset_peak() else None
+
+    result = call(args)
+
+    _tasks_done += 1
+    if measure:
+        usage['after'] = read_rss()
+        peak = _read_status('VmHWM:') if rss_before is not None else None
+        if peak is not None:
+            usage['growth'] = max(peak - rss_before, 0)
+
+    if max_rss and usage['after'] is not None and usage['after'] > max_rss:
+        usage['retire'] = 'rss'
+    elif max_tasks and _tasks_done == max_tasks:
+        usage['retire'] = 'tasks'
+
+    return ticket, usage, result
+
+
+# ## Parent side ## #
+class Admission():
+    """
+    Admit tasks into a pool of `processes` workers while their estimated
+    memory fits `budget` bytes (no limit when None), and while fewer tasks
+    than the current concurrency limit are in flight. The limit drops by one
+    whenever available memory is below `min_free` bytes, and comes back up
+    once there is twice that. A task that does not fit on its own is still
+    admitted when nothing else is in flight. `recycle` is set once a worker
+    reports passing its RSS limit, for the caller to replace the pool.
+    """
+    poll_interval = 0.5
+    lower_cooldown = 2.0
+    raise_cooldown = 10.0
+    alpha = 0.3
+
+    def __init__(self, processes, budget=None, min_free=None, depth=2):
+        self.processes = processes
+        self.budget = budget
+        self.min_free = min_free
+        self.depth = depth
+        self.limit = processes
+        self.expansion = DEFAULT_EXPANSION
+
+        self.condition = threading.Condition()
+        self.running = {}
+        self.reserved = 0
+        self.next_ticket = 0
+        self.cancelled = False
+        self.last_change = 0.0
+        self.recycle = threading.Event()
+
+        # For the summary
+        self.started = time.perf_counter()
+        self.decisions = []
+        self.measured = 0
+        self.held = 0
+        self.longest_wait = 0.0
+        self.peak_rss = None
+        self.recycled = {}
+
+    def estimate(self, weight):
+        return int(weight * self.expansion)
+
+    def _decide(self, message, *args):
+        elapsed = time.perf_counter() - self.started
+        self.decisions.append((elapsed, message % args))
+        log.info("Memory: " + message, *args)
+
+    def _adapt(self):
+        # Lower or raise the concurrency limit from available memory
+        if not self.min_free:
+            return
+        free = available_memory()
+        if free is None:
+            return
+
+        now = time.perf_counter()
+        since = now - self.last_change
+        if free < self.min_free and self.limit > 1 and since >= self.lower_cooldown:
+            self.limit -= 1
+            self.last_change = now
+            self._decide("%d MB free, lowering concurrency to %d", free // MB, self.limit)
+        elif free > 2 * self.min_free and self.limit < self.processes and since >= self.raise_cooldown:
+            self.limit += 1
+            self.last_change = now
+            self._decide("%d MB free, raising concurrency to %d", free // MB, self.limit)
+
+    def _fits(self, estimate):
+        if not self.running:
+            return True
+        # At full concurrency, keep tasks queued ahead of the workers
+        cap = self.limit if self.limit < self.processes else self.processes * self.depth
+        if len(self.running) >= cap:
+            return False
+        return self.budget is None or self.reserved + estimate <= self.budget
+
+    def acquire(self, weight):
+        """
+        Wait until a task of `weight` bytes may run, and return its ticket.
+        """
+        with self.condition:
+            estimate = self.estimate(weight)
+            self._adapt()
+
+            waited = 0.0
+            if not self._fits(estimate):
+                self.held += 1
+                start = time.perf_counter()
+                while not self.cancelled and not self._fits(estimate):
+                    self.condition.wait(self.poll_interval)
+                    self._adapt()
+                waited = time.perf_counter() - start
+                self.longest_wait = max(self.longest_wait, waited)
+
+            if self.budget is not None and estimate > self.budget:
+                self._decide(
+                    "admitted a %d MB task alone, over the %d MB budget",
+                    estimate // MB, self.budget // MB
+                )
+
+            ticket = self.next_ticket
+            self.next_ticket += 1
+            self.running[ticket] = (weight, estimate)
+            self.reserved += estimate
+            return ticket
+
+    def release(self, ticket, usage):
+        """
+        Account for a finished task, learning from its `usage`.
+        """
+        with self.condition:
+            weight, estimate = self.running.pop(ticket)
+            self.reserved -= estimate
+
+            if usage is not None:
+                self._learn(weight, usage)
+
+            self._adapt()
+            self.condition.notify_all()
+
+    def _learn(self, weight, usage):
+        if usage['growth'] is not None and weight >= LEARN_MIN_WEIGHT:
+            observed = usage['growth'] / weight
+            # Rise at once, but come down slowly
+            if observed > self.expansion:
+                self.expansion = observed
+            else:
+                self.expansion += self.alpha * (observed - self.expansion)
+            self.measured += 1
+
+        for rss in (usage['before'], usage['after']):
+            if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+                self.peak_rss = rss
+
+        if usage['retire'] is not None:
+            self.recycled[usage['retire']] = self.recycled.get(usage['retire'], 0) + 1
+            if usage['retire'] == 'rss':
+                self.recycle.set()
+            log.debug(
+                "Memory: recycling worker %d (%s), RSS %s MB",
+                usage['pid'], usage['retire'],
+                '?' if usage['after'] is None else usage['after'] // MB
+            )
+
+    def cancel(self):
+        """
+        Let every waiting `acquire` through, so the pool can be shut down.
+        """
+        with self.condition:
+            self.cancelled = True
+            self.condition.notify_all()
+
+    def admit(self, tasks, weigh):
+        """
+        Yield `(ticket, task)` for each of `tasks` once it is admitted, given
+        `weigh(task)` in bytes.
+        """
+        for task in tasks:
+            yield self.acquire(weigh(task)), task
+
+    def report(self):
+        budget = 'no budget' if self.budget is None else f'budget {self.budget // MB:,} MB'
+        learned = (
+            f'learned from {self.measured} tasks' if self.measured
+            else 'default, nothing measured'
+        )
+        peak = '' if self.peak_rss is None else f', peak worker RSS {self.peak_rss // MB:,} MB'
+        lines = [f"Memory: {budget}, expansion factor {self.expansion:.1f} ({learned}){peak}"]
+        if self.held:
+            lines.append(
+                f"  {self.held} tasks held back for memory, longest wait {self.longest_wait:.1f}s"
+            )
+        if self.recycled:
+            reasons = {'tasks': 'task limit', 'rss': 'RSS limit'}
+            lines.append("  recycled workers: " + ', '.join(
+                f'{count} at the {reasons[reason]}'
+                for reason, count in sorted(self.recycled.items())
+            ))
+        for elapsed, decision in self.decisions:
+            lines.append(f"  {elapsed:7.1f}s {decision}")
+
+        return '\n'.join(lines)
+
+
+def chunk_weight(chunk, stream_threshold=None):
+    """
+    The weight of a chunk of paths: the size of its largest file, as the
+    stages hold one file at a time. Streamed files only hold a window.
+    """
+    weight = 0
+    for path in chunk:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            continue
+        if stream_threshold:
+            size = min(size, stream_threshold)
+        weight = max(weight, size)
+    return weight
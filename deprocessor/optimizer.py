@@ -0,0 +1,300 @@
+"""
+Optimization pass run on parsed DSL statements before they are compiled.
+
+The pass removes statements that cannot change the result (exact duplicates
+and rules shadowed by an earlier rule), and folds runs of word-bounded literal
+replacements into a single identifier map that is applied in one scan.
+Every decision is recorded so it can be reported.
+
+The analysis is deliberately conservative: a replacement rule is only dropped
+when it provably cannot match anything the rules before it leave behind.
+"""
+
+import regex as re
+
+
+# Plain literals, once VERBOSE whitespace is taken out
+_literal_regex = re.compile(r'[^\\.^$|?*+()\[\]{}#\s]+')
+
+# \bWORD\b, the only shape folded into an identifier map
+_word_literal_regex = re.compile(r'\\b(\w+)\\b')
+
+_word_regex = re.compile(r'\w+')
+
+
+class Optimization():
+    __slots__ = ('action', 'kind', 'text', 'reason')
+
+    def __init__(self, action, kind, text, reason):
+        self.action = action
+        self.kind = kind
+        self.text = text
+        self.reason = reason
+
+    def __str__(self):
+        return f'{self.action:<8} {self.kind:<14} {self.text}  ({self.reason})'
+
+
+class TokenMap():
+    """
+    Replacement callable for a folded run of word-bounded literal rules.
+    """
+    __slots__ = ('mapping',)
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+
+    def __call__(self, match):
+        return self.mapping[match[0]]
+
+    def __getstate__(self):
+        return self.mapping
+
+    def __setstate__(self, state):
+        self.mapping = state
+
+    def __repr__(self):
+        return f'TokenMap({self.mapping!r})'
+
+
+# ## Pattern analysis ## #
+def literal_of(pattern):
+    """
+    Return the literal text matched by a VERBOSE-mode pattern, or None if the
+    pattern uses any regex syntax.
+    """
+    pattern = re.sub(r'\s+', '', pattern)
+    if _literal_regex.fullmatch(pattern):
+        return pattern
+    return None
+
+
+def word_literal_of(pattern):
+    """
+    Return WORD for a pattern of the form \\bWORD\\b, otherwise None.
+    """
+    match = _word_literal_regex.fullmatch(re.sub(r'\s+', '', pattern))
+    if match:
+        return match[1]
+    return None
+
+
+def is_literal_replacement(replacement):
+    return '\\' not in replacement and '$' not in replacement
+
+
+def can_overlap(needle, replacement):
+    """
+    Whether a fresh occurrence of `needle` could be formed by text that
+    includes an inserted `replacement`, given arbitrary surrounding text.
+    """
+    if not replacement:
+        # Joining the text on either side of a removed match
+        return len(needle) > 1
+
+    for offset in range(-len(needle) + 1, len(replacement)):
+        consistent = all(
+            needle[i] == replacement[offset + i]
+            for i in range(len(needle))
+            if 0 <= offset + i < len(replacement)
+        )
+        if consistent:
+            return True
+
+    return False
+
+
+def is_idempotent(pattern, replacement):
+    """
+    Whether applying the rule a second time is provably a no-op.
+    """
+    if not is_literal_replacement(replacement):
+        return False
+
+    word = word_literal_of(pattern)
+    if word is not None:
+        # The neighbours of a word-bounded match are non-word characters,
+        # so the only new words are the ones inside the replacement.
+        return word not in _word_regex.findall(replacement)
+
+    literal = literal_of(pattern)
+    if literal is not None:
+        return not can_overlap(literal, replacement)
+
+    return False
+
+
+# ## Statement passes ## #
+def dedupe_statements(statements, kind, key, report):
+    """
+    Drop statements whose `key(statement)` repeats an earlier one.
+    """
+    seen = set()
+    kept = []
+    for statement in statements:
+        k = key(statement)
+        if k in seen:
+            report.append(Optimization('removed', kind, statement.text, 'duplicate'))
+            continue
+        seen.add(k)
+        kept.append(statement)
+
+    statements[:] = kept
+
+
+def resolve_mapping(statements, kind, winner, report):
+    """
+    Keep one statement per key of a mapping kind. `winner(a, b)` picks which
+    of two statements with the same key the compiled mapping would use.
+    """
+    chosen = {}
+    for statement in statements:
+        current = chosen.get(statement.key)
+        if current is None:
+            chosen[statement.key] = statement
+            continue
+
+        if (current.key, current.value) == (statement.key, statement.value):
+            report.append(Optimization('removed', kind, statement.text, 'duplicate'))
+            continue
+
+        keep = winner(current, statement)
+        drop = statement if keep is current else current
+        chosen[statement.key] = keep
+        report.append(Optimization(
+            'removed', kind, drop.text,
+            f'shadowed by {keep.text!r}'
+        ))
+
+    statements[:] = [s for s in statements if chosen.get(s.key) is s]
+
+
+def optimize_statements(statements, report):
+    dedupe_statements(statements['EXCLUDE_PATH'], 'EXCLUDE_PATH', lambda s: s.value, report)
+    dedupe_statements(statements['EXCLUDE_CONTENT'], 'EXCLUDE_CONTENT', lambda s: s.value, report)
+    dedupe_statements(statements['DEFINE'], 'DEFINE', lambda s: s.value, report)
+    dedupe_statements(statements['UNDEFINE'], 'UNDEFINE', lambda s: s.value, report)
+    for kind in ('STRIP', 'STRIP_SUFFIX', 'STRIP_PREFIX'):
+        dedupe_statements(statements[kind], kind, lambda s: s.value, report)
+
+    # Mappings are built from reverse-sorted (key, value) pairs, so the
+    # smallest value for a key is the one that takes effect.
+    smallest = lambda a, b: min(a, b, key=lambda s: s.value)
+    resolve_mapping(statements['MAP_TYPE'], 'MAP_TYPE', smallest, report)
+    resolve_mapping(statements['REWRITE_TOKEN'], 'REWRITE_TOKEN', smallest, report)
+
+    # Later REGEX definitions override earlier ones
+    resolve_mapping(statements['REGEX'], 'REGEX', lambda a, b: b, report)
+
+
+# ## Replacement passes ## #
+def _shadowed(rules, index):
+    """
+    Whether `rules[index]` can never match because an earlier idempotent
+    literal rule removes every occurrence of a literal it contains, and
+    nothing run in between can bring one back.
+    """
+    pattern, _, _ = rules[index]
+    literal = literal_of(pattern) or word_literal_of(pattern)
+    if literal is None:
+        return None
+
+    for earlier in range(index - 1, -1, -1):
+        earlier_pattern, earlier_replacement, earlier_statement = rules[earlier]
+        earlier_literal = literal_of(earlier_pattern)
+
+        if (earlier_literal is not None
+                and earlier_literal in literal
+                and is_idempotent(earlier_pattern, earlier_replacement)):
+            # Everything between must be a literal rule that cannot
+            # recreate the earlier literal
+            between = rules[earlier + 1:index]
+            if all(
+                is_literal_replacement(r)
+                and not can_overlap(earlier_literal, r)
+                for _, r, _ in between
+            ):
+                return earlier_statement
+
+    return None
+
+
+def optimize_replacements(rules, kind, report, fold=True):
+    """
+    Optimize an ordered list of `(pattern, replacement, statement)` rules for
+    one stage. Returns a list whose items are either such rules or
+    `(pattern, TokenMap, [statements])` folds. With `fold` off every rule
+    stays on its own, so match counts stay per rule.
+    """
+    # Drop adjacent exact duplicates that are provably no-ops, and rules an
+    # earlier literal rule shadows.
+    kept = []
+    for pattern, replacement, statement in rules:
+        if kept and kept[-1][:2] == (pattern, replacement):
+            if is_idempotent(pattern, replacement):
+                report.append(Optimization('removed', kind, statement.text, 'duplicate'))
+                continue
+            report.append(Optimization(
+                'kept', kind, statement.text,
+                'duplicate, but its replacement can form a new match'
+            ))
+
+        kept.append((pattern, replacement, statement))
+        shadow = _shadowed(kept, len(kept) - 1)
+        if shadow is not None:
+            kept.pop()
+            report.append(Optimization(
+                'removed', kind, statement.text,
+                f'shadowed by {shadow.text!r}'
+            ))
+
+    # Fold runs of word-bounded literal rules into one identifier map. A run
+    # is only valid if no rule's output is the input of a later rule in the
+    # same run, since the map rewrites every word in a single pass.
+    result = []
+    run = []
+
+    def flush():
+        if fold and len(run) > 1:
+            mapping = {word: replacement for word, replacement, _, _ in run}
+            words = sorted(mapping, key=len, reverse=True)
+            pattern = r'\b(?:' + '|'.join(re.escape(w) for w in words) + r')\b'
+            statements = [s for _, _, s, _ in run]
+            result.append((pattern, TokenMap(mapping), statements))
+            for statement in statements:
+                report.append(Optimization(
+                    'folded', kind, statement.text,
+                    f'into an identifier map of {len(run)} rules'
+                ))
+        else:
+            result.extend(
+                (pattern, replacement, statement)
+                for _, replacement, statement, pattern in run
+            )
+        run.clear()
+
+    for pattern, replacement, statement in kept:
+        word = word_literal_of(pattern)
+        if word is None or not is_literal_replacement(replacement):
+            flush()
+            result.append((pattern, replacement, statement))
+            continue
+
+        produced = set()
+        for _, earlier_replacement, _, _ in run:
+            produced.update(_word_regex.findall(earlier_replacement))
+
+        if word in produced:
+            flush()
+        elif any(word == w for w, _, _, _ in run):
+            # The earlier rule already rewrote every occurrence
+            report.append(Optimization(
+                'removed', kind, statement.text,
+                'shadowed by an earlier rule for the same word'
+            ))
+            continue
+
+        run.append((word, replacement, statement, pattern))
+
+    flush()
+    return result
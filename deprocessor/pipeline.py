@@ -0,0 +1,235 @@
+"""
+An in-process API for the pipeline, for build systems that embed the
+deprocessor rather than run its command line.
+
+    from deprocessor.dsl import DSL
+    from deprocessor.pipeline import Pipeline
+
+    with open('default.dsl') as fh:
+        pipeline = Pipeline(DSL(fh.read()).compile())
+
+    result = pipeline.process_text(header, name='winbase.h2')
+    if result.ok:
+        print(result.text)
+
+    for result in pipeline.process_many(headers):
+        ...
+
+Headers go in as text (or bytes-like buffers) and come back as text. The
+rule stages and unifdef run in memory. Toast only reads files, so the toast
+stage alone writes its batch to a scratch directory, removed as soon as the
+batch is done, and its argument file to the working directory, as every run
+does; a pipeline without it never touches disk.
+
+`process_many` is lazy: it takes items from its iterable a batch at a time
+and yields their results, in order, as each batch finishes. A failure,
+whether a rule raising or toast rejecting a header, becomes that item's
+`error` rather than ending the run.
+"""
+
+import os
+import tempfile
+from itertools import islice
+
+from . import unifdef
+from .steps import SubStats, nim_path_for, nimterop_files, sub_file_data, write_file
+
+
+STAGES = ('pre', 'unifdef', 'toast', 'post')
+
+
+# ## Results ## #
+class ItemError():
+    """
+    Why an item failed: the stage it failed in, a message, and for toast, its
+    exit code and output.
+    """
+    __slots__ = ('stage', 'message', 'returncode', 'stderr')
+
+    def __init__(self, stage, message, returncode=None, stderr=''):
+        self.stage = stage
+        self.message = message
+        self.returncode = returncode
+        self.stderr = stderr
+
+    def __str__(self):
+        return f'{self.stage}: {self.message}'
+
+    def __repr__(self):
+        return f'ItemError({self.stage!r}, {self.message!r})'
+
+
+class Result():
+    """
+    The outcome for one item. `text` is the output of the last stage run (the
+    Nim code, when toast ran), `header` the header as toast was given it, and
+    `error` an `ItemError`, or None.
+    """
+    __slots__ = ('name', 'text', 'header', 'error')
+
+    def __init__(self, name, text=None):
+        self.name = name
+        self.text = text
+        self.header = None
+        self.error = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        state = 'ok' if self.ok else str(self.error)
+        return f'<Result {self.name} {state}>'
+
+
+class _Failures():
+    # Collects toast failures in memory, in place of a `FailureSink`
+    def __init__(self):
+        self.records = {}
+
+    def record(self, path, stage, returncode=None, stderr='', **_):
+        self.records[path] = (stage, returncode, stderr)
+
+
+# ## Pipeline ## #
+class Pipeline():
+    """
+    Run the `stages` of a compiled `dsl`, in the order of `STAGES`, over
+    headers held in memory. `batch_size` items are taken at a time;
+    `amalgamate` and `cache` are as for `nimterop_files`, and the split
+    options as for `sub_file_data`. With `stats`, rule counts are kept in
+    `pre_stats` and `post_stats`.
+    """
+    def __init__(
+            self,
+            dsl,
+            stages=STAGES,
+            batch_size=32,
+            amalgamate=0,
+            cache=None,
+            split_threshold=None,
+            split_threads=None,
+            stats=False,
+            encoding='utf-8'):
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            raise ValueError(f"Unknown stages {', '.join(sorted(unknown))}, expected some of {', '.join(STAGES)}")
+
+        self.dsl = dsl
+        self.stages = [stage for stage in STAGES if stage in stages]
+        self.batch_size = max(batch_size, 1)
+        self.amalgamate = amalgamate
+        self.cache = cache
+        self.split_threshold = split_threshold
+        self.split_threads = split_threads
+        self.encoding = encoding
+
+        self.known = unifdef.macros(dsl.defines, dsl.undefines)
+        self.pre_stats  = SubStats(len(dsl.pre_replacements)) if stats else None
+        self.post_stats = SubStats(len(dsl.post_replacements)) if stats else None
+
+    def process_text(self, text, name='input.h2'):
+        """
+        Run one header through the pipeline, returning its `Result`.
+        """
+        return next(self.process_many([(name, text)]))
+
+    def process_many(self, items):
+        """
+        Lazily yield a `Result` for each item, in order. Items are headers,
+        or `(name, header)` pairs; unnamed headers are numbered.
+        """
+        items = iter(items)
+        index = 0
+        while True:
+            batch = list(islice(items, self.batch_size))
+            if not batch:
+                return
+
+            results = []
+            for item in batch:
+                name, data = item if isinstance(item, tuple) else (f'{index}.h2', item)
+                results.append(self._read(name, data))
+                index += 1
+
+            yield from self._process_batch(results)
+
+    # ## Stages ## #
+    def _read(self, name, data):
+        result = Result(name)
+        if isinstance(data, str):
+            result.text = data
+        else:
+            try:
+                result.text = bytes(data).decode(self.encoding)
+            except (TypeError, UnicodeDecodeError) as e:
+                result.error = ItemError('read', f'{type(e).__name__}: {e}')
+        return result
+
+    def _process_batch(self, results):
+        for stage in self.stages:
+            live = [result for result in results if result.ok]
+            if stage == 'toast':
+                self._toast(live)
+                continue
+
+            for result in live:
+                try:
+                    result.text = self._rewrite(stage, result)
+                except Exception as e:
+                    result.error = ItemError(stage, f'{type(e).__name__}: {e}')
+
+        return results
+
+    def _rewrite(self, stage, result):
+        if stage == 'unifdef':
+            return unifdef.unifdef(result.text, self.known)[0]
+
+        if stage == 'pre':
+            subs, stats = self.dsl.pre_replacements, self.pre_stats
+        else:
+            subs, stats = self.dsl.post_replacements, self.post_stats
+        file_data = sub_file_data(
+            subs, [(result.name, result.text)], stats,
+            self.split_threshold, self.split_threads
+        )
+        return next(file_data)[1]
+
+    def _toast(self, results):
+        if not results:
+            return
+
+        with tempfile.TemporaryDirectory(prefix='deprocess-') as scratch:
+            # One directory, so amalgamation can join them, and names kept
+            # apart with an extension for the .nim file to replace
+            paths = []
+            for index, result in enumerate(results):
+                result.header = result.text
+                stem = os.path.splitext(os.path.basename(result.name))[0] or 'input'
+                paths.append(os.path.join(scratch, f'{index}-{stem}.h2'))
+                write_file(paths[-1], result.text)
+
+            failures = _Failures()
+            nim_paths = set(nimterop_files(
+                paths          = paths,
+                defines        = self.dsl.defines,
+                undefines      = self.dsl.undefines,
+                suffixes       = self.dsl.suffixes,
+                prefixes       = self.dsl.prefixes,
+                type_map       = self.dsl.type_map,
+                identifier_map = self.dsl.identifier_map,
+                cache          = self.cache,
+                failures       = failures,
+                batch_size     = self.amalgamate,
+            ))
+
+            for path, result in zip(paths, results):
+                nim_path = nim_path_for(path)
+                if nim_path in nim_paths:
+                    with open(nim_path, 'r') as fh:
+                        result.text = fh.read()
+                    continue
+
+                stage, returncode, stderr = failures.records.get(path, ('toast', None, ''))
+                result.text = None
+                result.error = ItemError(stage, 'toast failed', returncode, stderr)
@@ -0,0 +1,216 @@
+"""
+Profiling inside pool workers, for `--profile`.
+
+A profiler in the parent sees none of a run's work, which happens in the
+pool's workers. `call_profiled` runs each task under the worker's own
+`cProfile.Profile`, and dumps the worker's stats so far to the profile
+directory after every task, as pool workers exit without running exit
+handlers. Rules match in C, so cProfile mostly times the Python around
+them, at little cost.
+
+With `trace_frames`, it also traces allocations with `tracemalloc` during a
+sample of tasks, recording each traced task's peak and the lines holding
+the most memory once it is done. Tracing slows the lexer's many small
+allocations several times over, so only one task in `trace_every` is traced.
+
+`merge` then combines the per-worker files into `merged.prof`, for `pstats`
+or any viewer that reads it, and `allocations.txt`.
+"""
+
+import cProfile
+import glob
+import io
+import json
+import logging
+import marshal
+import os
+import pstats
+import threading
+import tracemalloc
+
+from .steps import write_files
+
+
+log = logging.getLogger('deprocessor')
+
+MB = 1024 * 1024
+
+# Allocations made by profiling itself, or by imports, say nothing of a run
+_trace_filters = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, cProfile.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+# ## Worker side ## #
+_local = threading.local()
+_trace_lock = threading.Lock()
+_tasks = 0
+_peaks = []
+_lines = {}
+
+
+def _worker_name():
+    # Threads of the thread executor each keep a profile of their own
+    return f'worker-{os.getpid()}-{threading.get_ident()}'
+
+
+def _dump_profile(profile, directory):
+    profile.create_stats()
+    path = os.path.join(directory, _worker_name() + '.prof')
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as fh:
+        marshal.dump(profile.stats, fh)
+    os.replace(temp_path, path)
+
+
+def _start_tracing(frames, every):
+    # Trace the first task and one in every `every` after it. Memory is
+    # traced for the whole process, so with threads, one task at a time.
+    global _tasks
+    with _trace_lock:
+        _tasks += 1
+        if (_tasks - 1) % every or tracemalloc.is_tracing():
+            return False
+        tracemalloc.start(frames)
+        return True
+
+
+def _stop_tracing(directory, top):
+    with _trace_lock:
+        _peaks.append(tracemalloc.get_traced_memory()[1])
+        snapshot = tracemalloc.take_snapshot().filter_traces(_trace_filters)
+        tracemalloc.stop()
+
+        for stat in snapshot.statistics('lineno'):
+            frame = stat.traceback[0]
+            where = f'{frame.filename}:{frame.lineno}'
+            size, count = _lines.get(where, (0, 0))
+            _lines[where] = (size + stat.size, count + stat.count)
+
+        lines = [
+            dict(where=where, size=size, count=count)
+            for where, (size, count) in sorted(_lines.items(), key=lambda item: -item[1][0])[:top]
+        ]
+        report = dict(pid=os.getpid(), peaks=_peaks, lines=lines)
+        path = os.path.join(directory, f'worker-{os.getpid()}.alloc.json')
+        write_files([(path, json.dumps(report))])
+
+
+def call_profiled(call, args, directory, trace_frames=0, trace_every=10, top=100):
+    """
+    Run `call(args)` under this worker's profiler, then dump its stats to
+    `directory`. With `trace_frames`, also trace allocations, with that many
+    frames each, in one task of every `trace_every`, and dump the `top` lines
+    holding the most memory after traced tasks.
+    """
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        profile = _local.profile = cProfile.Profile()
+
+    traced = trace_frames and _start_tracing(trace_frames, trace_every)
+    try:
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler holds this process, as a second thread's does
+            # since Python 3.12
+            return call(args)
+
+        try:
+            return call(args)
+        finally:
+            profile.disable()
+            _dump_profile(profile, directory)
+    finally:
+        if traced:
+            _stop_tracing(directory, top)
+
+
+# ## Parent side ## #
+def prepare(directory):
+    """
+    Create the profile directory, removing workers' files from earlier runs.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, 'worker-*')):
+        os.remove(path)
+
+
+def merge(directory, top=20):
+    """
+    Merge the workers' files in `directory` into `merged.prof` and
+    `allocations.txt`, returning a summary.
+    """
+    stats = None
+    worker_count = 0
+    for path in sorted(glob.glob(os.path.join(directory, 'worker-*.prof'))):
+        try:
+            if stats is None:
+                stats = pstats.Stats(path, stream=io.StringIO())
+            else:
+                stats.add(path)
+        except (OSError, EOFError, ValueError, TypeError) as e:
+            log.warning("Could not read profile %s: %s", path, e)
+            continue
+        worker_count += 1
+
+    if stats is None:
+        return "Profile: no worker wrote a profile"
+
+    merged_path = os.path.join(directory, 'merged.prof')
+    stats.dump_stats(merged_path)
+    stats.stream = io.StringIO()
+    stats.sort_stats('tottime').print_stats(top)
+    lines = [
+        f"Profile: merged {worker_count} workers into {merged_path}, top {top} by own time:",
+        *('  ' + line for line in stats.stream.getvalue().strip('\n').splitlines()[-top - 1:]),
+    ]
+
+    allocations = merge_allocations(directory, top)
+    if allocations is not None:
+        lines.append(allocations)
+
+    return '\n'.join(lines)
+
+
+def merge_allocations(directory, top=20):
+    """
+    Sum the workers' allocation reports in `directory` by line, write them to
+    `allocations.txt`, and return the first `top` lines of it, or None when
+    no worker traced allocations.
+    """
+    reports = []
+    for path in sorted(glob.glob(os.path.join(directory, 'worker-*.alloc.json'))):
+        try:
+            with open(path, 'r') as fh:
+                reports.append(json.load(fh))
+        except (OSError, ValueError) as e:
+            log.warning("Could not read allocations %s: %s", path, e)
+
+    if not reports:
+        return None
+
+    by_line = {}
+    for report in reports:
+        for line in report['lines']:
+            size, count, workers = by_line.get(line['where'], (0, 0, 0))
+            by_line[line['where']] = (size + line['size'], count + line['count'], workers + 1)
+
+    peaks = sorted(peak for report in reports for peak in report['peaks'])
+    output = [
+        f"Allocations traced in {len(peaks)} tasks across {len(reports)} processes; "
+        f"peak traced memory per task "
+        f"{peaks[len(peaks) // 2] / MB:.1f} MB median, {peaks[-1] / MB:.1f} MB max",
+        "Lines holding the most memory at the end of traced tasks, summed:",
+    ]
+    for where, (size, count, workers) in sorted(by_line.items(), key=lambda item: -item[1][0]):
+        output.append(f"  {size / MB:9.2f} MB {count:>9,} blocks {workers:>4} workers  {where}")
+
+    path = os.path.join(directory, 'allocations.txt')
+    write_files([(path, '\n'.join(output) + '\n')])
+    return '\n'.join(output[:top + 2]) + f"\n  (all lines in {path})"
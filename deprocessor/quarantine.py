@@ -0,0 +1,156 @@
+"""
+Screening of headers the toolchain is expected to fail on.
+
+Before any tool runs, each header's contents are hashed, and its head is
+searched for C++ constructs, which toast cannot translate, and for the DSL's
+`EXCLUDE CONTENT` patterns. C headers often declare C++ under
+`#ifdef __cplusplus`, which toast never sees, so those regions are removed
+before searching. Headers that match, or whose contents toast
+failed on in an earlier run, are skipped without running any tools. Failed
+contents are remembered as one JSON line each in a file that, unlike the
+failure report, persists from run to run.
+"""
+
+import hashlib
+import json
+import time
+
+import regex as re
+
+from . import lexer, unifdef
+from .steps import append_json_line
+
+
+SAMPLE_SIZE = 256 * 1024
+
+# Toast parses headers as C
+_c_macros = {'__cplusplus': None}
+
+_cpp_regex = re.compile(r'''
+    (?P<extern_cpp> \b extern \s* "C\+\+" )
+  | (?P<namespace> \b namespace \s+ (?: \w+ \s* )? \{ | \b using \s+ namespace \b )
+  | (?P<template> \b template \s* < )
+  | (?P<class>
+        \b class \s+
+        (?: __declspec \s* \( (?: [^()] | \( [^()]* \) )* \) \s* )*
+        \w+ \s* (?: final \s* )? [:{;]
+    )
+  | (?P<access> ^ [ \t]* (?: public | private | protected ) \s* : (?!:) )
+  | (?P<operator> \b operator \s* (?: [-+*/%^&|~!=<>]+ | \(\) | \[\] | new | delete ) \s* \( )
+''', re.VERBOSE | re.MULTILINE)
+
+_cpp_reasons = {
+    'extern_cpp': 'C++ (extern "C++")',
+    'namespace' : 'C++ (namespace)',
+    'template'  : 'C++ (template)',
+    'class'     : 'C++ (class)',
+    'access'    : 'C++ (access specifier)',
+    'operator'  : 'C++ (operator overload)',
+}
+
+
+def sniff(text, exclude_contents=()):
+    """
+    Return why `text` should be skipped, or None. Comments, and code only
+    compiled as C++, are ignored. `text` may be the start of a header.
+    """
+    text = unifdef.unifdef(text, _c_macros, partial=True)[0]
+    text = lexer.strip_comments(text)
+
+    match = _cpp_regex.search(text)
+    if match:
+        return _cpp_reasons[match.lastgroup]
+
+    for regex in exclude_contents:
+        if regex.search(text):
+            return f'EXCLUDE CONTENT {regex.pattern.strip()}'
+
+    return None
+
+
+def inspect(path, sample_size=SAMPLE_SIZE):
+    """
+    Return the SHA-256 digest of the file at `path`, and the text of its
+    first `sample_size` bytes, reading it once.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        head = fh.read(sample_size)
+        digest.update(head)
+        for block in iter(lambda: fh.read(1024 * 1024), b''):
+            digest.update(block)
+
+    return digest.hexdigest(), head.decode('utf-8', errors='replace')
+
+
+class Quarantine():
+    """
+    Screens headers before any tool runs, and remembers the contents of
+    headers toast failed on in the JSON lines file at `path`. With `known`
+    off, remembered failures are ignored, but still recorded.
+    """
+    def __init__(self, path, sample_size=SAMPLE_SIZE, known=True):
+        self.path = path
+        self.sample_size = sample_size
+        self.known = known
+
+    def load(self):
+        """
+        Return a dict mapping each remembered digest to its latest entry.
+        """
+        try:
+            fh = open(self.path, 'r')
+        except FileNotFoundError:
+            return {}
+
+        entries = {}
+        with fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries[entry['digest']] = entry
+
+        return entries
+
+    def remember(self, path, digest, reason):
+        append_json_line(self.path, dict(
+            path   = path,
+            digest = digest,
+            reason = reason,
+            time   = time.time(),
+        ))
+
+    def screen(self, paths, exclude_contents=()):
+        """
+        Split `paths` into headers to process and headers to skip. Returns
+        `(keep, skipped, digests)`, where `skipped` holds `(path, reason)`
+        pairs and `digests` maps each kept path to the digest of its contents.
+        """
+        known = self.load() if self.known else {}
+
+        keep = []
+        skipped = []
+        digests = {}
+        for path in paths:
+            try:
+                digest, head = inspect(path, self.sample_size)
+            except OSError:
+                # Left for the pipeline to report
+                keep.append(path)
+                continue
+
+            entry = known.get(digest)
+            if entry is not None:
+                reason = f"{entry['reason']} before, as {entry['path']}"
+            else:
+                reason = sniff(head, exclude_contents)
+
+            if reason is None:
+                keep.append(path)
+                digests[path] = digest
+            else:
+                skipped.append((path, reason))
+
+        return keep, skipped, digests
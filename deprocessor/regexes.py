@@ -51,4 +51,165 @@ def to_regex(pattern):
         msg = "Dangerous regex. Aborting"
         raise ExceptionWithExcerpt(msg, repr(regex))
 
-    return regex
\ No newline at end of file
+    return regex
+
+
+# ## Pattern analysis ## #
+
+# Escapes that can match a newline, or whose meaning depends on text outside
+# the current line
+_multi_line_escapes = set('nsWDXNZzAGxuUpP0')
+
+def is_line_local(pattern):
+    """
+    Conservatively decide whether a VERBOSE-mode pattern can only ever match
+    text within a single line, without looking past the ends of that line.
+    Such patterns give the same result whether they run over a whole file or
+    over pieces of it split at line ends.
+    """
+    position = 0
+    in_class = False
+    class_start = 0
+
+    while position < len(pattern):
+        char = pattern[position]
+
+        if char == '\\':
+            escaped = pattern[position + 1:position + 2]
+            if escaped in _multi_line_escapes:
+                return False
+            if in_class and pattern[position + 2:position + 3] == '-':
+                # A range with an escaped endpoint may span a newline
+                return False
+            position += 2
+            continue
+
+        if in_class:
+            if char == ']' and position > class_start:
+                in_class = False
+            elif char == '\n':
+                return False
+            elif char == '-' and 0 < position - class_start:
+                low = pattern[position - 1]
+                high = pattern[position + 1:position + 2]
+                if high and high != ']' and ord(low) <= ord('\n') <= ord(high):
+                    return False
+            position += 1
+            continue
+
+        if char == '[':
+            if pattern[position + 1:position + 2] == '^':
+                return False
+            if pattern.startswith('[:', position + 1):
+                return False
+            in_class = True
+            class_start = position + 1
+            position += 1
+            continue
+
+        if char == '#':
+            # A VERBOSE comment runs to the end of the line
+            end = pattern.find('\n', position)
+            position = len(pattern) if end < 0 else end + 1
+            continue
+
+        if char == '(' and pattern.startswith('(?', position):
+            flags = re.match(r'\(\?([a-zA-Z]*)[-:)]', pattern[position:])
+            if flags and 's' in flags[1]:
+                return False
+
+        position += 1
+
+    return True
+
+
+def _group_end(pattern, start):
+    """
+    Return the index just past the group opening at `start`, or None if it
+    is never closed.
+    """
+    depth = 0
+    position = start
+    in_class = False
+    class_start = 0
+
+    while position < len(pattern):
+        char = pattern[position]
+        if char == '\\':
+            position += 2
+            continue
+
+        if in_class:
+            if char == ']' and position > class_start:
+                in_class = False
+        elif char == '[':
+            in_class = True
+            class_start = position + (2 if pattern[position + 1:position + 2] == '^' else 1)
+        elif char == '#':
+            end = pattern.find('\n', position)
+            position = len(pattern) if end < 0 else end
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                return position + 1
+
+        position += 1
+
+    return None
+
+
+# Lookbehind contents whose width has no simple bound
+_unbounded_lookbehind_regex = re.compile(r'[*+{]|\\[0-9g]|\(\?[&R>P0-9]|\[\[')
+
+
+def lookbehind_reach(pattern):
+    """
+    Decide how much text before a piece of a file split at line ends a
+    VERBOSE-mode pattern needs to see. Returns 0 for line-local patterns, an
+    upper bound on the width of its lookbehinds for patterns that are
+    line-local apart from lookbehinds of bounded width, and None otherwise.
+    """
+    reach = 0
+    remainder = []
+    position = 0
+    scan = 0
+    in_class = False
+    class_start = 0
+
+    while scan < len(pattern):
+        char = pattern[scan]
+        if char == '\\':
+            scan += 2
+            continue
+
+        if in_class:
+            if char == ']' and scan > class_start:
+                in_class = False
+        elif char == '[':
+            in_class = True
+            class_start = scan + (2 if pattern[scan + 1:scan + 2] == '^' else 1)
+        elif char == '#':
+            end = pattern.find('\n', scan)
+            scan = len(pattern) if end < 0 else end
+        elif pattern.startswith(('(?<=', '(?<!'), scan):
+            end = _group_end(pattern, scan)
+            if end is None:
+                return None
+
+            body = pattern[scan + 4:end - 1]
+            if _unbounded_lookbehind_regex.search(body):
+                return None
+
+            reach = max(reach, len(body))
+            remainder.append(pattern[position:scan])
+            position = scan = end
+            continue
+
+        scan += 1
+
+    remainder.append(pattern[position:])
+    if not is_line_local(''.join(remainder)):
+        return None
+    return reach
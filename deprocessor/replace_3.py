@@ -1,3 +1,5 @@
+import argparse
+import multiprocessing
 import re
 import subprocess
 import itertools
@@ -10,6 +12,12 @@ from multiprocessing import Pool
 from pprint import pprint
 import json
 
+try:
+    from . import lexer, telemetry
+except ImportError:
+    import lexer
+    import telemetry
+
 jprint = lambda x: print(json.dumps(x, default=repr, indent=4))
 
 dsl_text = r"""
@@ -240,7 +248,7 @@ class DSL():
 def read_files(paths):
     for path in paths:
         # Read in the data
-        with open(path, 'r') as fh:
+        with telemetry.span('read', path, detail=True), open(path, 'r') as fh:
             data = fh.read()
 
         yield path, data
@@ -248,7 +256,7 @@ def read_files(paths):
 
 def write_files(path_data_pairs):
     for path, data in path_data_pairs:
-        with open(path, 'w') as fh:
+        with telemetry.span('write', path, len(data), detail=True), open(path, 'w') as fh:
             data = fh.write(data)
 
 
@@ -284,14 +292,21 @@ def run_process(*args, print_stdout=True, print_stderr=True, **kwargs):
 
 
 # ## Steps ## #
-def sub_file_data(subs, file_data):
+def sub_file_data(subs, file_data, stage=None):
     subs = list(subs)
     subs_used = [False]*len(subs)
 
     for path, data in file_data:
+        size = len(data)
+        if stage is not None:
+            telemetry.emit('start', stage, path, size)
+
         for index, (regex, replacement) in enumerate(subs):
             data = regex.sub(replacement, data)
             subs_used[index] = True
+
+        if stage is not None:
+            telemetry.emit('end', stage, path, size)
         
         yield path, data
 
@@ -305,54 +320,86 @@ def sub_file_data(subs, file_data):
 
 def remove_sections(start_marker, end_marker, file_data):
     for path, data in file_data:
-        count = 0
-        while True:
-            start_pos = data.find(start_marker)
-            if start_pos < 0:
-                break
+        starts = lexer.find_comments(data, start_marker)
+        ends = lexer.find_comments(data, end_marker)
 
-            end_pos = data.find(end_marker, start_pos + len(start_marker))
-            if end_pos < 0:
-                print(f"Unbalanced marker found in {path}. File written to.")
-                write_file(path, data)
+        pieces = []
+        position = 0
+        end_index = 0
+        balanced = True
+        for start_pos, _ in starts:
+            if start_pos < position:
+                continue
+
+            while end_index < len(ends) and ends[end_index][0] <= start_pos:
+                end_index += 1
+            if end_index == len(ends):
+                balanced = False
                 break
 
-            count += 1
-            data = data[: start_pos] + data[end_pos + len(end_marker) :]
+            pieces.append(data[position:start_pos])
+            position = ends[end_index][0] + len(end_marker)
+
+        pieces.append(data[position:])
+        data = ''.join(pieces)
+        if not balanced:
+            print(f"Unbalanced marker found in {path}. File written to.")
+            write_file(path, data)
 
         # print("Removed", count, "sections from", path)
         yield path, data
 
 
+def wrap_includes(before, after, file_data):
+    # Put text around every #include directive, found by the shared lexer.
+    # This wraps the same directives the old `^[ \t]*#[ \t]*include` regex
+    # did, except that ones inside comments and strings are left alone.
+    for path, data in file_data:
+        pieces = []
+        position = 0
+        for start, end in lexer.includes(data):
+            line_start = data.rfind('\n', 0, start) + 1
+            directive = data[start + 1:end].lstrip(' \t')
+            if directive.startswith('include_next'):
+                continue
+            pieces.append(data[position:line_start])
+            pieces.append(f'{before}\n{data[line_start:end]}\n{after}')
+            position = end
+
+        pieces.append(data[position:])
+        yield path, ''.join(pieces)
+
+
 def preprocess_files(args, file_data):
     # Run the preprocessor
     for path, data in file_data:
-        clang = run_process(
-            [
-                'clang',
-                '--preprocess',
-                '--no-line-commands',
-                '--comments',
-                '--comments-in-macros',
-                # '-U__has_attribute',
-                # '-U__has_builtin',
-                # '-U__has_feature',
-                # '-U__has_declspec_attribute',
-                # '-U__has_extension',
-                # '-U__has_warning',
-                '-Wno-builtin-macro-redefined',
-                '-Wno-comment',
-                '-Wno-macro-redefined',
-                '-Wno-pragma-once-outside-header',
-                '-Wno-extra-tokens',
-                *args,
-                '-'
-            ],
-            input        = data,
-            capture_output = True,
-            print_stdout = False,
-            print_stderr = False
-        )
+        with telemetry.span('clang', path, len(data)):
+            clang = run_process(
+                [
+                    'clang',
+                    '--preprocess',
+                    '--no-line-commands',
+                    '--comments',
+                    '--comments-in-macros',
+                    # '-U__has_attribute',
+                    # '-U__has_builtin',
+                    # '-U__has_feature',
+                    # '-U__has_declspec_attribute',
+                    # '-U__has_extension',
+                    # '-U__has_warning',
+                    '-Wno-builtin-macro-redefined',
+                    '-Wno-comment',
+                    '-Wno-macro-redefined',
+                    '-Wno-pragma-once-outside-header',
+                    '-Wno-extra-tokens',
+                    *args,
+                    '-'
+                ],
+                input        = data,
+                capture_output = True,
+                print_stdout = False,
+                print_stderr = False
+            )
 
         if clang.stderr or clang.returncode != 0:
             # print(clang.stderr)
@@ -372,9 +419,11 @@ def reformat_files(paths):
 
 def c2nim_files(paths):
     # print(f"Starting c2nim {paths[0]}")
-    c2nim = run_process(
-        ['c2nim', *paths],
-    )
+    # One c2nim run covers the whole chunk
+    with telemetry.span('c2nim', paths[0] if paths else '', len(paths)):
+        c2nim = run_process(
+            ['c2nim', *paths],
+        )
 
 
 #
@@ -384,26 +433,8 @@ def worker(dsl, paths):
     pre_macros = '\n'.join(chain(dsl.pre_defines, dsl.pre_undefines))
     post_macros = '\n'.join(chain(dsl.post_defines, dsl.post_undefines))
 
-    include_match = r"""
-        ^       # Beginning of line
-        [ \t]*  # Spaces
-        [#]     # Macro start
-        [ \t]*  # Spaces
-        include
-        [ \t]*  # Spaces
-        (
-            (<[^>]+>) |
-            ("[^"]+")
-        )
-    """
-
-    include_replacement = strip_lines(r"""
-        //INCLUDE_MARKER
-        {pre_macros}
-        \g<0>
-        {post_macros}
-        //INCLUDE_MARKER
-    """.format(**locals()))
+    include_before = '\n'.join(('//INCLUDE_MARKER', pre_macros))
+    include_after = '\n'.join((post_macros, '//INCLUDE_MARKER'))
 
     declude_match = r"""
         //INCLUDE_MARKER \n
@@ -411,17 +442,16 @@ def worker(dsl, paths):
         //INCLUDE_MARKER
     """
 
-    include_sub = [(to_regex(include_match), include_replacement)]
     declude_sub = [(to_regex(declude_match), r'\n')]
 
     # Read files in
     file_data = read_files(paths)
 
     # Perform initial replacements
-    file_data = sub_file_data(dsl.pre_replacements, file_data)
+    file_data = sub_file_data(dsl.pre_replacements, file_data, stage='pre')
 
     # Add macros around includes
-    file_data = sub_file_data(include_sub, file_data)
+    file_data = wrap_includes(include_before, include_after, file_data)
 
     # Preprocess files
     file_data = preprocess_files([], file_data)
@@ -433,7 +463,7 @@ def worker(dsl, paths):
     file_data = remove_sections('//INCLUDE_MARKER', '//INCLUDE_MARKER', file_data)
 
     # Perform post replacements
-    file_data = sub_file_data(dsl.post_replacements, file_data)
+    file_data = sub_file_data(dsl.post_replacements, file_data, stage='post')
 
     # Write files out
     write_files(file_data)
@@ -452,6 +482,13 @@ if __name__ != "__main__":
 
 
 else:
+    parser = argparse.ArgumentParser(description="Run the clang and c2nim flow over ./output.")
+    parser.add_argument(
+        '--trace', metavar='PATH',
+        help="Write a span for every file in every stage to PATH as Chrome trace-event JSON"
+    )
+    args = parser.parse_args()
+
     dsl = DSL(dsl_text)
     # jprint(dsl.replacements)
 
@@ -469,7 +506,15 @@ else:
         for i in range(0, 200)
     ]
 
-    POOL = Pool(4)
+    # Workers send their spans to the parent, which pairs them up
+    trace = None
+    if args.trace:
+        events = multiprocessing.Queue()
+        trace = telemetry.TraceRecorder(args.trace)
+        progress = telemetry.Progress(events, len(PATH_LIST), live=False, trace=trace).start()
+        POOL = Pool(4, telemetry.attach, (events, True))
+    else:
+        POOL = Pool(4)
 
     try:
         print("Running workers")
@@ -494,4 +539,9 @@ else:
         print("Caught KeyboardInterrupt, terminating workers")
         POOL.terminate()
     else:
-        POOL.close()
\ No newline at end of file
+        POOL.close()
+        POOL.join()
+    finally:
+        if trace is not None:
+            progress.stop()
+            print(f"Trace: {trace.write()} spans written to {args.trace}")
\ No newline at end of file
@@ -0,0 +1,78 @@
+"""
+File contents handed to pool workers through shared memory.
+
+For contents a parent already holds in memory, rather than files workers
+can read for themselves in parallel, the parent packs a chunk of them into
+one shared memory block and sends the worker a small handle naming the
+block, instead of a pickled `str` per file. The worker copies the contents
+out and unlinks the block, so each block lives only until its chunk is
+picked up.
+"""
+
+from multiprocessing import shared_memory
+
+
+class SharedFiles():
+    """
+    Picklable handle to a shared memory block holding UTF-8 file contents,
+    with an index of `(path, offset, length)` entries.
+    """
+    __slots__ = ('name', 'index')
+
+    def __init__(self, name, index):
+        self.name = name
+        self.index = index
+
+    def __getstate__(self):
+        return self.name, self.index
+
+    def __setstate__(self, state):
+        self.name, self.index = state
+
+    @property
+    def size(self):
+        return sum(length for _, _, length in self.index)
+
+
+def share_files(file_data):
+    """
+    Pack `(path, data)` pairs into a new shared memory block. Returns a
+    `SharedFiles` handle, or None when there is nothing to share.
+    """
+    encoded = [(path, data.encode('utf-8')) for path, data in file_data]
+    total = sum(len(data) for _, data in encoded)
+    if not total:
+        return None
+
+    block = shared_memory.SharedMemory(create=True, size=total)
+    index = []
+    offset = 0
+    try:
+        for path, data in encoded:
+            block.buf[offset:offset + len(data)] = data
+            index.append((path, offset, len(data)))
+            offset += len(data)
+
+        # The block outlives this mapping until the reader unlinks it
+        return SharedFiles(block.name, index)
+    finally:
+        block.close()
+
+
+def read_shared(handle):
+    """
+    Return the `(path, data)` pairs held by `handle`, and release its block.
+    """
+    block = shared_memory.SharedMemory(name=handle.name)
+    try:
+        buf = block.buf
+        file_data = [
+            (path, bytes(buf[offset:offset + length]).decode('utf-8'))
+            for path, offset, length in handle.index
+        ]
+        del buf
+    finally:
+        block.close()
+        block.unlink()
+
+    return file_data
@@ -0,0 +1,181 @@
+"""
+Packed output: the pipeline's results in one SQLite file instead of many
+small ones.
+
+By default every stage rewrites its files in place, next to the inputs (see
+`steps.write_files`). With a packed store, workers run the pipeline in a local
+scratch directory instead, and `write` sends each finished file over a queue
+to a single `StoreWriter` process, which inserts them into the store in
+batched transactions. The inputs are left untouched, and the output volume
+sees one file rather than thousands of creates and renames.
+`PackedStore.extract` writes a store's files back out.
+"""
+
+import fnmatch
+import os
+import queue
+import sqlite3
+import time
+from collections import deque
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+
+
+_schema = '''
+    CREATE TABLE IF NOT EXISTS files (
+        path  TEXT PRIMARY KEY,
+        data  BLOB NOT NULL,
+        size  INTEGER NOT NULL,
+        mtime REAL NOT NULL
+    )
+'''
+
+
+# ## Worker side ## #
+_queue = None
+
+
+def attach(sink):
+    global _queue
+    _queue = sink
+
+
+def write(path, data):
+    """
+    Send a finished file to the store writer.
+    """
+    _queue.put((path, data))
+
+
+# ## Store ## #
+class PackedStore():
+    """
+    A SQLite database holding one row per output file, indexed by path.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute(_schema)
+        return connection
+
+    def reset(self):
+        with closing(self.connect()) as connection, connection:
+            connection.execute('DELETE FROM files')
+
+    def paths(self):
+        with closing(self.connect()) as connection:
+            return {path for path, in connection.execute('SELECT path FROM files')}
+
+    def read(self, path):
+        with closing(self.connect()) as connection:
+            row = connection.execute('SELECT data FROM files WHERE path = ?', (path,)).fetchone()
+        return None if row is None else row[0].decode('utf-8')
+
+    def extract(self, destination, pattern=None, threads=8):
+        """
+        Write the files whose paths match the glob `pattern`, or all of them,
+        under `destination`. Returns the number of files and bytes written.
+        """
+        connection = self.connect()
+        rows = connection.execute('SELECT path, data FROM files')
+
+        made = set()
+        count = 0
+        size = 0
+
+        def write_one(target, data):
+            with open(target, 'wb') as fh:
+                fh.write(data)
+
+        with ThreadPoolExecutor(threads) as executor:
+            # Bound the writes in flight, so the store is never all in memory
+            futures = deque()
+            for path, data in rows:
+                if pattern is not None and not fnmatch.fnmatch(path, pattern):
+                    continue
+
+                relative = os.path.splitdrive(path)[1].lstrip('/\\')
+                target = os.path.join(destination, relative)
+                directory = os.path.dirname(target)
+                if directory not in made:
+                    os.makedirs(directory or '.', exist_ok=True)
+                    made.add(directory)
+
+                futures.append(executor.submit(write_one, target, data))
+                if len(futures) > threads * 4:
+                    futures.popleft().result()
+                count += 1
+                size += len(data)
+
+            for future in futures:
+                future.result()
+
+        connection.close()
+        return count, size
+
+
+# ## Writer ## #
+def _write_loop(store_path, items, batch_size, interval):
+    connection = PackedStore(store_path).connect()
+    connection.execute('PRAGMA synchronous = NORMAL')
+
+    pending = []
+    deadline = time.monotonic() + interval
+
+    def flush():
+        with connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO files (path, data, size, mtime) VALUES (?, ?, ?, ?)',
+                pending
+            )
+        pending.clear()
+
+    while True:
+        try:
+            item = items.get(timeout=interval)
+        except queue.Empty:
+            item = ()
+
+        if item is None:
+            break
+        if item:
+            path, data = item
+            data = data.encode('utf-8')
+            pending.append((path, data, len(data), time.time()))
+
+        if len(pending) >= batch_size or (pending and time.monotonic() >= deadline):
+            flush()
+            deadline = time.monotonic() + interval
+
+    if pending:
+        flush()
+    connection.close()
+
+
+class StoreWriter():
+    """
+    The one process that writes to a `PackedStore`. Workers `attach` its
+    `queue`, which is bounded, so a slow store holds workers back rather
+    than filling memory.
+    """
+    batch_size = 256
+    interval = 1.0
+
+    def __init__(self, store, context, max_pending=256):
+        self.store = store
+        self.queue = context.Queue(max_pending)
+        self.process = context.Process(
+            target = _write_loop,
+            args   = (store.path, self.queue, self.batch_size, self.interval),
+            daemon = True,
+        )
+
+    def start(self):
+        self.process.start()
+        return self
+
+    def close(self):
+        self.queue.put(None)
+        self.process.join()
@@ -1,10 +1,25 @@
+import hashlib
+import json
+import logging
 import shlex
 import subprocess
+import time
 import regex as re
 import os
+import threading
 from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 
 from . import regexes
+from . import amalgamate
+from . import chunking
+from . import lexer
+from . import streaming
+from . import telemetry
+
+
+log = logging.getLogger(__name__)
+
 
 # ## Helper functions ## #
 # Exception helpers
@@ -21,19 +36,62 @@ def read_files(paths):
     for path in paths:
         # Read in the data
         try:
-            with open(path, 'r') as fh:
+            with telemetry.span('read', path, detail=True), open(path, 'r') as fh:
                 data = fh.read()
         except:
-            print(f'Could not read contents of {path}')
+            log.warning("Could not read contents of %s", path)
             continue
 
         yield path, data
 
 
-def write_files(path_data_pairs):
+def read_includes(paths):
+    """
+    Yield `(path, data)` for each header that `paths` include with
+    `#include "..."` and that sits beside its includer, then for the headers
+    those include, once each. Headers only found on the include path are not
+    followed.
+    """
+    seen = set(map(os.path.abspath, paths))
+    pending = list(paths)
+    while pending:
+        including = pending.pop(0)
+        try:
+            with open(including, 'r') as fh:
+                data = fh.read()
+        except (OSError, UnicodeDecodeError):
+            continue
+
+        if including not in paths:
+            yield including, data
+
+        for start, end in lexer.includes(data):
+            name = data[start:end].rstrip()
+            if not name.endswith('"'):
+                continue
+            name = name[name.index('"') + 1:-1]
+            path = os.path.join(os.path.dirname(including), name)
+            if os.path.abspath(path) not in seen and os.path.isfile(path):
+                seen.add(os.path.abspath(path))
+                pending.append(path)
+
+
+def write_files(path_data_pairs, journal=None, stage=None):
     for path, data in path_data_pairs:
-        with open(path, 'w') as fh:
-            data = fh.write(data)
+        if journal is not None:
+            journal.begin(path, stage, data)
+
+        # Write next to the target and rename over it, so an interrupted run
+        # never leaves a truncated file behind. The temporary name is unique
+        # to the writing thread, in case several write the same path.
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with telemetry.span('write', path, len(data), detail=True):
+            with open(temp_path, 'w') as fh:
+                fh.write(data)
+            os.replace(temp_path, path)
+
+        if journal is not None:
+            journal.done(path, stage)
 
 
 def write_file(path, data):
@@ -41,7 +99,7 @@ def write_file(path, data):
         with open(path, 'w') as fh:
             data = fh.write(data)
     except:
-        print(f"Unable to write to file {path}")
+        log.warning("Unable to write to file %s", path)
 
 
 def append_file(path, data):
@@ -49,10 +107,27 @@ def append_file(path, data):
         data = fh.write(data)
 
 
+def append_json_line(path, entry, sync=False):
+    # A single short O_APPEND write keeps lines from different pool workers
+    # from interleaving.
+    line = (json.dumps(entry) + '\n').encode('utf-8')
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+        if sync:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def nim_path_for(header_path):
+    return re.sub(r'\.[^.]+$', '.nim', header_path)
+
+
 # Process helpers
 def run_process(*args, print_stdout=True, print_stderr=True, **kwargs):
     def _print(arg):
-        if arg: print(arg)
+        if arg: log.info(arg)
 
     internal_kwargs = dict(text=True)
     print_func      = lambda x: x
@@ -73,63 +148,274 @@ def run_process(*args, print_stdout=True, print_stderr=True, **kwargs):
     return result
 
 
+def run_cached_process(cache, args, inputs=(), input_paths=(), output_path=None, **kwargs):
+    """
+    Run a process through `cache`, keyed on the tool, its arguments and the
+    data it reads. Arguments naming `input_paths` or `output_path` are left out
+    of the key; the contents of `input_paths`, along with any extra `inputs`,
+    are hashed instead. On a hit the process is not run at all, and the cached
+    output file, if any, is written to `output_path`. Only successful runs are
+    cached, so a failure, which may be passing, is always run again.
+    """
+    if cache is None:
+        return run_process(args, **kwargs)
+
+    def read_inputs():
+        yield from inputs
+        for path in input_paths:
+            with open(path, 'rb') as fh:
+                yield fh.read()
+
+    excluded = {output_path, *input_paths}
+    key_args = [arg for arg in args[1:] if arg not in excluded]
+    key = cache.key(args[0], key_args, read_inputs())
+
+    cached = cache.get(key)
+    if cached is not None:
+        result, output = cached
+        if output_path is not None and output is not None:
+            write_file(output_path, output)
+        return result
+
+    result = run_process(args, **kwargs)
+
+    output = None
+    if output_path is not None and result.returncode == 0 and os.path.isfile(output_path):
+        with open(output_path, 'r') as fh:
+            output = fh.read()
+
+    if result.returncode == 0:
+        cache.put(key, result, output)
+    return result
+
+
 
 
 # ## Steps ## #
-def sub_file_data(subs, file_data):
+class SubStats():
+    """
+    Match bookkeeping for a list of substitutions: how many matches each rule
+    produced, in how many files, and how many rules touched each file.
+    """
+    def __init__(self, count):
+        self.matches = [0]*count
+        self.file_counts = [0]*count
+        self.files = {}
+
+    def record(self, path, counts):
+        touched = 0
+        for index, count in enumerate(counts):
+            if count:
+                self.matches[index] += count
+                self.file_counts[index] += 1
+                touched += 1
+
+        self.files[path] = touched
+
+    def merge(self, other):
+        for index, count in enumerate(other.matches):
+            self.matches[index] += count
+            self.file_counts[index] += other.file_counts[index]
+
+        self.files.update(other.files)
+        return self
+
+
+def sub_file_data(subs, file_data, stats=None, split_threshold=None, split_threads=None, stage=None):
+    """
+    Apply `subs` in order to each file. Files of at least `split_threshold`
+    characters are split into chunks, and each run of line-local rules is
+    applied to the chunks in parallel threads; other rules always see the
+    whole file, so matches that could cross a chunk boundary are not missed.
+    With a `stage` name, each file is reported as a telemetry span.
+    """
     subs = list(subs)
-    subs_used = [False]*len(subs)
-
-    def repl_hook(m):
-        if False:
-            append_file(path + '.repl', '\n'.join([
-                'Match'  , m[0],
-                'Pattern', m.re.pattern,
-                'Start'  , str(m.start()),
-                'End'    , str(m.end()),
-                '\n'
-            ]))
-        return m.expand(replacement)
-
-    for path, data in file_data:
-        for index, (regex, replacement) in enumerate(subs):
-            data = regex.sub(repl_hook, data)
-            subs_used[index] = True
-        
-        yield path, data
 
-    # for index, used in enumerate(subs_used):
-    #     if not used:
-    #         print(add_example(
-    #             "Warning, replacement not used:",
-    #             repr(subs[index])
-    #         ))
+    def make_repl(replacement):
+        # Compiled templates are expanded natively by `subn`; strings are
+        # regex templates already.
+        return getattr(replacement, 'native', replacement)
+
+    def make_chunk_repl(replacement):
+        # Chunked substitution calls its replacement for every match
+        if callable(replacement):
+            return replacement
+        if '\\' not in replacement:
+            return lambda m: replacement
+        return lambda m: m.expand(replacement)
+
+    rules = [(regex, make_repl(replacement)) for regex, replacement in subs]
+    chunk_rules = [(regex, make_chunk_repl(replacement)) for regex, replacement in subs]
+
+    # Consecutive runs of rules that can share a chunked pass, or a lexing
+    # pass for token-scoped rules
+    groups = []
+    for index, sub in enumerate(subs):
+        if getattr(sub, 'scope', None) == 'token':
+            kind = 'token'
+        else:
+            kind = 'line' if getattr(sub, 'line_local', False) else 'file'
+        if groups and groups[-1][0] == kind:
+            groups[-1][1].append(index)
+        else:
+            groups.append((kind, [index]))
+
+    def sub_tokens(data, indices, counts):
+        data, group_counts = lexer.sub_identifiers(
+            [(rules[i][0].regex, chunk_rules[i][1]) for i in indices], data
+        )
+        for index, count in zip(indices, group_counts):
+            counts[index] = count
+        return data
 
+    executor = None
+    try:
+        for path, data in file_data:
+            counts = [0]*len(subs)
+            size = len(data)
+
+            if stage is not None:
+                telemetry.emit('start', stage, path, size)
+
+            if split_threshold and len(data) >= split_threshold:
+                threads = split_threads or os.cpu_count() or 1
+                if executor is None:
+                    executor = ThreadPoolExecutor(threads)
+                chunk_size = max(split_threshold // 4, len(data) // (threads * 4))
+
+                for kind, indices in groups:
+                    if kind == 'token':
+                        data = sub_tokens(data, indices, counts)
+                    elif kind == 'line':
+                        chunks = chunking.split_chunks(data, chunk_size)
+                        chunks, group_counts = chunking.sub_chunks(
+                            executor, [chunk_rules[i] for i in indices], chunks
+                        )
+                        data = ''.join(chunks)
+                        for index, count in zip(indices, group_counts):
+                            counts[index] = count
+                    else:
+                        for index in indices:
+                            regex, repl = rules[index]
+                            data, counts[index] = regex.subn(repl, data, concurrent=True)
+            else:
+                for kind, indices in groups:
+                    if kind == 'token':
+                        data = sub_tokens(data, indices, counts)
+                        continue
+                    # Releasing the GIL lets thread pool workers match in parallel
+                    for index in indices:
+                        regex, repl = rules[index]
+                        data, counts[index] = regex.subn(repl, data, concurrent=True)
+
+            if stats is not None:
+                stats.record(path, counts)
+
+            if stage is not None:
+                telemetry.emit('end', stage, path, size)
+
+            yield path, data
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def split_streamed(paths, stream_threshold):
+    """
+    Split `paths` into those to read whole, and those of at least
+    `stream_threshold` bytes to stream.
+    """
+    if not stream_threshold:
+        return list(paths), []
+
+    whole, streamed = [], []
+    for path in paths:
+        try:
+            large = os.path.getsize(path) >= stream_threshold
+        except OSError:
+            large = False
+        (streamed if large else whole).append(path)
+    return whole, streamed
+
+
+def stream_files(subs, paths, stats=None, journal=None, stage=None, write=True):
+    """
+    Apply `subs` in order to each file in bounded memory, rewriting it in
+    place like `write_files`, or only counting matches when `write` is off.
+    Rules that cannot be streamed get a whole-file pass (see `streaming`).
+    """
+    subs = list(subs)
+    for path in paths:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            log.warning("Could not read contents of %s", path)
+            continue
 
-def remove_sections(start_marker, end_marker, file_data):
+        if stage is not None:
+            telemetry.emit('start', stage, path, size)
+
+        if write:
+            temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(temp_path, 'w') as fh:
+                counts, digest = streaming.stream_file(subs, path, fh)
+            if journal is not None:
+                journal.begin(path, stage, digest=digest)
+            os.replace(temp_path, path)
+            if journal is not None:
+                journal.done(path, stage)
+        else:
+            counts, _ = streaming.stream_file(subs, path)
+
+        if stats is not None:
+            stats.record(path, counts)
+
+        if stage is not None:
+            telemetry.emit('end', stage, path, size)
+
+
+def remove_sections(start_marker, end_marker, file_data, failures=None):
+    """
+    Remove the text from each `start_marker` comment through the next
+    `end_marker` comment. Markers are only looked for in comments, so one
+    spelled out in a string literal is left alone.
+    """
     for path, data in file_data:
-        count = 0
-        while True:
-            start_pos = data.find(start_marker)
-            if start_pos < 0:
-                break
+        starts = lexer.find_comments(data, start_marker)
+        ends = lexer.find_comments(data, end_marker)
+        if not starts:
+            yield path, data
+            continue
 
-            end_pos = data.find(end_marker, start_pos + len(start_marker))
-            if end_pos < 0:
-                print(f"Unbalanced marker found in {path}. File written to.")
-                write_file(path, data)
+        pieces = []
+        position = 0
+        end_index = 0
+        for start_pos, _ in starts:
+            if start_pos < position:
+                continue
+
+            # The first end marker after this start marker
+            while end_index < len(ends) and ends[end_index][0] <= start_pos:
+                end_index += 1
+            if end_index == len(ends):
+                log.warning("Unbalanced marker found in %s.", path)
+                if failures is not None:
+                    failures.record(path, 'remove_sections', stderr=data[start_pos:][:4096])
                 break
 
-            count += 1
-            data = data[: start_pos] + data[end_pos + len(end_marker) :]
+            end_pos = ends[end_index][0]
+            pieces.append(data[position:start_pos])
+            position = end_pos + len(end_marker)
 
-        # print("Removed", count, "sections from", path)
-        yield path, data
+        pieces.append(data[position:])
+        yield path, ''.join(pieces)
 
 
-def preprocess_files(args, paths):
+def preprocess_files(args, paths, cache=None, failures=None):
     # Run the preprocessor
-    clang = run_process(
+    start = time.perf_counter()
+    clang = run_cached_process(
+        cache,
         [
             'clang',
             '--preprocess',
@@ -153,16 +439,28 @@ def preprocess_files(args, paths):
             *args,
             *paths
         ],
+        inputs = chain(
+            (data for path, data in read_files(paths)),
+            (data for path, data in read_includes(paths)),
+        ),
         capture_output = True,
         print_stdout = False,
         print_stderr = False
     )
 
     if clang.stderr:
-        print(clang.stderr)
+        log.info(clang.stderr)
     if clang.returncode != 0:
-        print(f"Preprocess failed for {paths[0]}. Wrote error to file")
-        write_file(paths[0], clang.stderr + '\n' + clang.stdout)
+        log.warning("Preprocess failed for %s", paths[0])
+        if failures is not None:
+            failures.record(
+                path       = paths[0],
+                stage      = 'clang',
+                args       = clang.args,
+                returncode = clang.returncode,
+                stderr     = clang.stderr,
+                duration   = time.perf_counter() - start,
+            )
         return
 
     for file, data in dejoin_files(clang.stdout):
@@ -176,7 +474,19 @@ def nimterop_files(
         suffixes,
         prefixes,
         type_map,
-        identifier_map):
+        identifier_map,
+        cache=None,
+        failures=None,
+        batch_size=0,
+        durations=None):
+    """
+    Run toast over each of `paths`, yielding the Nim path of every header it
+    succeeded on. With `batch_size` above 1, up to that many headers from the
+    same directory are joined and run through toast at once; a batch that
+    fails or cannot be split is bisected until the failing header runs alone.
+    `durations`, if given, is filled with the seconds toast spent on each
+    header, with a batch's time shared out by size.
+    """
     # Run the preprocessor
     from_list = lambda arg, li: chain.from_iterable(
         (arg, c)
@@ -203,21 +513,33 @@ def nimterop_files(
 
     environ = {k: v for k, v in os.environ.items()}
 
-    write_file('toast_args.cfg', ' '.join(common_args))
-
-    for header_path in paths:
-        nim_path = re.sub(r'\.[^.]+$', '.nim', header_path)
+    # Named by its contents, as runs with other DSLs may be running toast
+    # from the same directory at once, as the daemon's threads do
+    toast_config = ' '.join(common_args)
+    config_path = f"toast_args.{hashlib.sha256(toast_config.encode('utf-8')).hexdigest()[:16]}.cfg"
+    write_files([(config_path, toast_config)])
 
-        args = [
+    def toast_args(header_path, nim_path):
+        return [
             'toast.exe',
             '--output', nim_path,
-            'toast_args.cfg',
+            config_path,
             header_path,
         ]
+
+    def run_toast(header_path):
+        nim_path = nim_path_for(header_path)
+        args = toast_args(header_path, nim_path)
+
         # print(args)
-        toast = run_process(
+        start = time.perf_counter()
+        toast = run_cached_process(
+            cache,
             args = args,
             env  = environ,
+            inputs = chain([toast_config], (data for path, data in read_includes([header_path]))),
+            input_paths = [header_path],
+            output_path = nim_path,
             capture_output = True,
             print_stdout = False,
             print_stderr = False
@@ -227,12 +549,133 @@ def nimterop_files(
         #     print(toast.stderr)
 
         if toast.returncode != 0:
-            print(f"Toast failed for {header_path}. Wrote error to file")
-            write_file(header_path, f'{args}\n{toast.stderr}\n{toast.stdout}')
-            # raise Exception("Toast failed")
+            log.warning("Toast failed for %s", header_path)
+            if failures is not None:
+                failures.record(
+                    path       = header_path,
+                    stage      = 'toast',
+                    args       = args,
+                    returncode = toast.returncode,
+                    stderr     = toast.stderr + toast.stdout,
+                    duration   = time.perf_counter() - start,
+                )
+            return None
+
+        if durations is not None:
+            durations[header_path] = time.perf_counter() - start
+        return nim_path
+
+    if batch_size <= 1:
+        for header_path in paths:
+            with telemetry.span('toast', header_path):
+                nim_path = run_toast(header_path)
+            if nim_path is not None:
+                yield nim_path
+        return
+
+    # Toast's output for an empty header, which every amalgamated run repeats
+    empty_output = None
+
+    def run_amalgamated(header_paths):
+        nonlocal empty_output
+
+        token = amalgamate.new_token()
+        directory = os.path.dirname(header_paths[0])
+        batch_path = os.path.join(directory, f'deprocess_batch_{token}.h2')
+        batch_nim_path = nim_path_for(batch_path)
+
+        try:
+            if empty_output is None:
+                write_file(batch_path, '')
+                run_process(
+                    toast_args(batch_path, batch_nim_path),
+                    env = environ,
+                    capture_output = True,
+                    print_stdout = False,
+                    print_stderr = False
+                )
+                empty_output = ''
+                if os.path.isfile(batch_nim_path):
+                    with open(batch_nim_path, 'r') as fh:
+                        empty_output = fh.read()
+                    os.remove(batch_nim_path)
+
+            datas = [data for _, data in read_files(header_paths)]
+            if len(datas) != len(header_paths):
+                return None
+            write_file(batch_path, amalgamate.join_headers(token, datas))
+
+            toast = run_process(
+                toast_args(batch_path, batch_nim_path),
+                env = environ,
+                capture_output = True,
+                print_stdout = False,
+                print_stderr = False
+            )
+            if toast.returncode != 0:
+                return None
+
+            with open(batch_nim_path, 'r') as fh:
+                output = fh.read()
+
+            try:
+                return amalgamate.split_output(
+                    token, len(header_paths), output, empty_output,
+                    declared = [amalgamate.declares(data) for data in datas],
+                )
+            except amalgamate.SplitError as e:
+                log.info("Could not split amalgamated output: %s", e)
+                return None
+        finally:
+            for path in (batch_path, batch_nim_path):
+                if os.path.isfile(path):
+                    os.remove(path)
+
+    def run_batch(header_paths):
+        # A single header, or a batch broken by one of its headers, falls back
+        # to running toast per file, bisecting towards the culprit.
+        if len(header_paths) == 1:
+            nim_path = run_toast(header_paths[0])
+            if nim_path is not None:
+                yield nim_path
+            return
+
+        start = time.perf_counter()
+        pieces = run_amalgamated(header_paths)
+        if pieces is not None and durations is not None:
+            elapsed = time.perf_counter() - start
+            sizes = [os.path.getsize(p) for p in header_paths]
+            total = sum(sizes) or len(sizes)
+            for header_path, size in zip(header_paths, sizes):
+                durations[header_path] = elapsed * (size if sum(sizes) else 1) / total
+        if pieces is None:
+            middle = len(header_paths) // 2
+            yield from run_batch(header_paths[:middle])
+            yield from run_batch(header_paths[middle:])
+            return
+
+        for header_path, piece in zip(header_paths, pieces):
+            nim_path = nim_path_for(header_path)
+            write_file(nim_path, piece)
+            yield nim_path
+
+    # Headers are only joined with their siblings, so relative includes
+    # still resolve.
+    by_directory = {}
+    for header_path in paths:
+        by_directory.setdefault(os.path.dirname(header_path), []).append(header_path)
+
+    for header_paths in by_directory.values():
+        for i in range(0, len(header_paths), batch_size):
+            batch = header_paths[i:i + batch_size]
+            for header_path in batch:
+                telemetry.emit('start', 'toast', header_path)
+            try:
+                yield from run_batch(batch)
+            finally:
+                for header_path in batch:
+                    telemetry.emit('end', 'toast', header_path)
 
-        yield nim_path
-    
 
 def reformat_files(paths):
     # Run the formatter
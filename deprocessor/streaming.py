@@ -0,0 +1,140 @@
+"""
+Bounded-memory substitution for files too large to hold comfortably.
+
+Rules that only look at the line they match in (`Replacement.reach` is 0)
+are applied to a file one window of whole lines at a time, reading and
+writing through fixed-size buffers, with the partial line at the end of each
+window carried over to the next. Rules whose lookbehinds reach into earlier
+lines (a bounded `reach`) also see the end of the text before each window.
+Other rules get a whole-file pass in between, and the file is only held in
+memory for that pass. Each pass reads the output of the previous one from an
+anonymous temporary file.
+"""
+
+import hashlib
+import tempfile
+
+from . import chunking
+
+
+WINDOW = 1024 * 1024
+
+
+def _repl(replacement):
+    # Windows are rewritten match by match
+    if callable(replacement):
+        return replacement
+    if '\\' not in replacement:
+        return lambda m: replacement
+    return lambda m: m.expand(replacement)
+
+
+def passes(subs):
+    """
+    Split `subs` into consecutive runs that can be streamed together, or
+    need the whole file. Returns a list of `(streamed, indices)`.
+    """
+    runs = []
+    for index, sub in enumerate(subs):
+        streamed = getattr(sub, 'reach', None) is not None
+        if runs and runs[-1][0] == streamed:
+            runs[-1][1].append(index)
+        else:
+            runs.append((streamed, [index]))
+    return runs
+
+
+def stream_sub(rules, read, write, window=WINDOW):
+    """
+    Apply `(regex, repl, reach)` rules in order to the text returned by
+    successive `read(window)` calls, passing the result to `write` a window
+    at a time. Returns the match count of each rule.
+    """
+    counts = [0]*len(rules)
+    tails = ['']*len(rules)
+    carry = ''
+    final = False
+
+    while not final:
+        block = read(window)
+        final = not block
+        text = carry + block if carry else block
+        carry = ''
+
+        if not final:
+            cut = text.rfind('\n') + 1
+            if not cut:
+                # A line longer than the window; keep reading until it ends
+                carry = text
+                continue
+            text, carry = text[:cut], text[cut:]
+
+        for index, (regex, repl, reach) in enumerate(rules):
+            context = tails[index]
+            if reach:
+                # Lookbehinds see the rule's own input, as over the whole file
+                joined = text if len(text) >= reach else context + text
+                tails[index] = joined[-reach:]
+            text, count = chunking.sub_chunk(regex, repl, text, final, context)
+            counts[index] += count
+
+        if text:
+            write(text)
+
+    return counts
+
+
+def stream_file(subs, path, output=None, window=WINDOW):
+    """
+    Apply `subs` in order to the file at `path`, writing the result to the
+    text file `output`, or discarding it. Returns the match count of each
+    rule and the SHA-256 digest of the result.
+    """
+    counts = [0]*len(subs)
+    # With no rules at all, a single streamed pass copies the file
+    runs = passes(subs) or [(True, [])]
+    digest = hashlib.sha256()
+
+    source = open(path, 'r')
+    try:
+        for run_index, (streamed, indices) in enumerate(runs):
+            last = run_index == len(runs) - 1
+            if last:
+                target = output
+            else:
+                target = tempfile.TemporaryFile('w+', encoding='utf-8')
+
+            def write(text):
+                if last:
+                    digest.update(text.encode('utf-8'))
+                if target is not None:
+                    target.write(text)
+
+            if streamed:
+                rules = [
+                    (subs[index].regex, _repl(subs[index].replacement), subs[index].reach)
+                    for index in indices
+                ]
+                run_counts = stream_sub(rules, source.read, write, window)
+            else:
+                data = source.read()
+                run_counts = []
+                for index in indices:
+                    regex, replacement = subs[index]
+                    repl = getattr(replacement, 'native', replacement)
+                    data, count = regex.subn(repl, data, concurrent=True)
+                    run_counts.append(count)
+                write(data)
+                del data
+
+            for index, count in zip(indices, run_counts):
+                counts[index] = count
+
+            source.close()
+            if not last:
+                target.seek(0)
+                source = target
+    finally:
+        source.close()
+
+    return counts, digest.hexdigest()
@@ -0,0 +1,421 @@
+"""
+Logging, live progress and metrics for long runs.
+
+Pipeline code reports the files it works on with `span(stage, path, size)`,
+tool failures with `failure(stage, path)` and files screened out before any
+tool runs with `skip(path)`. These events go to the queue
+installed by `attach`, and are dropped when there is none, so the pipeline
+costs nothing extra when used without telemetry. Pool workers also send their
+log records over the same queue, and the parent's `Progress` thread turns the
+whole stream into a live progress line, log output and, optionally, a
+Prometheus text file.
+
+Spans marked `detail`, such as reading and writing each file, only matter to
+a timeline, and are only sent once `attach` is told to send them. A
+`TraceRecorder` on the `Progress` thread then turns every span into a Chrome
+trace event, one row per worker thread, for chrome://tracing or Perfetto.
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+log = logging.getLogger('deprocessor')
+
+_events = None
+_detail = False
+
+
+# ## Worker side ## #
+def attach(events, detail=False):
+    global _events, _detail
+    _events = events
+    _detail = detail
+
+
+def attach_worker(events, detail=False):
+    """
+    Send this worker process' events and log records to the parent.
+    """
+    attach(events, detail)
+    log.handlers[:] = [logging.handlers.QueueHandler(events)]
+    log.propagate = False
+
+
+def emit(kind, stage, path, size=0):
+    if _events is not None:
+        _events.put((kind, stage, path, size, time.time(), os.getpid(), threading.get_ident()))
+
+
+@contextmanager
+def span(stage, path, size=0, detail=False):
+    if detail and not _detail:
+        yield
+        return
+
+    emit('start', stage, path, size)
+    try:
+        yield
+    finally:
+        emit('end', stage, path, size)
+
+
+def call_spanned(call, task):
+    """
+    Run `call(task)` for a `(ticket, args)` pool task inside a detail span,
+    so a trace shows each task a worker ran.
+    """
+    with span('task', f'task {task[0]}', detail=True):
+        return call(task)
+
+
+def failure(stage, path):
+    emit('failure', stage, path)
+
+
+def skip(path):
+    emit('skip', 'screen', path)
+
+
+# ## Logging ## #
+class _Formatter(logging.Formatter):
+    def format(self, record):
+        message = super().format(record)
+        if record.levelno == logging.INFO:
+            return message
+        return f'{record.levelname.lower()}: {message}'
+
+
+class _ProgressAwareHandler(logging.StreamHandler):
+    """
+    A stream handler that moves the live progress line out of the way of
+    each record.
+    """
+    progress = None
+
+    def emit(self, record):
+        progress = self.progress
+        if progress is None:
+            return super().emit(record)
+
+        with progress.lock:
+            progress.clear()
+            super().emit(record)
+            progress.draw()
+
+
+def configure(level='INFO', stream=None):
+    handler = _ProgressAwareHandler(stream or sys.stderr)
+    handler.setFormatter(_Formatter('%(message)s'))
+
+    log.handlers[:] = [handler]
+    log.setLevel(level)
+    log.propagate = False
+    return handler
+
+
+# ## Progress ## #
+def _duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f'{seconds // 3600}h{seconds % 3600 // 60:02d}m'
+    if seconds >= 60:
+        return f'{seconds // 60}m{seconds % 60:02d}s'
+    return f'{seconds}s'
+
+
+class Progress():
+    """
+    Drain an event queue on a background thread, keeping counts of finished,
+    failed, skipped and in-flight files. A file is finished when it leaves
+    `final_stage`, fails, or is skipped. The progress line is redrawn in place when the
+    stream is a terminal, and logged every `report_interval` seconds
+    otherwise.
+    """
+    draw_interval = 0.5
+    report_interval = 10.0
+    stages = ('pre', 'toast', 'post')
+
+    def __init__(
+            self,
+            events,
+            total,
+            final_stage='post',
+            stream=None,
+            live=None,
+            metrics_path=None,
+            metrics_interval=15.0,
+            trace=None):
+        self.events = events
+        self.total = total
+        self.final_stage = final_stage
+        self.stream = stream or sys.stderr
+        self.live = self.stream.isatty() if live is None else live
+        self.metrics_path = metrics_path
+        self.metrics_interval = metrics_interval
+        self.trace = trace
+
+        self.lock = threading.RLock()
+        self.started = None
+        self.completed = 0
+        self.bytes = 0
+        self.failed = set()
+        self.skipped = 0
+        self.in_flight = {stage: 0 for stage in self.stages}
+
+        self._line = ''
+        self._thread = None
+
+    # ## Counters ## #
+    def handle(self, event):
+        if isinstance(event, logging.LogRecord):
+            logging.getLogger(event.name).handle(event)
+            return
+
+        if self.trace is not None:
+            self.trace.record(event)
+
+        kind, stage, path, size = event[:4]
+        with self.lock:
+            if kind == 'start':
+                if stage in self.in_flight:
+                    self.in_flight[stage] += 1
+            elif kind == 'end':
+                if stage in self.in_flight:
+                    self.in_flight[stage] -= 1
+                if stage == 'pre':
+                    self.bytes += size
+                if stage == self.final_stage:
+                    self.completed += 1
+            elif kind == 'failure':
+                self.failed.add(path)
+            elif kind == 'skip':
+                self.skipped += 1
+
+    def snapshot(self):
+        with self.lock:
+            elapsed = max(time.perf_counter() - self.started, 1e-9)
+            finished = self.completed + len(self.failed) + self.skipped
+            rate = finished / elapsed
+            remaining = max(self.total - finished, 0)
+            return {
+                'finished'   : finished,
+                'completed'  : self.completed,
+                'failed'     : len(self.failed),
+                'skipped'    : self.skipped,
+                'total'      : self.total,
+                'bytes'      : self.bytes,
+                'elapsed'    : elapsed,
+                'rate'       : rate,
+                'byte_rate'  : self.bytes / elapsed,
+                'eta'        : remaining / rate if rate else None,
+                'in_flight'  : dict(self.in_flight),
+            }
+
+    def line(self):
+        s = self.snapshot()
+        percent = 100 * s['finished'] / s['total'] if s['total'] else 100
+        eta = '?' if s['eta'] is None else _duration(s['eta'])
+        in_flight = ' '.join(f'{stage} {count}' for stage, count in s['in_flight'].items())
+        return (
+            f"[{s['finished']}/{s['total']} {percent:5.1f}%] "
+            f"{s['rate']:.1f} files/s {s['byte_rate'] / 1e6:.2f} MB/s ETA {eta} "
+            f"| {in_flight} | {s['failed']} failed {s['skipped']} skipped"
+        )
+
+    # ## Output ## #
+    def clear(self):
+        if self.live and self._line:
+            self.stream.write('\r\x1b[K')
+            self.stream.flush()
+
+    def draw(self):
+        if self.live and self._line:
+            self.stream.write(self._line)
+            self.stream.flush()
+
+    def refresh(self):
+        with self.lock:
+            self._line = self.line()
+            self.clear()
+            self.draw()
+
+    def write_metrics(self):
+        s = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append(f'# HELP deprocessor_{name} {help}')
+            lines.append(f'# TYPE deprocessor_{name} {kind}')
+            for labels, value in samples:
+                lines.append(f'deprocessor_{name}{labels} {value}')
+
+        metric('files_planned', 'gauge', 'Files planned for this run.', [('', s['total'])])
+        metric('files_completed_total', 'counter', 'Files that finished every stage.', [('', s['completed'])])
+        metric('files_failed_total', 'counter', 'Files a tool failed on.', [('', s['failed'])])
+        metric('files_skipped_total', 'counter', 'Files screened out before any tool ran.', [('', s['skipped'])])
+        metric('input_bytes_total', 'counter', 'Header bytes through the pre stage.', [('', s['bytes'])])
+        metric('files_in_flight', 'gauge', 'Files currently in each stage.', [
+            (f'{{stage="{stage}"}}', count)
+            for stage, count in s['in_flight'].items()
+        ])
+        metric('files_per_second', 'gauge', 'Mean file throughput.', [('', f"{s['rate']:.3f}")])
+        metric('bytes_per_second', 'gauge', 'Mean input byte throughput.', [('', f"{s['byte_rate']:.0f}")])
+        metric('eta_seconds', 'gauge', 'Estimated time left.', [
+            ('', f"{s['eta']:.0f}" if s['eta'] is not None else 'NaN')
+        ])
+        metric('last_update_timestamp_seconds', 'gauge', 'When this file was written.', [('', f'{time.time():.0f}')])
+
+        # Write and rename, so collectors never read a partial file
+        temp_path = self.metrics_path + '.tmp'
+        with open(temp_path, 'w') as fh:
+            fh.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, self.metrics_path)
+
+    # ## Thread ## #
+    def _run(self):
+        next_draw = next_metrics = time.perf_counter()
+        next_report = next_draw + self.report_interval
+        while True:
+            try:
+                event = self.events.get(timeout=self.draw_interval)
+            except queue.Empty:
+                event = None
+
+            if event == 'stop':
+                break
+            if event is not None:
+                self.handle(event)
+
+            now = time.perf_counter()
+            if self.live and now >= next_draw:
+                self.refresh()
+                next_draw = now + self.draw_interval
+            if not self.live and now >= next_report:
+                log.info(self.line())
+                next_report = now + self.report_interval
+            if self.metrics_path and now >= next_metrics:
+                self.write_metrics()
+                next_metrics = now + self.metrics_interval
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Process the events still queued, and leave the final counts on
+        screen.
+        """
+        self.events.put('stop')
+        self._thread.join()
+
+        with self.lock:
+            self._line = self.line()
+            self.clear()
+            self._line = ''
+        log.info(self.line())
+        if self.metrics_path:
+            self.write_metrics()
+
+
+# ## Traces ## #
+class TraceRecorder():
+    """
+    Pair up the start and end of every span into a Chrome trace-event file at
+    `path`. Each process shows as its own track, named for the parent or a
+    worker, with a row per thread; failures and skips show as instant events.
+    Spans still open when the trace is written are closed there, marked
+    unfinished.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.parent = os.getpid()
+        self.open = {}
+        self.spans = []
+        self.instants = []
+        self.threads = {}
+
+    def _thread(self, pid, ident):
+        # Thread identifiers are huge and arbitrary; number them per process
+        threads = self.threads.setdefault(pid, {})
+        return threads.setdefault(ident, len(threads))
+
+    def record(self, event):
+        kind, stage, path, size, timestamp, pid, ident = event
+        tid = self._thread(pid, ident)
+        if kind == 'start':
+            self.open[(pid, tid, stage, path)] = (timestamp, size)
+        elif kind == 'end':
+            start = self.open.pop((pid, tid, stage, path), None)
+            if start is not None:
+                self.spans.append((stage, path, start[1] or size, start[0], timestamp, pid, tid, False))
+        else:
+            self.instants.append((kind, stage, path, timestamp, pid, tid))
+
+    def write(self):
+        """
+        Write the trace, returning the number of spans in it.
+        """
+        now = time.time()
+        spans = self.spans + [
+            (stage, path, size, start, now, pid, tid, True)
+            for (pid, tid, stage, path), (start, size) in self.open.items()
+        ]
+        starts = [span[3] for span in spans] + [instant[3] for instant in self.instants]
+        origin = min(starts, default=now)
+        micros = lambda timestamp: round((timestamp - origin) * 1e6)
+
+        events = []
+        for pid, threads in self.threads.items():
+            name = 'parent' if pid == self.parent else f'worker {pid}'
+            events.append(dict(name='process_name', ph='M', pid=pid, tid=0, args=dict(name=name)))
+            events.append(dict(name='process_sort_index', ph='M', pid=pid, tid=0, args=dict(sort_index=pid)))
+            for tid in threads.values():
+                events.append(dict(name='thread_name', ph='M', pid=pid, tid=tid, args=dict(name=f'thread {tid}')))
+
+        for stage, path, size, start, end, pid, tid, unfinished in spans:
+            args = dict(path=path)
+            if size:
+                args['size'] = size
+            if unfinished:
+                args['unfinished'] = True
+            events.append(dict(
+                name = f'{stage} {os.path.basename(path)}',
+                cat  = stage,
+                ph   = 'X',
+                ts   = micros(start),
+                dur  = micros(end) - micros(start),
+                pid  = pid,
+                tid  = tid,
+                args = args,
+            ))
+
+        for kind, stage, path, timestamp, pid, tid in self.instants:
+            events.append(dict(
+                name = f'{kind} {stage} {os.path.basename(path)}',
+                cat  = kind,
+                ph   = 'i',
+                s    = 't',
+                ts   = micros(timestamp),
+                pid  = pid,
+                tid  = tid,
+                args = dict(path=path),
+            ))
+
+        # Write and rename, so viewers never read a partial file
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as fh:
+            json.dump(dict(traceEvents=events, displayTimeUnit='ms'), fh)
+        os.replace(temp_path, self.path)
+
+        return len(spans)
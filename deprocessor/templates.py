@@ -0,0 +1,141 @@
+"""
+Replacement templates for WITH clauses, parsed once instead of on every match.
+
+References to groups are written `$N`, `${N}`, `${name}`, `\\N` or
+`\\g<name>`, and `$$` is a literal dollar sign. The backslash escapes accepted
+by `Match.expand` (`\\n`, `\\t`, `\\xhh`, octal, ...) are supported too.
+Templates without references compile to their plain text, which the `regex`
+module inserts without any per-match work. Other templates compile to a
+`Template`, which can be called with a match, and which also carries the same
+template in the `regex` module's own syntax, for `sub` to expand natively.
+"""
+
+import regex as re
+
+
+_simple_escapes = {
+    'a': '\a', 'b': '\b', 'f': '\f', 'n': '\n',
+    'r': '\r', 't': '\t', 'v': '\v', '\\': '\\',
+}
+
+_reference_regex = re.compile(r'''
+    \$ (?:
+        (?P<dollar> \$ )
+      | (?P<dollar_group> \d+ )
+      | \{ (?P<dollar_braced> \w+ ) \}
+    )
+  | \\ (?:
+        g< (?P<named> [^>]+ ) >
+      | (?P<octal> 0[0-7]{0,2} | [0-7]{3} )
+      | (?P<group> [1-9]\d? )
+      | x (?P<hex2> [0-9a-fA-F]{2} )
+      | u (?P<hex4> [0-9a-fA-F]{4} )
+      | U (?P<hex8> [0-9a-fA-F]{8} )
+      | (?P<escape> . )
+    )
+''', re.VERBOSE | re.DOTALL)
+
+
+class Template():
+    """
+    Replacement callable for a template with group references. Unmatched
+    groups insert nothing, as with `Match.expand`. `native` is the template
+    in `regex` syntax, which `sub` expands faster than it can call back into
+    Python.
+    """
+    __slots__ = ('text', 'format', 'groups', 'native')
+
+    def __init__(self, text, format, groups, native):
+        self.text = text
+        self.format = format
+        self.groups = groups
+        self.native = native
+
+    def __call__(self, match):
+        if not self.groups:
+            return self.format
+        if self.format == '{0}':
+            return match[self.groups[0]] or ''
+        return self.format.format(*[match[group] or '' for group in self.groups])
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return f'Template({self.text!r})'
+
+
+def _group_key(text):
+    return int(text) if text.isdigit() else text
+
+
+def compile_template(text):
+    """
+    Compile a WITH clause into a plain string, if it has no group references
+    and no backslashes left once escapes are resolved, or a `Template`.
+    """
+    literals = ['']
+    groups = []
+    position = 0
+
+    for match in _reference_regex.finditer(text):
+        literals[-1] += text[position:match.start()]
+        position = match.end()
+
+        kind = match.lastgroup
+        value = match[kind]
+        if kind == 'dollar':
+            literals[-1] += '$'
+        elif kind in ('dollar_group', 'dollar_braced', 'named', 'group'):
+            groups.append(_group_key(value))
+            literals.append('')
+        elif kind == 'octal':
+            literals[-1] += chr(int(value, 8))
+        elif kind in ('hex2', 'hex4', 'hex8'):
+            literals[-1] += chr(int(value, 16))
+        elif value in _simple_escapes:
+            literals[-1] += _simple_escapes[value]
+        elif value.isascii() and value.isalpha():
+            raise ValueError(f"Bad escape \\{value} in replacement {text!r}")
+        else:
+            literals[-1] += '\\' + value
+
+    literals[-1] += text[position:]
+
+    native = literals[0].replace('\\', '\\\\') + ''.join(
+        f'\\g<{group}>' + literal.replace('\\', '\\\\')
+        for group, literal in zip(groups, literals[1:])
+    )
+
+    if not groups:
+        if '\\' not in literals[0]:
+            return literals[0]
+        return Template(text, literals[0], (), native)
+
+    # Interleave the literals with format fields for the groups
+    escape = lambda literal: literal.replace('{', '{{').replace('}', '}}')
+    format = escape(literals[0]) + ''.join(
+        f'{{{index}}}' + escape(literal)
+        for index, literal in enumerate(literals[1:])
+    )
+    return Template(text, format, tuple(groups), native)
+
+
+def check(replacement, regex):
+    """
+    Raise ValueError if a compiled replacement refers to a group `regex`
+    does not have.
+    """
+    if not isinstance(replacement, Template):
+        return
+
+    for group in replacement.groups:
+        if isinstance(group, int):
+            exists = group <= regex.groups
+        else:
+            exists = group in regex.groupindex
+        if not exists:
+            raise ValueError(
+                f"Replacement {replacement.text!r} refers to group {group!r}, "
+                f"which {regex.pattern!r} does not have"
+            )
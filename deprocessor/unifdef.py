@@ -0,0 +1,556 @@
+"""
+Partial preprocessing of the conditionals the DSL's macros decide.
+
+DEFINE statements only reach toast as `--defines`, so it still has to parse
+every branch of every `#if` in a header, dead ones included. `unifdef`
+evaluates `#if`, `#ifdef`, `#ifndef` and `#elif` conditions in the manner of
+the unifdef tool, knowing only the macros named by DEFINE and UNDEFINE
+statements: branches that are known to be dead are removed along with the
+directives that select them, and conditions on any other macro are left
+as they are. Headers are assumed not to have the DSL's macros redefined
+under them by the headers they include.
+"""
+
+import json
+import time
+from bisect import bisect_right
+
+import regex as re
+
+from . import lexer, telemetry
+from .steps import append_json_line
+
+
+# Stands in for the body of a function-like macro, which is defined but
+# cannot be evaluated
+FUNCTION = object()
+
+_INT_MIN = -2 ** 63
+_INT_MAX = 2 ** 64 - 1
+
+_define_regex = re.compile(r'^\s*(\w+)(\()?[^=]*?(?:=(.*))?$', re.DOTALL)
+
+# The directives `unifdef` acts on
+_keywords = {
+    'if', 'ifdef', 'ifndef', 'elif', 'elifdef', 'elifndef', 'else', 'endif', 'define', 'undef',
+}
+
+_comment_regex = re.compile(r'/\*.*?\*/|//[^\n]*', re.DOTALL)
+
+_token_regex = re.compile(r'''
+    (?P<number> (?: 0[xX][0-9a-fA-F]+ | [0-9]+ ) [uUlL]* \b )
+  | (?P<char>   L? ' (?: [^'\\\n] | \\. )* ' )
+  | (?P<name>   [A-Za-z_]\w* )
+  | (?P<op>     && | \|\| | << | >> | <= | >= | == | != | [-+*/%<>!~&|^?:(),] )
+  | (?P<space>  \s+ )
+  | (?P<other>  . )
+''', re.VERBOSE | re.DOTALL)
+
+_precedence = {
+    '||': 1,
+    '&&': 2,
+    '|' : 3,
+    '^' : 4,
+    '&' : 5,
+    '==': 6, '!=': 6,
+    '<' : 7, '>' : 7, '<=': 7, '>=': 7,
+    '<<': 8, '>>': 8,
+    '+' : 9, '-' : 9,
+    '*' : 10, '/': 10, '%': 10,
+}
+
+
+# ## Macros ## #
+def macros(defines, undefines):
+    """
+    Return a dict mapping each macro named by a DEFINE or UNDEFINE statement
+    to its body, None when it is undefined, or FUNCTION when it takes
+    arguments. A DEFINE without `=` defines its macro as 1, as `-D` does.
+    """
+    known = {}
+    for define in defines:
+        match = _define_regex.match(define)
+        if match is None:
+            continue
+        name, arguments, body = match.groups()
+        if arguments:
+            known[name] = FUNCTION
+        else:
+            known[name] = '1' if body is None else body.strip()
+
+    for undefine in undefines:
+        known[undefine.strip()] = None
+
+    return known
+
+
+# ## Expressions ## #
+class _Unparsable(Exception):
+    pass
+
+
+def _tokenize(text):
+    tokens = []
+    for match in _token_regex.finditer(text):
+        kind = match.lastgroup
+        if kind == 'space':
+            continue
+        if kind == 'other':
+            raise _Unparsable(text)
+        tokens.append((kind, match[kind]))
+    return tokens
+
+
+def _expand(tokens, known, active=frozenset()):
+    """
+    Replace each known object-like macro in `tokens` with its expanded body,
+    leaving the operands of `defined` alone.
+    """
+    expanded = []
+    position = 0
+    while position < len(tokens):
+        kind, text = tokens[position]
+        position += 1
+
+        if kind == 'name' and text == 'defined':
+            end = position
+            if end < len(tokens) and tokens[end][1] == '(':
+                end += 3
+            else:
+                end += 1
+            expanded.append((kind, text))
+            expanded.extend(tokens[position:end])
+            position = end
+            continue
+
+        body = known.get(text)
+        if kind == 'name' and isinstance(body, str) and text not in active:
+            expanded.extend(_expand(_tokenize(body), known, active | {text}))
+            continue
+
+        expanded.append((kind, text))
+
+    return expanded
+
+
+def _number(text):
+    digits = text.rstrip('uUlL')
+    if 'u' in text[len(digits):].lower():
+        # Unsigned arithmetic is left to the compiler
+        return None
+    if digits[:2] in ('0x', '0X'):
+        return int(digits, 16)
+    if len(digits) > 1 and digits[0] == '0':
+        return int(digits, 8)
+    return int(digits)
+
+
+def _binary(op, left, right):
+    if op == '&&':
+        if left == 0 or right == 0:
+            return 0
+        return None if left is None or right is None else 1
+    if op == '||':
+        if left or right:
+            return 1
+        return None if left is None or right is None else 0
+    if left is None or right is None:
+        return None
+
+    if op in ('/', '%'):
+        if right == 0:
+            return None
+        quotient = abs(left) // abs(right)
+        if (left < 0) != (right < 0):
+            quotient = -quotient
+        value = quotient if op == '/' else left - right * quotient
+    elif op in ('<<', '>>'):
+        if not 0 <= right < 64:
+            return None
+        value = left << right if op == '<<' else left >> right
+    else:
+        value = {
+            '|' : lambda: left | right,
+            '^' : lambda: left ^ right,
+            '&' : lambda: left & right,
+            '==': lambda: int(left == right),
+            '!=': lambda: int(left != right),
+            '<' : lambda: int(left < right),
+            '>' : lambda: int(left > right),
+            '<=': lambda: int(left <= right),
+            '>=': lambda: int(left >= right),
+            '+' : lambda: left + right,
+            '-' : lambda: left - right,
+            '*' : lambda: left * right,
+        }[op]()
+
+    return value if _INT_MIN <= value <= _INT_MAX else None
+
+
+class _Parser():
+    """
+    Evaluates a macro-expanded `#if` condition, where values that depend on
+    unknown macros are None.
+    """
+    def __init__(self, tokens, known):
+        self.tokens = tokens
+        self.known = known
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            kind, text = self.tokens[self.position]
+            if kind == 'op':
+                return text
+        return None
+
+    def next(self):
+        if self.position >= len(self.tokens):
+            raise _Unparsable('unexpected end of condition')
+        self.position += 1
+        return self.tokens[self.position - 1]
+
+    def expect(self, text):
+        if self.next()[1] != text:
+            raise _Unparsable(f'expected {text}')
+
+    def skip_arguments(self):
+        # A call to a function-like or unknown macro
+        if self.peek() != '(':
+            return False
+        depth = 0
+        while True:
+            text = self.next()[1]
+            depth += {'(': 1, ')': -1}.get(text, 0)
+            if depth == 0:
+                return True
+
+    def parse(self):
+        value = self.conditional()
+        if self.position != len(self.tokens):
+            raise _Unparsable('trailing tokens')
+        return value
+
+    def conditional(self):
+        condition = self.binary(1)
+        if self.peek() != '?':
+            return condition
+
+        self.next()
+        true = self.conditional()
+        self.expect(':')
+        false = self.conditional()
+        if condition is None:
+            return true if true == false else None
+        return true if condition else false
+
+    def binary(self, level):
+        left = self.unary()
+        while True:
+            op = self.peek()
+            precedence = _precedence.get(op)
+            if precedence is None or precedence < level:
+                return left
+            self.next()
+            left = _binary(op, left, self.binary(precedence + 1))
+
+    def unary(self):
+        kind, text = self.next()
+
+        if kind == 'op':
+            if text == '(':
+                value = self.conditional()
+                self.expect(')')
+                return value
+            if text in ('!', '~', '-', '+'):
+                value = self.unary()
+                if value is None:
+                    return None
+                return {
+                    '!': lambda: int(not value),
+                    '~': lambda: ~value,
+                    '-': lambda: -value,
+                    '+': lambda: value,
+                }[text]()
+            raise _Unparsable(f'unexpected {text}')
+
+        if kind == 'number':
+            return _number(text)
+
+        if kind == 'char':
+            body = text.lstrip('L')[1:-1]
+            return ord(body) if len(body) == 1 else None
+
+        if text == 'defined':
+            parenthesized = self.peek() == '('
+            if parenthesized:
+                self.next()
+            kind, name = self.next()
+            if kind != 'name':
+                raise _Unparsable('defined without a name')
+            if parenthesized:
+                self.expect(')')
+            if name not in self.known:
+                return None
+            return int(self.known[name] is not None)
+
+        # Whatever is left is an unknown macro, a function-like one or an
+        # undefined one, which is 0 unless it is called
+        undefined = text in self.known and self.known[text] is None
+        if self.skip_arguments():
+            return None
+        return 0 if undefined else None
+
+
+def evaluate(condition, known):
+    """
+    Return whether the `#if` condition `condition` holds, or None when that
+    depends on macros outside `known`.
+    """
+    try:
+        tokens = _expand(_tokenize(_comment_regex.sub(' ', condition)), known)
+        if not tokens:
+            return None
+        value = _Parser(tokens, known).parse()
+    except (_Unparsable, RecursionError, ValueError):
+        return None
+    return None if value is None else bool(value)
+
+
+# ## Conditionals ## #
+class _Group():
+    """
+    An open `#if` group. `kept` is set once one of its conditions is unknown,
+    from which point its directives stay in the output; `taken` once one of
+    its branches is known to be the live one.
+    """
+    __slots__ = ('outer_live', 'live', 'kept', 'taken')
+
+    def __init__(self, outer_live):
+        self.outer_live = outer_live
+        self.live = False
+        self.kept = False
+        self.taken = False
+
+
+def _directive_end(text, position, comment_starts, comment_ends):
+    # The end of the logical line at `position`, past escaped newlines and
+    # newlines inside comments
+    while True:
+        newline = text.find('\n', position)
+        if newline < 0:
+            return len(text)
+
+        index = bisect_right(comment_starts, newline) - 1
+        if index >= 0 and comment_ends[index] > newline:
+            position = comment_ends[index]
+        elif text[newline - 1:newline] == '\\' or text[newline - 2:newline] == '\\\r':
+            position = newline + 1
+        else:
+            return newline + 1
+
+
+def unifdef(text, known, partial=False):
+    """
+    Remove the branches of `text`'s conditionals that `known` decides, as
+    returned by `macros`. Returns the new text and the number of conditions
+    resolved. Headers with unbalanced conditionals are returned unchanged,
+    unless `partial` says `text` is only the start of a header, which may
+    end inside conditionals.
+    """
+    if not known or '#' not in text:
+        return text, 0
+
+    # Only lex headers with a directive that names one of the macros
+    names = '|'.join(map(re.escape, known))
+    directives = re.compile(
+        r'^[ \t]*\#[ \t]*(?:el)?(?:if|ifdef|ifndef|define|undef)\b(?:[^\n\\]|\\.)*?\b(?:' + names + r')\b',
+        re.MULTILINE | re.DOTALL
+    )
+    if not directives.search(text):
+        return text, 0
+
+    tokens = lexer.tokenize(text)
+    comments = [(start, end) for _, start, end in tokens.spans(lexer.COMMENT)]
+    comment_starts = [start for start, _ in comments]
+    comment_ends = [end for _, end in comments]
+
+    known = dict(known)
+    results = {}
+    output = []
+    groups = []
+    resolved = 0
+
+    def condition():
+        nonlocal resolved
+        expression = rest.replace('\\\r\n', ' ').replace('\\\n', ' ')
+        if keyword.endswith('ifdef'):
+            expression = f'defined({expression.strip()})'
+        elif keyword.endswith('ifndef'):
+            expression = f'!defined({expression.strip()})'
+        if expression not in results:
+            results[expression] = evaluate(expression, known)
+        value = results[expression]
+        if value is not None:
+            resolved += 1
+        return value
+
+    position = 0
+    for _, start, end in tokens.spans(lexer.DIRECTIVE):
+        keyword = text[start + 1:end].lstrip(' \t')
+        if keyword not in _keywords or start < position:
+            # Not a directive handled here, or part of a directive's
+            # continuation lines
+            continue
+
+        # Copy out the text since the last directive
+        line_start = text.rfind('\n', 0, start) + 1
+        if not groups or groups[-1].live:
+            output.append(text[position:line_start])
+
+        position = _directive_end(text, end, comment_starts, comment_ends)
+        line = text[line_start:position]
+        keyword_start = end - len(keyword) - line_start
+        rest = text[end:position]
+        live = not groups or groups[-1].live
+
+        if keyword in ('define', 'undef'):
+            if live:
+                name_match = re.match(r'\s*(\w+)(\()?(.*)', rest, re.DOTALL)
+                name = name_match[1] if name_match else None
+                if name in known:
+                    known.pop(name)
+                    if not any(group.kept for group in groups):
+                        # An unconditional redefinition is known too
+                        if keyword == 'undef':
+                            known[name] = None
+                        elif name_match[2]:
+                            known[name] = FUNCTION
+                        else:
+                            body = name_match[3].replace('\\\r\n', ' ').replace('\\\n', ' ')
+                            known[name] = _comment_regex.sub(' ', body).strip() or '1'
+                    results.clear()
+                output.append(line)
+            continue
+
+        if keyword in ('if', 'ifdef', 'ifndef'):
+            group = _Group(live)
+            groups.append(group)
+            if not live:
+                continue
+            value = condition()
+            if value is None:
+                group.kept = group.live = True
+                output.append(line)
+            else:
+                group.taken = group.live = value
+            continue
+
+        if not groups:
+            return text, 0
+        group = groups[-1]
+
+        if keyword == 'endif':
+            groups.pop()
+            if group.outer_live and group.kept:
+                output.append(line)
+            continue
+
+        if not group.outer_live:
+            continue
+        if group.taken:
+            group.live = False
+            continue
+
+        if keyword == 'else':
+            group.taken = group.live = True
+            if group.kept:
+                output.append(line)
+            continue
+
+        # elif, elifdef and elifndef
+        value = condition()
+        if value is None:
+            group.live = True
+            if group.kept:
+                output.append(line)
+            else:
+                # The first branch that can still be live opens the group
+                group.kept = True
+                output.append(line[:keyword_start] + line[keyword_start + 2:])
+        elif value:
+            group.taken = group.live = True
+            if group.kept:
+                newline = line[len(line.rstrip('\r\n')):] or '\n'
+                output.append(line[:line.index('#')] + '#else' + newline)
+        else:
+            group.live = False
+
+    if groups and not partial:
+        return text, 0
+
+    if not groups or groups[-1].live:
+        output.append(text[position:])
+    return ''.join(output), resolved
+
+
+def unifdef_files(known, file_data, results=None):
+    """
+    Run `unifdef` over `(path, data)` pairs, filling `results` with each
+    changed header's sizes before and after, and its resolved conditions.
+    """
+    for path, data in file_data:
+        with telemetry.span('unifdef', path, len(data), detail=True):
+            new_data, resolved = unifdef(data, known)
+        if resolved and results is not None:
+            results[path] = dict(size_in=len(data), size_out=len(new_data), resolved=resolved)
+        yield path, new_data
+
+
+# ## Report ## #
+class Report():
+    """
+    A per-run report of what `unifdef` removed, as one JSON line per header
+    at `path`. Toast time saved is estimated from the time toast took over
+    the reduced header, assuming it grows with the input's size.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def reset(self):
+        with open(self.path, 'w'):
+            pass
+
+    def record(self, path, size_in, size_out, resolved, toast_seconds=None, **_):
+        saved = None
+        if toast_seconds is not None and size_out:
+            saved = toast_seconds * (size_in - size_out) / size_out
+
+        entry = dict(
+            path          = path,
+            size_in       = size_in,
+            size_out      = size_out,
+            resolved      = resolved,
+            toast_seconds = None if toast_seconds is None else round(toast_seconds, 6),
+            saved_seconds = None if saved is None else round(saved, 6),
+            time          = time.time(),
+        )
+        append_json_line(self.path, entry)
+        return entry
+
+    def load(self):
+        try:
+            fh = open(self.path, 'r')
+        except FileNotFoundError:
+            return []
+
+        records = []
+        with fh:
+            for line in fh:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+
+        return records
+
@@ -0,0 +1,446 @@
+"""
+Watch mode: regenerate bindings as headers and the DSL change.
+
+`Watch` keeps the compiled DSL and a worker pool between changes, and runs
+changed headers through the pipeline in scratch directories (see
+`workers.scratch_worker`). Headers are never rewritten in place, so every
+run starts over from the text as saved; only the `.nim` next to each header
+is written.
+
+When the DSL changes, headers are only regenerated if the change can reach
+them. If only pre rules changed, the pre stage is run under the old and new
+rules, and headers whose output is the same are left alone. Post rules and
+toast's settings apply to toast's output, so a change to them regenerates
+every header; toast itself is served from the tool cache wherever its input
+is unchanged.
+
+Changes are picked up with inotify where the C library provides it, and by
+polling modification times otherwise.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+from functools import partial
+
+from .executors import make_pool, call_preloaded, call_star
+from .steps import nim_path_for, write_file
+from .workers import scratch_worker, changed_headers_worker
+
+
+log = logging.getLogger('deprocessor')
+
+HEADER_SUFFIX = '.h2'
+
+
+def _signature(path):
+    # What tells a saved file apart from the last time it was seen
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+    return info.st_mtime_ns, info.st_size
+
+
+def _headers(root):
+    for directory, _, names in os.walk(root):
+        for name in names:
+            if name.endswith(HEADER_SUFFIX):
+                yield os.path.join(directory, name)
+
+
+# ## Watchers ## #
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_Q_OVERFLOW  = 0x00004000
+IN_ISDIR       = 0x40000000
+IN_CLOEXEC     = 0o2000000
+
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+_EVENT = struct.Struct('iIII')
+
+
+def _load_inotify():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class InotifyWatcher():
+    """
+    Report changes under `root`, and to `files`, as the kernel sees them.
+    Every directory under `root` is watched, and new ones as they appear.
+    """
+    name = 'inotify'
+
+    def __init__(self, root, files, libc):
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.directories = {}
+        self.root = root
+        for directory, _, _ in os.walk(root):
+            self._add(directory)
+        # Editors often save by renaming over the file, so watch the
+        # directories the files are in
+        for path in files:
+            self._add(os.path.dirname(os.path.abspath(path)))
+
+    def _add(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            log.warning("Could not watch %s", directory)
+        else:
+            self.directories[wd] = directory
+
+    def changes(self, timeout=None):
+        """
+        Wait up to `timeout` seconds for changes, and return the paths that
+        changed, or None when events were lost and everything must be
+        checked.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        data = os.read(self.fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b'\0')
+            offset += _EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                return None
+            directory = self.directories.get(wd)
+            if directory is None:
+                continue
+
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Watch the new directory, and report what is already in it
+                    for subdirectory, _, names in os.walk(path):
+                        self._add(subdirectory)
+                        changed.update(os.path.join(subdirectory, n) for n in names)
+                continue
+            changed.add(path)
+
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher():
+    """
+    Report changes under `root`, and to `files`, by comparing modification
+    times every `interval` seconds.
+    """
+    name = 'polling'
+
+    def __init__(self, root, files, interval=1.0):
+        self.root = root
+        self.files = list(files)
+        self.interval = interval
+        self.state = self.scan()
+
+    def scan(self):
+        paths = [*_headers(self.root), *self.files]
+        return {path: _signature(path) for path in paths}
+
+    def changes(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            time.sleep(self.interval if deadline is None else min(self.interval, timeout))
+            state = self.scan()
+            changed = {
+                path
+                for path in state.keys() | self.state.keys()
+                if state.get(path) != self.state.get(path)
+            }
+            self.state = state
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def close(self):
+        pass
+
+
+def make_watcher(root, files, poll=False, interval=1.0):
+    """
+    Return an `InotifyWatcher` where inotify is available, and a
+    `PollingWatcher` otherwise or when `poll` is set.
+    """
+    libc = None if poll else _load_inotify()
+    if libc is not None:
+        try:
+            return InotifyWatcher(root, files, libc)
+        except OSError as e:
+            log.warning("inotify is not available (%s), polling instead", e)
+    return PollingWatcher(root, files, interval)
+
+
+# ## Watch ## #
+def _rules(replacements):
+    return [(r.pattern, repr(r.replacement), r.scope) for r in replacements]
+
+
+def _toast_settings(dsl):
+    return (dsl.defines, dsl.undefines, dsl.suffixes, dsl.prefixes, dsl.type_map, dsl.identifier_map)
+
+
+class Watch():
+    """
+    Regenerate the `.nim` files of the headers under `root` as they, or the
+    DSL at `dsl_path`, change. `load_dsl()` returns a compiled DSL, and
+    `options` are passed on to `workers.worker`.
+    """
+    def __init__(
+            self,
+            root,
+            dsl_path,
+            load_dsl,
+            processes=4,
+            executor='fork',
+            chunk_size=20,
+            cache=None,
+            options=None,
+            poll=False,
+            poll_interval=1.0,
+            debounce=0.1):
+        self.root = root
+        self.dsl_path = dsl_path
+        self.load_dsl = load_dsl
+        self.processes = processes
+        self.executor = executor
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.options = options or {}
+        self.poll = poll
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+
+        self.dsl = None
+        self.pool = None
+        self.watcher = None
+        self.signatures = {}
+
+    # ## Headers ## #
+    def headers(self):
+        return [
+            path for path in _headers(self.root)
+            if not any(regex.search(path) for regex in self.dsl.exclude_paths)
+        ]
+
+    def stale_headers(self, headers):
+        # Headers whose .nim is missing, or older than them or the DSL
+        dsl_time = os.path.getmtime(self.dsl_path)
+        stale = []
+        for path in headers:
+            try:
+                nim_time = os.path.getmtime(nim_path_for(path))
+            except OSError:
+                stale.append(path)
+                continue
+            if nim_time < max(os.path.getmtime(path), dsl_time):
+                stale.append(path)
+        return stale
+
+    def chunks(self, paths):
+        # Spread small batches over every worker, for latency
+        size = max(1, min(self.chunk_size, -(-len(paths) // self.processes)))
+        return [paths[i:i + size] for i in range(0, len(paths), size)]
+
+    # ## Pool ## #
+    def start_pool(self):
+        self.pool = make_pool(self.executor, self.processes, self.dsl)
+
+    def stop_pool(self):
+        self.pool.close()
+        self.pool.join()
+
+    def map(self, function, tasks):
+        return self.pool.imap_unordered(partial(call_star, function), tasks)
+
+    # ## Regenerating ## #
+    def regenerate(self, saves, reason, since='save'):
+        """
+        Run the headers in `saves` through the pipeline and write their
+        `.nim` files, reporting the time since each was saved, given as
+        `{path: save time}`.
+        """
+        if not saves:
+            return
+
+        paths = sorted(saves)
+        log.info("Regenerating %d headers (%s)", len(paths), reason)
+        process = partial(scratch_worker, cache=self.cache, **self.options)
+        if self.executor == 'fork':
+            # Workers already hold the DSL
+            results = self.pool.imap_unordered(
+                partial(call_preloaded, process),
+                [((), chunk) for chunk in self.chunks(paths)]
+            )
+        else:
+            results = self.map(process, [(self.dsl, (), chunk) for chunk in self.chunks(paths)])
+
+        latencies = []
+        failed = 0
+        for chunk_results, *_ in results:
+            for path, outcome in chunk_results:
+                if outcome['nim'] is None:
+                    failed += 1
+                    stages = sorted({f['stage'] for f in outcome['failures']})
+                    log.warning("  %s: failed (%s)", path, ', '.join(stages) or 'skipped')
+                    continue
+
+                write_file(nim_path_for(path), outcome['nim'])
+                latency = time.time() - saves[path]
+                latencies.append((latency, path))
+                if len(paths) <= 10:
+                    log.info("  %s: %.2fs from %s to .nim", nim_path_for(path), latency, since)
+
+        if latencies:
+            latencies.sort()
+            slowest, slowest_path = latencies[-1]
+            log.info(
+                "Regenerated %d headers, %d failed; %.2fs median and %.2fs slowest (%s) from %s to .nim",
+                len(latencies), failed, latencies[len(latencies) // 2][0], slowest, slowest_path, since
+            )
+        elif failed:
+            log.warning("Regenerated no headers, %d failed", failed)
+
+    def affected_headers(self, old, new, headers):
+        """
+        Return those of `headers` that DSL `new` can give different output
+        than `old`, and why.
+        """
+        if _toast_settings(old) != _toast_settings(new):
+            return headers, "toast settings changed"
+        if _rules(old.post_replacements) != _rules(new.post_replacements):
+            return headers, "post rules changed"
+        if _rules(old.pre_replacements) == _rules(new.pre_replacements):
+            return [], "no rules changed"
+
+        check = partial(
+            changed_headers_worker,
+            unifdef_headers = 'unifdef_report' in self.options,
+            **{k: v for k, v in self.options.items() if k.endswith(('_threshold', '_threads'))}
+        )
+        affected = []
+        for changed in self.map(check, [(old, new, chunk) for chunk in self.chunks(headers)]):
+            affected.extend(changed)
+        return affected, "pre rules changed"
+
+    def reload(self):
+        # Swap in the new DSL, returning the headers it affects
+        try:
+            new = self.load_dsl()
+        except Exception as e:
+            log.error("Keeping the previous DSL, %s failed to load: %s", self.dsl_path, e)
+            return []
+
+        old = self.dsl
+        old_headers = set(self.headers())
+        self.dsl = new
+        headers = self.headers()
+        added = [p for p in headers if p not in old_headers]
+
+        affected, reason = self.affected_headers(old, new, [p for p in headers if p in old_headers])
+        log.info(
+            "DSL changed: %s, %d of %d headers affected%s",
+            reason, len(affected), len(headers),
+            f", {len(added)} no longer excluded" if added else ''
+        )
+
+        if self.executor == 'fork':
+            # Fork workers hold the DSL they were started with
+            self.stop_pool()
+            self.start_pool()
+        return affected + added
+
+    # ## Loop ## #
+    def gather(self):
+        # Wait for a change, then for the burst of events a save makes to end
+        changed = self.watcher.changes()
+        while changed is not None:
+            more = self.watcher.changes(self.debounce)
+            if more is None:
+                changed = None
+            elif not more:
+                break
+            else:
+                changed |= more
+
+        if changed is None:
+            log.warning("Events were lost, checking every file")
+            changed = set(_headers(self.root)) | set(self.signatures) | {self.dsl_path}
+        return changed
+
+    def step(self, changed):
+        saves = {}
+        dsl_path = os.path.abspath(self.dsl_path)
+        excluded = lambda path: any(regex.search(path) for regex in self.dsl.exclude_paths)
+
+        for path in sorted(changed):
+            signature = _signature(path)
+            if os.path.abspath(path) == dsl_path:
+                if signature is not None and signature != self.signatures.get(dsl_path):
+                    self.signatures[dsl_path] = signature
+                    save_time = signature[0] / 1e9
+                    for header in self.reload():
+                        saves.setdefault(header, save_time)
+                continue
+
+            if not path.endswith(HEADER_SUFFIX) or excluded(path):
+                continue
+            if signature is None:
+                if self.signatures.pop(path, None) is not None:
+                    log.info("%s was removed", path)
+                continue
+            if signature != self.signatures.get(path):
+                self.signatures[path] = signature
+                # A header's own save is later than any DSL change
+                saves[path] = signature[0] / 1e9
+
+        self.regenerate(saves, 'changed')
+
+    def run(self):
+        self.dsl = self.load_dsl()
+        self.signatures[os.path.abspath(self.dsl_path)] = _signature(self.dsl_path)
+        self.watcher = make_watcher(self.root, [self.dsl_path], self.poll, self.poll_interval)
+        self.start_pool()
+
+        try:
+            headers = self.headers()
+            self.signatures.update((path, _signature(path)) for path in headers)
+            stale = self.stale_headers(headers)
+            log.info(
+                "Watching %d headers under %s and %s (%s), %d out of date",
+                len(headers), self.root, self.dsl_path, self.watcher.name, len(stale)
+            )
+            now = time.time()
+            self.regenerate({path: now for path in stale}, 'out of date', since='start')
+
+            while True:
+                self.step(self.gather())
+        except KeyboardInterrupt:
+            log.info("Stopping")
+        finally:
+            self.pool.terminate()
+            self.watcher.close()
@@ -0,0 +1,396 @@
+"""
+The functions pool workers run, and the helpers that prepare their input and
+collect their output.
+"""
+
+import glob
+import json
+import logging
+import os
+import shutil
+import tempfile
+from functools import partial
+from multiprocessing import Process
+
+from .steps import (
+    SubStats, nim_path_for, nimterop_files, read_files, split_streamed, stream_files,
+    sub_file_data, write_file, write_files
+)
+from .failures import FailureSink
+from .shared import read_shared
+from . import distributed, sinks, telemetry, unifdef
+
+
+log = logging.getLogger(__name__)
+
+
+def worker(
+        dsl,
+        paths,
+        completed=None,
+        shared=None,
+        stats=False,
+        cache=None,
+        journal=None,
+        failures=None,
+        amalgamate=0,
+        split_threshold=None,
+        split_threads=None,
+        stream_threshold=None,
+        quarantine=None,
+        unifdef_report=None):
+    pre_stats  = SubStats(len(dsl.pre_replacements)) if stats else None
+    post_stats = SubStats(len(dsl.post_replacements)) if stats else None
+
+    # Skip headers the toolchain is expected to fail on
+    skipped = []
+    digests = {}
+    if quarantine is not None:
+        paths, skipped, digests = quarantine.screen(paths, dsl.exclude_contents)
+        for path, reason in skipped:
+            log.debug("Skipping %s: %s", path, reason)
+            telemetry.skip(path)
+
+    # Skip stages a previous run already completed
+    completed = dict(completed or {})
+    pending = lambda stage, paths, key=str: [
+        p for p in paths
+        if stage not in completed.get(key(p), ())
+    ]
+
+    # Stream the largest files through the replacements in bounded memory
+    pre_paths, streamed = split_streamed(pending('pre', paths), stream_threshold)
+    stream_files(dsl.pre_replacements, streamed, pre_stats, journal, stage='pre')
+
+    # Read files in, unless the parent passed them through shared memory
+    if shared is not None:
+        kept = set(pre_paths)
+        file_data = [(p, data) for p, data in read_shared(shared) if p in kept]
+    else:
+        file_data = read_files(pre_paths)
+
+    # Perform initial replacements
+    file_data = sub_file_data(
+        dsl.pre_replacements, file_data, pre_stats,
+        split_threshold, split_threads, stage='pre'
+    )
+
+    # Strip conditional branches the DSL's macros rule out
+    unifdef_results = {}
+    if unifdef_report is not None:
+        known = unifdef.macros(dsl.defines, dsl.undefines)
+        file_data = unifdef.unifdef_files(known, file_data, unifdef_results)
+
+    # Write files out
+    write_files(file_data, journal, 'pre')
+
+    # Run Nimterop over files
+    durations = {}
+    toast_paths = pending('toast', paths, nim_path_for)
+    nim_paths = nimterop_files(
+        paths          = toast_paths,
+        defines        = dsl.defines,
+        undefines      = dsl.undefines,
+        suffixes       = dsl.suffixes,
+        prefixes       = dsl.prefixes,
+        type_map       = dsl.type_map,
+        identifier_map = dsl.identifier_map,
+        cache          = cache,
+        failures       = failures,
+        batch_size     = amalgamate,
+        durations      = durations,
+    )
+
+    for nim_path in nim_paths:
+        if journal is not None:
+            journal.done(nim_path, 'toast')
+        completed[nim_path] = completed.get(nim_path, set()) | {'toast'}
+
+    for path, result in unifdef_results.items():
+        unifdef_report.record(path, toast_seconds=durations.get(path), **result)
+
+    # Remember what toast failed on, so later runs skip it
+    if quarantine is not None:
+        for path in toast_paths:
+            toasted = 'toast' in completed.get(nim_path_for(path), ())
+            if not toasted and path in digests:
+                quarantine.remember(path, digests[path], 'toast failed')
+
+    # Read files in, skipping those toast failed on
+    nim_paths = [
+        p for p in pending('post', map(nim_path_for, paths))
+        if 'toast' in completed.get(p, ())
+    ]
+    nim_paths, streamed = split_streamed(nim_paths, stream_threshold)
+    stream_files(dsl.post_replacements, streamed, post_stats, journal, stage='post')
+    file_data = read_files(nim_paths)
+
+    # Perform post replacements
+    file_data = sub_file_data(
+        dsl.post_replacements, file_data, post_stats,
+        split_threshold, split_threads, stage='post'
+    )
+
+    # Write files out
+    write_files(file_data, journal, 'post')
+
+    return pre_stats, post_stats, skipped
+
+
+def scratch_worker(dsl, items, copy_paths=(), cache=None, **options):
+    """
+    Run `worker` inside a scratch directory over `(path, data)` pairs, and
+    over the files at `copy_paths`, which are copied rather than read. Files
+    from the same directory share a scratch directory, so amalgamation still
+    applies. Returns `(results, pre_stats, post_stats, skipped)`: each
+    header's rewritten text, its Nim output (None when toast failed) and any
+    failure records, then the worker's own results, all under the original
+    paths.
+    """
+    with tempfile.TemporaryDirectory() as scratch:
+        failures = FailureSink(os.path.join(scratch, 'failures.jsonl'))
+
+        unifdef_report = options.pop('unifdef_report', None)
+        if unifdef_report is not None:
+            options['unifdef_report'] = unifdef.Report(os.path.join(scratch, 'unifdef.jsonl'))
+
+        local_dirs = {}
+        local_paths = {}
+
+        def local_path_for(path):
+            directory = os.path.dirname(path)
+            if directory not in local_dirs:
+                local_dirs[directory] = os.path.join(scratch, str(len(local_dirs)))
+                os.makedirs(local_dirs[directory])
+            local_path = os.path.join(local_dirs[directory], os.path.basename(path))
+            local_paths[path] = local_path
+            return local_path
+
+        for path, data in items:
+            write_file(local_path_for(path), data)
+        for path in copy_paths:
+            shutil.copyfile(path, local_path_for(path))
+
+        pre_stats, post_stats, skipped = worker(
+            dsl, list(local_paths.values()), cache=cache, failures=failures, **options
+        )
+
+        original_paths = {local: path for path, local in local_paths.items()}
+        original_paths.update({nim_path_for(local): nim_path_for(path) for path, local in local_paths.items()})
+        for stats in (pre_stats, post_stats):
+            if stats is not None:
+                stats.files = {original_paths[p]: touched for p, touched in stats.files.items()}
+        skipped_local = {p for p, _ in skipped}
+        skipped = [(original_paths[p], reason) for p, reason in skipped]
+
+        if unifdef_report is not None:
+            for record in options['unifdef_report'].load():
+                record.update(path=original_paths[record['path']])
+                unifdef_report.record(**record)
+
+        failure_records = {}
+        for record in failures.load():
+            failure_records.setdefault(record['path'], []).append(record)
+
+        results = []
+        for path, local_path in local_paths.items():
+            nim_path = nim_path_for(local_path)
+
+            outcome = {
+                'header'  : None,
+                'nim'     : None,
+                'failures': failure_records.get(local_path, []),
+                'skipped' : local_path in skipped_local,
+            }
+            if outcome['skipped']:
+                results.append((path, outcome))
+                continue
+
+            for key, output_path in (('header', local_path), ('nim', nim_path)):
+                if os.path.isfile(output_path):
+                    with open(output_path, 'r') as fh:
+                        outcome[key] = fh.read()
+
+            results.append((path, outcome))
+
+        return results, pre_stats, post_stats, skipped
+
+
+def remote_worker(dsl, items, cache=None):
+    """
+    Run `worker` over `(path, data)` pairs received from a coordinator, inside
+    a scratch directory, and return each header's rewritten text, its Nim
+    output (None when toast failed) and any failure records.
+    """
+    return scratch_worker(dsl, items, cache=cache)[0]
+
+
+def packed_worker(dsl, paths, completed=None, shared=None, failures=None, **options):
+    """
+    Run `worker` over `paths` inside a scratch directory, and send each
+    rewritten header and its Nim output to the packed output store, leaving
+    the inputs untouched. Headers the parent passed through shared memory
+    are written out from there; others are copied.
+    """
+    items = read_shared(shared) if shared is not None else []
+    in_memory = {path for path, _ in items}
+    copy_paths = [path for path in paths if path not in in_memory]
+
+    results, pre_stats, post_stats, skipped = scratch_worker(
+        dsl, items, copy_paths, **options
+    )
+    for path, outcome in results:
+        if outcome['header'] is not None:
+            sinks.write(path, outcome['header'])
+        if outcome['nim'] is not None:
+            sinks.write(nim_path_for(path), outcome['nim'])
+        forward_failures(failures, path, outcome['failures'])
+
+    return pre_stats, post_stats, skipped
+
+
+def forward_failures(failures, path, records):
+    # Failure records from a scratch directory, filed under the original path
+    for record in records:
+        record.update(path=path)
+        failures.record(**{k: v for k, v in record.items() if k != 'time'}, report=False)
+
+
+def write_remote_result(failures, path, outcome):
+    if outcome['header'] is not None:
+        write_file(path, outcome['header'])
+
+    forward_failures(failures, path, outcome['failures'])
+
+    if outcome['nim'] is None:
+        log.warning("Remote worker failed for %s", path)
+    else:
+        write_file(nim_path_for(path), outcome['nim'])
+
+
+def write_remote_failure(failures, path, reason):
+    failures.record(path=path, stage='remote', stderr=reason)
+
+
+def run_remote_workers(address, count, authkey, cache=None):
+    process_batch = partial(remote_worker, cache=cache)
+
+    processes = [
+        Process(
+            target = distributed.run_worker,
+            args   = (address, process_batch, authkey),
+        )
+        for _ in range(count)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+def dry_run_worker(dsl, paths, split_threshold=None, split_threads=None, stream_threshold=None):
+    """
+    Run the in-process replacement stages over `paths` without spawning any
+    tools or writing anything to disk, returning the match statistics.
+    Post replacements operate on toast output, which a dry run has none of,
+    so their statistics are left empty and the report lists them as not
+    evaluated. `.nim` files left by a previous run already had them applied.
+    """
+    pre_stats  = SubStats(len(dsl.pre_replacements))
+    post_stats = SubStats(len(dsl.post_replacements))
+
+    # Perform initial replacements
+    pre_paths, streamed = split_streamed(paths, stream_threshold)
+    stream_files(dsl.pre_replacements, streamed, pre_stats, stage='pre', write=False)
+    file_data = read_files(pre_paths)
+    file_data = sub_file_data(
+        dsl.pre_replacements, file_data, pre_stats,
+        split_threshold, split_threads, stage='pre'
+    )
+    for _ in file_data:
+        pass
+
+    return pre_stats, post_stats
+
+
+def changed_headers_worker(old_dsl, new_dsl, paths, unifdef_headers=True, split_threshold=None, split_threads=None, stream_threshold=None):
+    """
+    Return those of `paths` whose pre stage output, unifdef included, differs
+    between two DSLs, without running any tools or writing anything. Files
+    large enough to be streamed are always returned.
+    """
+    paths, streamed = split_streamed(paths, stream_threshold)
+
+    outputs = []
+    for dsl in (old_dsl, new_dsl):
+        file_data = sub_file_data(
+            dsl.pre_replacements, read_files(paths), None,
+            split_threshold, split_threads
+        )
+        if unifdef_headers:
+            known = unifdef.macros(dsl.defines, dsl.undefines)
+            file_data = unifdef.unifdef_files(known, file_data)
+        outputs.append(dict(file_data))
+
+    old_outputs, new_outputs = outputs
+    return streamed + [p for p in paths if old_outputs.get(p) != new_outputs.get(p)]
+
+
+def stats_report(dsl, file_count, pre_stats, post_stats):
+    rules = []
+    dead = []
+    unevaluated = []
+    files = {}
+
+    stages = (
+        ('pre',  dsl.pre_replacements,  pre_stats),
+        ('post', dsl.post_replacements, post_stats),
+    )
+    for stage, subs, stats in stages:
+        for index, (regex, replacement) in enumerate(subs):
+            rule = {
+                'stage'      : stage,
+                'index'      : index,
+                'pattern'    : regex.pattern,
+                'replacement': str(replacement),
+                'matches'    : stats.matches[index],
+                'files'      : stats.file_counts[index],
+            }
+            rules.append(rule)
+
+            if not stats.files:
+                unevaluated.append(rule)
+            elif not stats.matches[index]:
+                dead.append(rule)
+
+        for path, touched in stats.files.items():
+            files.setdefault(path, {})[stage] = touched
+
+    return {
+        'file_count' : file_count,
+        'rules'      : rules,
+        'files'      : files,
+        'dead'       : dead,
+        'unevaluated': unevaluated,
+    }
+
+
+def get_paths(dsl, parent_path):
+    header_glob = os.path.join(parent_path, '**/*.h2')
+    for path in glob.iglob(header_glob, recursive=True):
+        invalid = any(
+            regex.search(path)
+            for regex in dsl.exclude_paths
+        )
+        if invalid:
+            continue
+
+        yield path
+
+
+def write_stats(path, report):
+    text = json.dumps(report, indent=4)
+    if path == '-':
+        print(text)
+    else:
+        write_file(path, text)
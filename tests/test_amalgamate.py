@@ -0,0 +1,80 @@
+import pytest
+
+from deprocessor import amalgamate
+
+
+TOKEN = 'abc'
+
+EMPTY_OUTPUT = 'import nimterop/types\n\n'
+
+OUTPUT = '''\
+import nimterop/types
+
+const
+  A* = 1
+  DeprocessorMarkerabcx1* = 1
+  B* = 2
+  DeprocessorMarkerabcx2* = 2
+
+type
+  AType* = cint
+  DeprocessorMarkerabcx1Type* = cint
+  BType* = object
+    x*: cint
+  DeprocessorMarkerabcx2Type* = cint
+
+proc a*() {.importc.}
+proc DeprocessorMarkerabcx1Proc*() {.importc.}
+proc b*() {.importc.}
+proc DeprocessorMarkerabcx2Proc*() {.importc.}
+'''
+
+
+def test_join_headers_marks_boundaries():
+    joined = amalgamate.join_headers(TOKEN, ['#define A 1\nint a;', '#define B 2\n'])
+
+    assert joined.startswith('#define A 1\nint a;\n')
+    assert '#undef A\n' in joined
+    assert 'typedef int DeprocessorMarkerabcx1Type;\n' in joined
+    assert joined.endswith('void DeprocessorMarkerabcx1Proc(void);\n#define B 2\n')
+
+
+def test_split_output():
+    pieces = amalgamate.split_output(TOKEN, 3, OUTPUT, EMPTY_OUTPUT)
+
+    assert pieces == [
+        'import nimterop/types\n\n'
+        'const\n  A* = 1\n'
+        'type\n  AType* = cint\n'
+        'proc a*() {.importc.}\n',
+
+        'import nimterop/types\n\n'
+        'const\n  B* = 2\n'
+        'type\n  BType* = object\n    x*: cint\n'
+        'proc b*() {.importc.}\n',
+
+        'import nimterop/types\n\n',
+    ]
+
+
+def test_split_output_rejects_missing_markers():
+    output = OUTPUT.replace('proc DeprocessorMarkerabcx2Proc*() {.importc.}\n', '')
+
+    with pytest.raises(amalgamate.SplitError):
+        amalgamate.split_output(TOKEN, 3, output, EMPTY_OUTPUT)
+
+
+def test_split_output_rejects_markers_out_of_order():
+    output = OUTPUT.replace('x1Proc', 'x9Proc')
+
+    with pytest.raises(amalgamate.SplitError):
+        amalgamate.split_output(TOKEN, 3, output, EMPTY_OUTPUT)
+
+
+def test_split_output_rejects_files_that_came_out_empty():
+    declared = [amalgamate.declares(data) for data in ('int a;', 'int b;', '// only a comment\n')]
+    assert declared == [True, True, False]
+
+    amalgamate.split_output(TOKEN, 3, OUTPUT, EMPTY_OUTPUT, declared)
+    with pytest.raises(amalgamate.SplitError):
+        amalgamate.split_output(TOKEN, 3, OUTPUT, EMPTY_OUTPUT, [True, True, True])
@@ -0,0 +1,62 @@
+from deprocessor import chunking, steps
+from deprocessor.dsl import Replacement
+
+
+RULES = [
+    (r'\b (\w+) _t \b',          '$1Type'),
+    (r'^ [ \t]* typedef [ ]+',   'typedef '),
+    (r'(?<=\w) $',               ';'),
+    (r'^ (?=\w)',                '  '),
+    (r'foo \s+ bar',             'foobar'),
+    (r'\b int \b',               'cint'),
+]
+
+
+def header(lines):
+    pieces = []
+    for index in range(lines):
+        if index % 7 == 0:
+            pieces.append('')
+        if index % 11 == 0:
+            pieces.append('/* a comment\n\n spanning lines */')
+        if index % 13 == 0:
+            pieces.append('#define LONG_MACRO(x) \\\n\n    (x)')
+        pieces.append(f'typedef   int value{index}_t; foo')
+        pieces.append(f'bar size{index}_t')
+    return '\n'.join(pieces) + '\n'
+
+
+def whole_file(subs, data):
+    counts = []
+    for regex, replacement in subs:
+        data, count = regex.subn(getattr(replacement, 'native', replacement), data)
+        counts.append(count)
+    return data, counts
+
+
+def test_split_chunks_ends_at_line_ends():
+    data = header(200)
+    chunks = chunking.split_chunks(data, 500)
+
+    assert len(chunks) > 5
+    assert ''.join(chunks) == data
+    assert all(chunk.endswith('\n') for chunk in chunks)
+
+
+def test_chunked_substitution_matches_whole_file():
+    subs = [Replacement(pattern, replacement, []) for pattern, replacement in RULES]
+    assert [sub.line_local for sub in subs] == [True, True, True, True, False, True]
+
+    data = header(300)
+    expected, expected_counts = whole_file(subs, data)
+
+    stats = steps.SubStats(len(subs))
+    [(_, result)] = steps.sub_file_data(
+        subs, [('a.h', data)],
+        stats           = stats,
+        split_threshold = 1000,
+        split_threads   = 4,
+    )
+
+    assert result == expected
+    assert stats.matches == expected_counts
@@ -0,0 +1,103 @@
+import os
+import socket
+import threading
+from multiprocessing import Process
+
+import pytest
+
+from deprocessor import distributed
+
+
+AUTHKEY = b'test-key'
+
+
+def upper_batch(dsl, items):
+    if any('broken' in path for path, _ in items):
+        raise FileNotFoundError("toast.exe")
+    if any('crash' in path for path, _ in items):
+        os._exit(1)
+    return [(path, dsl + data.upper()) for path, data in items]
+
+
+def free_address():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()
+
+
+def run(tmp_path, names, workers=3, batch_size=2, **options):
+    paths = []
+    for name in names:
+        path = tmp_path / name
+        path.write_text(name)
+        paths.append(str(path))
+
+    results = {}
+    failures = {}
+    lock = threading.Lock()
+
+    def handle_result(path, outcome):
+        with lock:
+            assert path not in results
+            results[path] = outcome
+
+    def handle_failure(path, reason):
+        with lock:
+            assert path not in failures
+            failures[path] = reason
+
+    coordinator = distributed.Coordinator(
+        paths, '>', handle_result, handle_failure,
+        batch_size = batch_size,
+        authkey    = AUTHKEY,
+        **options
+    )
+    coordinator.wait_interval = 0.05
+
+    address = free_address()
+    processes = [
+        Process(target=distributed.run_worker, args=(address, upper_batch, AUTHKEY, 20, 0.05))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        coordinator.serve(address)
+    finally:
+        for process in processes:
+            process.join(10)
+            if process.is_alive():
+                process.kill()
+
+    names = lambda paths: {os.path.basename(path): value for path, value in paths.items()}
+    return names(results), names(failures)
+
+
+def test_every_path_completes_once_across_workers(tmp_path):
+    names = [f'h{i}.h2' for i in range(25)]
+    results, failures = run(tmp_path, names)
+
+    assert results == {name: '>' + name.upper() for name in names}
+    assert failures == {}
+
+
+def test_processing_errors_fail_their_batch_only(tmp_path):
+    results, failures = run(tmp_path, ['a.h2', 'broken.h2', 'c.h2', 'd.h2'])
+
+    assert set(failures) == {'a.h2', 'broken.h2'}
+    assert all('FileNotFoundError' in reason for reason in failures.values())
+    assert set(results) == {'c.h2', 'd.h2'}
+
+
+def test_batch_losing_workers_fails_after_max_leases(tmp_path):
+    results, failures = run(tmp_path, ['crash.h2', 'b.h2', 'c.h2'], workers=4, batch_size=1, max_leases=3)
+
+    assert set(failures) == {'crash.h2'}
+    assert 'lost 3 workers' in failures['crash.h2']
+    assert set(results) == {'b.h2', 'c.h2'}
+
+
+def test_tcp_needs_a_key():
+    with pytest.raises(ValueError):
+        distributed.check_authkey(('127.0.0.1', 1), b'')
+    assert distributed.check_authkey('/tmp/socket', b'') == distributed.LOCAL_AUTHKEY
@@ -0,0 +1,92 @@
+import os
+
+from deprocessor import identifiers
+
+
+HEADER = '''\
+#define HD_ITEM 1
+#define MAX(a, b) ((a) > (b) ? (a) : (b))
+typedef struct tagHDITEM { int mask; struct { int x; } inner; } HDITEM, *LPHDITEM;
+enum WriteCacheType { WRITE_CACHE_TYPE = 1, Other = WRITE_CACHE_TYPE + 1 };
+int __stdcall GetHdItem(HDITEM *item, int count);
+extern int g_count;
+/* int commented_out; */
+// int also_commented;
+const char *text = "int in_a_string;";
+__declspec(dllimport) int Imported(void);
+'''
+
+
+def test_declarations():
+    assert identifiers.declarations(HEADER) == {
+        'HD_ITEM'         : {'Const'},
+        'MAX'             : {'Const'},
+        'tagHDITEM'       : {'Type'},
+        'HDITEM'          : {'Type'},
+        'LPHDITEM'        : {'Type'},
+        'WriteCacheType'  : {'Type'},
+        'WRITE_CACHE_TYPE': {'Enum'},
+        'Other'           : {'Enum'},
+        'GetHdItem'       : {'Proc'},
+        'g_count'         : {'Var'},
+        'text'            : {'Var'},
+        'Imported'        : {'Proc'},
+    }
+
+
+def test_collisions():
+    table = identifiers.declarations(HEADER)
+    groups = identifiers.collisions(table)
+
+    assert sorted(sorted(group) for group in groups) == [
+        ['HDITEM', 'HD_ITEM'],
+        ['WRITE_CACHE_TYPE', 'WriteCacheType'],
+    ]
+
+
+def test_collisions_follow_rewrites_and_affixes():
+    table = {'HDITEM': {'Type'}, 'HD_ITEM': {'Const'}, 'tagHd_Item': {'Type'}}
+
+    # Renamed apart by the DSL
+    assert identifiers.collisions(table, {'HD_ITEM': 'HD_ITEM_VALUE'}) == []
+    # Brought together by toast's --prefix
+    groups = identifiers.collisions(table, {'HD_ITEM': 'HD_ITEM_VALUE'}, prefixes=('tag',))
+    assert groups == [{'HDITEM': {'Type'}, 'tagHd_Item': {'Type'}}]
+
+
+def test_rewrite_rules():
+    groups = [
+        {'HDITEM': {'Type'}, 'HD_ITEM': {'Const'}},
+        {'WRITE_CACHE_TYPE': {'Enum'}, 'WriteCacheType': {'Enum'}},
+    ]
+
+    assert identifiers.rewrite_rules(groups) == [
+        ('WriteCacheType', 'WriteCacheTypeIsNim2'),
+        ('WRITE_CACHE_TYPE', 'WRITE_CACHE_TYPE_IS_NIM_1'),
+        ('HD_ITEM', 'HD_ITEM_IS_NIM_CONST'),
+        ('HDITEM', 'HDITEM_IS_NIM_TYPE'),
+    ]
+    assert identifiers.rewrite_rules(groups[:1], {'HDITEM': 'HeaderItem'}) == [
+        ('HD_ITEM', 'HD_ITEM_IS_NIM_CONST'),
+    ]
+
+
+def test_index_only_rereads_changed_files(tmp_path):
+    first = tmp_path / 'first.h'
+    second = tmp_path / 'second.h'
+    first.write_text('#define HD_ITEM 1\n')
+    second.write_text('typedef int HDITEM;\n')
+    paths = [str(first), str(second)]
+
+    index = identifiers.IdentifierIndex(str(tmp_path / 'index.json'))
+    assert index.update(paths) == (2, 0)
+    index.save()
+
+    index = identifiers.IdentifierIndex(index.path).load()
+    assert index.update(paths) == (0, 0)
+
+    second.write_text('typedef int HDITEM2;\n')
+    stat = os.stat(second)
+    os.utime(second, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert index.update(paths[1:]) == (1, 1)
+    assert index.table() == {'HDITEM2': {'Type'}}
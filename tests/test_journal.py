@@ -0,0 +1,58 @@
+import hashlib
+
+from deprocessor.journal import Journal
+
+
+def test_load_without_journal(tmp_path):
+    assert Journal(str(tmp_path / 'missing.journal')).load() == {}
+
+
+def test_load_settles_writes(tmp_path):
+    journal = Journal(str(tmp_path / 'deprocess.journal'))
+    journal.reset()
+
+    done = str(tmp_path / 'done.h')
+    landed = str(tmp_path / 'landed.h')
+    lost = str(tmp_path / 'lost.h')
+    missing = str(tmp_path / 'missing.h')
+    for path in (done, landed, lost):
+        with open(path, 'w') as fh:
+            fh.write('old')
+
+    # Written and recorded
+    journal.begin(done, 'pre', 'new')
+    journal.done(done, 'pre')
+
+    # Written, but the run died before recording it
+    journal.begin(landed, 'pre', 'new')
+    with open(landed, 'w') as fh:
+        fh.write('new')
+
+    # Recorded as about to be written, but never written
+    journal.begin(lost, 'pre', 'new')
+    journal.begin(missing, 'pre', 'new')
+
+    # A later stage of a file whose earlier stage completed
+    journal.begin(done, 'post', 'newer')
+
+    assert journal.load() == {done: {'pre'}, landed: {'pre'}}
+
+
+def test_load_skips_torn_line(tmp_path):
+    journal = Journal(str(tmp_path / 'deprocess.journal'))
+    journal.reset()
+    journal.done('a.h', 'pre')
+    with open(journal.path, 'a') as fh:
+        fh.write('{"path": "b.h", "sta')
+
+    assert journal.load() == {'a.h': {'pre'}}
+
+
+def test_begin_accepts_a_digest(tmp_path):
+    journal = Journal(str(tmp_path / 'deprocess.journal'))
+    journal.reset()
+    path = tmp_path / 'a.h'
+    path.write_bytes(b'streamed')
+
+    journal.begin(str(path), 'post', digest=hashlib.sha256(b'streamed').hexdigest())
+    assert journal.load() == {str(path): {'post'}}
@@ -0,0 +1,79 @@
+import regex
+
+from deprocessor import lexer
+
+
+HEADER = '''\
+#define WORD_T unsigned short  // WORD_T in a comment
+typedef WORD_T *PWORD_T;
+const char *s = "WORD_T";
+WORD_T WORD_T_MAX;
+'''
+
+
+def rule(pattern, repl):
+    return (regex.compile(pattern), repl)
+
+
+def test_only_whole_identifiers_are_replaced():
+    data, counts = lexer.sub_identifiers([rule(r'WORD_T', 'WORD')], HEADER)
+
+    assert data == '''\
+#define WORD unsigned short  // WORD_T in a comment
+typedef WORD *PWORD_T;
+const char *s = "WORD_T";
+WORD WORD_T_MAX;
+'''
+    assert counts == [3]
+
+
+def test_matches_subn_on_identifier_boundaries():
+    pattern = r'(\w+)_T'
+    data, counts = lexer.sub_identifiers([rule(pattern, r'\1Type')], 'WORD_T x; PWORD_T y;')
+
+    assert data == 'WORDType x; PWORDType y;'
+    assert counts == [2]
+
+
+def test_rules_apply_in_order():
+    rules = [
+        rule(r'a', 'b'),
+        rule(r'b', 'c'),
+        rule(r'c\w*', lambda m: m[0].upper()),
+    ]
+    data, counts = lexer.sub_identifiers(rules, 'a b cd e')
+
+    assert data == 'C C CD e'
+    assert counts == [1, 2, 3]
+
+
+def test_one_rule_renames_all_at_once():
+    swap = {'x': 'y', 'y': 'x'}
+    data, counts = lexer.sub_identifiers([rule(r'x|y', lambda m: swap[m[0]])], 'x = y + x;')
+
+    assert data == 'y = x + y;'
+    assert counts == [3]
+
+
+def test_unchanged_text_is_returned_as_is():
+    data, counts = lexer.sub_identifiers([rule(r'missing', 'found')], HEADER)
+
+    assert data is HEADER
+    assert counts == [0]
+
+
+def test_derived_tokens_match_a_fresh_lex():
+    data, _ = lexer.sub_identifiers([rule(r'WORD_T', 'W'), rule(r's', 'string_value')], HEADER)
+
+    cached = lexer.tokenize(data)
+    fresh = lexer._lex(data)
+    assert list(cached.kinds) == list(fresh.kinds)
+    assert list(cached.starts) == list(fresh.starts)
+    assert list(cached.ends) == list(fresh.ends)
+
+
+def test_token_regex_subn():
+    token_regex = lexer.TokenRegex(regex.compile(r'WORD_T'))
+
+    data, (count,) = lexer.sub_identifiers([(token_regex, 'WORD')], HEADER)
+    assert token_regex.subn('WORD', HEADER) == (data, count)
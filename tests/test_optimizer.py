@@ -0,0 +1,75 @@
+import regex
+
+from deprocessor import optimizer
+
+
+class Statement():
+    def __init__(self, text):
+        self.text = text
+
+
+def rules(*pairs):
+    return [(pattern, replacement, Statement(f'{pattern} -> {replacement}')) for pattern, replacement in pairs]
+
+
+def apply(result, text):
+    for pattern, replacement, _ in result:
+        text = regex.sub(pattern, replacement, text)
+    return text
+
+
+def test_removes_idempotent_duplicate():
+    report = []
+    result = optimizer.optimize_replacements(rules((r'\bfoo\b', 'bar'), (r'\bfoo\b', 'bar')), 'REPLACE', report)
+
+    assert len(result) == 1
+    assert [(o.action, o.reason) for o in report] == [('removed', 'duplicate')]
+
+
+def test_keeps_duplicate_that_can_match_again():
+    report = []
+    result = optimizer.optimize_replacements(rules(('ab', 'aab'), ('ab', 'aab')), 'REPLACE', report)
+
+    assert len(result) == 2
+    assert report[0].action == 'kept'
+
+
+def test_removes_shadowed_rule():
+    report = []
+    result = optimizer.optimize_replacements(rules(('IID', 'GUID'), ('IID_Foo', 'GUID_Foo')), 'REPLACE', report)
+
+    assert [pattern for pattern, _, _ in result] == ['IID']
+    assert report[0].action == 'removed'
+    assert report[0].reason.startswith('shadowed by')
+
+
+def test_folds_word_rules_into_one_map():
+    original = rules((r'\bfoo\b', 'bar'), (r'\bbaz\b', 'qux'), (r'\bfood\b', 'meal'))
+    report = []
+    result = optimizer.optimize_replacements(original, 'REPLACE', report)
+
+    assert len(result) == 1
+    pattern, token_map, statements = result[0]
+    assert isinstance(token_map, optimizer.TokenMap)
+    assert len(statements) == 3
+    assert {o.action for o in report} == {'folded'}
+
+    text = 'foo food baz foobar'
+    assert apply(result, text) == apply(original, text) == 'bar meal qux foobar'
+
+
+def test_does_not_fold_chained_words():
+    # `bar` is produced by the first rule and rewritten by the second
+    original = rules((r'\bfoo\b', 'bar'), (r'\bbar\b', 'baz'))
+    result = optimizer.optimize_replacements(original, 'REPLACE', [])
+
+    assert apply(result, 'foo bar') == apply(original, 'foo bar') == 'baz baz'
+
+
+def test_fold_off_keeps_rules_separate():
+    original = rules((r'\bfoo\b', 'bar'), (r'\bbaz\b', 'qux'))
+    report = []
+    result = optimizer.optimize_replacements(original, 'REPLACE', report, fold=False)
+
+    assert result == original
+    assert report == []
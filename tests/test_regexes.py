@@ -0,0 +1,60 @@
+import pytest
+
+from deprocessor import regexes
+
+
+@pytest.mark.parametrize('pattern', [
+    r'\bfoo\b',
+    r'^ [ \t]* \# [ \t]* pragma .* $',
+    r'(\w+) _t \b',
+    r'[ -~]+',
+    r'''
+        __declspec   # MSVC only
+        \( \w+ \)
+    ''',
+])
+def test_line_local(pattern):
+    assert regexes.is_line_local(pattern)
+
+
+@pytest.mark.parametrize('pattern', [
+    r'foo \s+ bar',
+    r'foo \n bar',
+    r'[^;]+ ;',
+    r'[\t-z]',
+    r'[\x00-\x7f]',
+    r'(?s) a .* b',
+    r'\A header',
+    r'[[:space:]]',
+    r'''
+        a [
+        ] b
+    ''',
+])
+def test_not_line_local(pattern):
+    assert not regexes.is_line_local(pattern)
+
+
+def test_lookbehind_reach_of_line_local_pattern():
+    assert regexes.lookbehind_reach(r'\bfoo\b') == 0
+
+
+@pytest.mark.parametrize('pattern, width', [
+    (r'(?<=struct[ ]) \w+',      7),
+    (r'(?<!\#) define',          1),
+    (r'(?<=a) b (?<=bc)',        2),
+    (r'(?<=\n) b',               1),
+    (r'(?<=(?:ab|cd)) e',        2),
+])
+def test_lookbehind_reach_bounds_lookbehinds(pattern, width):
+    # An upper bound on the text the lookbehinds can see
+    assert regexes.lookbehind_reach(pattern) >= width
+
+
+@pytest.mark.parametrize('pattern', [
+    r'(?<=a+) b',
+    r'(?<=\w{2,}) b',
+    r'(?<=a) \s+ b',
+])
+def test_lookbehind_reach_unbounded(pattern):
+    assert regexes.lookbehind_reach(pattern) is None
@@ -0,0 +1,76 @@
+import signal
+
+import pytest
+
+# replace_3 installs a SIGINT handler that signals its parent when imported
+# as a worker module, which must not outlive the import here
+_handler = signal.getsignal(signal.SIGINT)
+from deprocessor import replace_3
+signal.signal(signal.SIGINT, _handler)
+
+
+PRE_MACROS = '#define WIN32\n#undef _MSC_VER'
+POST_MACROS = '#undef WIN32'
+
+HEADER = '''\
+#pragma once
+#include <windows.h>
+  #  include "local.h"  // trailing comment
+#include_next <stdio.h>
+int x; #include <not_at_line_start.h>
+/* note */ #include <after_comment.h>
+typedef int INT;
+'''
+
+COMMENTED = '''\
+/* Usage:
+#include <example.h>
+*/
+// #include <other.h>
+const char *s = "#include <string.h>";
+'''
+
+
+def legacy_wrap(pre_macros, post_macros, data):
+    # The substitution replace_3.worker used before includes came from the lexer
+    include_match = r"""
+        ^       # Beginning of line
+        [ \t]*  # Spaces
+        [#]     # Macro start
+        [ \t]*  # Spaces
+        include
+        [ \t]*  # Spaces
+        (
+            (<[^>]+>) |
+            ("[^"]+")
+        )
+    """
+    include_replacement = replace_3.strip_lines(r"""
+        //INCLUDE_MARKER
+        {pre_macros}
+        \g<0>
+        {post_macros}
+        //INCLUDE_MARKER
+    """.format(pre_macros=pre_macros, post_macros=post_macros))
+    return replace_3.to_regex(include_match).sub(include_replacement, data)
+
+
+def wrap(pre_macros, post_macros, data):
+    before = '\n'.join(('//INCLUDE_MARKER', pre_macros))
+    after = '\n'.join((post_macros, '//INCLUDE_MARKER'))
+    [(_, result)] = replace_3.wrap_includes(before, after, [('a.h', data)])
+    return result
+
+
+@pytest.mark.parametrize('pre_macros, post_macros', [
+    (PRE_MACROS, POST_MACROS),
+    ('', ''),
+])
+def test_wrap_includes_matches_legacy_substitution(pre_macros, post_macros):
+    assert wrap(pre_macros, post_macros, HEADER) == legacy_wrap(pre_macros, post_macros, HEADER)
+
+
+def test_wrap_includes_skips_comments_and_strings():
+    # The legacy regex wrapped the include in the block comment too
+    assert legacy_wrap(PRE_MACROS, POST_MACROS, COMMENTED) != COMMENTED
+    assert wrap(PRE_MACROS, POST_MACROS, COMMENTED) == COMMENTED
@@ -0,0 +1,14 @@
+from deprocessor import bench
+from deprocessor.cli import build_parser
+
+
+def test_help_starts_within_budget():
+    # The same budget `bench startup` enforces
+    budget = build_parser().parse_args(['bench', 'startup']).budget
+
+    seconds = bench.startup_time(repeat=5)
+
+    assert seconds <= budget, (
+        f"python -m deprocessor --help took {seconds * 1000:.0f} ms, "
+        f"over the {budget * 1000:.0f} ms budget"
+    )
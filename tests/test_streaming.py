@@ -0,0 +1,68 @@
+import hashlib
+import io
+
+import pytest
+
+from deprocessor import streaming
+from deprocessor.dsl import Replacement
+
+
+RULES = [
+    (r'\b (\w+) _t \b',              '$1Type'),
+    (r'(?<=struct[ ]) (\w+)',        'S_$1'),
+    (r'(?<=e\n) typedef',            'TYPEDEF'),
+    (r'foo \s+ bar',                 'foobar'),
+    (r'(?<=\w) $',                   ';'),
+    (r'\b int \b',                   'cint'),
+]
+
+
+def header(lines):
+    pieces = []
+    for index in range(lines):
+        pieces.append(f'typedef int value{index}_t; foo')
+        pieces.append(f'bar struct size{index}_t')
+        if index % 17 == 0:
+            pieces.append('x' * 300)
+    return '\n'.join(pieces) + '\n'
+
+
+def whole_file(subs, data):
+    counts = []
+    for regex, replacement in subs:
+        data, count = regex.subn(getattr(replacement, 'native', replacement), data)
+        counts.append(count)
+    return data, counts
+
+
+@pytest.mark.parametrize('window', [64, 1000, streaming.WINDOW])
+def test_stream_file_matches_whole_file(tmp_path, window):
+    subs = [Replacement(pattern, replacement, []) for pattern, replacement in RULES]
+    assert [sub.reach is not None for sub in subs] == [True, True, True, False, True, True]
+
+    data = header(200)
+    path = tmp_path / 'a.h'
+    path.write_text(data)
+    expected, expected_counts = whole_file(subs, data)
+
+    output = io.StringIO()
+    counts, digest = streaming.stream_file(subs, str(path), output, window)
+
+    assert output.getvalue() == expected
+    assert counts == expected_counts
+    assert digest == hashlib.sha256(expected.encode('utf-8')).hexdigest()
+
+
+def test_stream_file_without_rules_copies(tmp_path):
+    path = tmp_path / 'a.h'
+    path.write_text('int x;\n')
+    output = io.StringIO()
+
+    assert streaming.stream_file([], str(path), output, 4)[0] == []
+    assert output.getvalue() == 'int x;\n'
+
+
+def test_passes_group_streamed_rules():
+    subs = [Replacement(pattern, replacement, []) for pattern, replacement in RULES]
+
+    assert streaming.passes(subs) == [(True, [0, 1, 2]), (False, [3]), (True, [4, 5])]
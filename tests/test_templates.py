@@ -0,0 +1,67 @@
+import pytest
+import regex
+
+from deprocessor import templates
+
+
+MATCH = regex.compile(r'(?P<name>\w+)=(\w+)(x)?').match('key=value')
+
+
+def test_plain_text_compiles_to_a_string():
+    assert templates.compile_template('plain text') == 'plain text'
+    assert templates.compile_template('cost: $$5') == 'cost: $5'
+    assert templates.compile_template(r'a\tb\x41') == 'a\tbA'
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('$2 <- $1',          'value <- key'),
+    ('${2}_${name}',      'value_key'),
+    (r'\2 \g<name>',      'value key'),
+    (r'\g<2>\n',          'value\n'),
+    ('$$$1$$',            '$key$'),
+    ('{$1}',              '{key}'),
+    ('[$3]',              '[]'),
+])
+def test_template_expands_like_match_expand(text, expected):
+    template = templates.compile_template(text)
+
+    assert isinstance(template, templates.Template)
+    assert template(MATCH) == expected
+
+
+@pytest.mark.parametrize('text', [
+    '$2 <- $1',
+    '${2}_${name}',
+    r'\2 \g<name>',
+    '$$$1$$',
+    r'a\\b $1',
+    '{$1}',
+])
+def test_native_form_expands_the_same(text):
+    template = templates.compile_template(text)
+    pattern = regex.compile(r'(?P<name>\w+)=(\w+)')
+    data = 'a=b, c\\d=e'
+
+    assert pattern.sub(template.native, data) == pattern.sub(template, data)
+
+
+def test_literal_backslash_is_kept():
+    template = templates.compile_template(r'a\;b')
+
+    assert isinstance(template, templates.Template)
+    assert template(MATCH) == r'a\;b'
+
+
+def test_bad_escape_is_rejected():
+    with pytest.raises(ValueError):
+        templates.compile_template(r'\q')
+
+
+def test_check_reports_missing_groups():
+    pattern = regex.compile(r'(?P<name>\w+)')
+    templates.check(templates.compile_template('$1 ${name}'), pattern)
+
+    with pytest.raises(ValueError):
+        templates.check(templates.compile_template('$2'), pattern)
+    with pytest.raises(ValueError):
+        templates.check(templates.compile_template('${other}'), pattern)
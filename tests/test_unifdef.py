@@ -0,0 +1,111 @@
+import pytest
+
+from deprocessor import unifdef
+
+
+KNOWN = unifdef.macros(
+    ['WIN32', 'WINVER=0x0601', 'MAKE(x)=x'],
+    ['_MSC_VER'],
+)
+
+
+def test_macros():
+    assert KNOWN == {'WIN32': '1', 'WINVER': '0x0601', 'MAKE': unifdef.FUNCTION, '_MSC_VER': None}
+
+
+@pytest.mark.parametrize('condition, value', [
+    ('defined(WIN32)',                  True),
+    ('!defined WIN32',                  False),
+    ('defined(_MSC_VER)',               False),
+    ('_MSC_VER >= 1200',                False),
+    ('WINVER >= 0x0600 && WIN32',       True),
+    ('WINVER < 0x0600 || defined(X)',   None),
+    ('OTHER',                           None),
+    ('defined(MAKE)',                   True),
+    ('WIN32 /* comment */ ? 2 : 0',     True),
+])
+def test_evaluate(condition, value):
+    assert unifdef.evaluate(condition, KNOWN) is value
+
+
+def test_removes_dead_branches():
+    text = '''\
+a
+#ifdef WIN32
+win
+#else
+other
+#endif
+#if defined(_MSC_VER)
+msc
+#elif WINVER >= 0x0600
+vista
+#endif
+b
+'''
+    assert unifdef.unifdef(text, KNOWN) == ('a\nwin\nvista\nb\n', 3)
+
+
+def test_keeps_unknown_conditions():
+    text = '''\
+#if defined(UNICODE)
+wide
+#elif WIN32
+narrow
+#else
+none
+#endif
+#ifndef _MSC_VER
+gcc
+#endif
+'''
+    assert unifdef.unifdef(text, KNOWN) == ('''\
+#if defined(UNICODE)
+wide
+#else
+narrow
+#endif
+gcc
+''', 2)
+
+
+def test_unknown_elif_opens_the_group():
+    text = '''\
+#if _MSC_VER
+msc
+#elif defined(UNICODE)
+wide
+#else
+narrow
+#endif
+'''
+    assert unifdef.unifdef(text, KNOWN) == ('''\
+#if defined(UNICODE)
+wide
+#else
+narrow
+#endif
+''', 1)
+
+
+def test_tracks_redefinitions():
+    text = '''\
+#undef WIN32
+#ifdef WIN32
+win
+#endif
+'''
+    assert unifdef.unifdef(text, KNOWN) == ('#undef WIN32\n', 1)
+
+
+def test_leaves_unbalanced_headers_alone():
+    text = '#ifdef WIN32\nwin\n'
+
+    assert unifdef.unifdef(text, KNOWN) == (text, 0)
+    assert unifdef.unifdef(text, KNOWN, partial=True) == ('win\n', 1)
+
+
+def test_ignores_directives_in_comments():
+    text = '/*\n#ifdef WIN32\n*/\nx\n#ifdef WIN32\nwin\n#endif\n'
+
+    assert unifdef.unifdef(text, KNOWN) == ('/*\n#ifdef WIN32\n*/\nx\nwin\n', 1)